@@ -1,13 +1,35 @@
 import requests
 import re
+import argparse
+import sqlite3
 import json
+import codecs
+import asyncio
 import os
+import hashlib
+import heapq
+import random
+import struct
 import sys
 import subprocess
+import tempfile
+from urllib.parse import urlsplit
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 from tqdm import tqdm
 
+try:
+    import aiohttp
+except ImportError:  # 未安装 aiohttp 时只能使用线程版下载引擎
+    aiohttp = None
+
+try:
+    import xxhash
+except ImportError:  # 未安装 xxhash 时下载库索引使用 hashlib.blake2b
+    xxhash = None
+
 # ---- 全局常量和配置 ----
 HEADERS = {
     "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36 Edg/131.0.0.0",
@@ -19,6 +41,161 @@ QUALITY_MAP = {
     127: '8K 超高清', 120: '4K 超清', 116: '1080P 60帧', 112: '1080P 高码率',
     80: '1080P 高清', 74: '720P 60帧', 64: '720P 高清', 32: '480P 清晰', 16: '360P 流畅'
 }
+# 分段下载设置：并行连接数、每段最小字节数、单段失败重试次数
+DOWNLOAD_SEGMENTS = 8
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+SEGMENT_RETRIES = 3
+# 镜像竞速：下载前用小段 Range 请求测速 baseUrl 和各 backupUrl，分段分摊到多个镜像，低速时中途切换
+MIRROR_RACING = True
+MIRROR_PROBE_BYTES = 256 * 1024
+MIRROR_PROBE_TIMEOUT = 5
+MIRROR_MIN_SPEED = 256 * 1024           # 单个分段低于该速度 (B/s) 时切换到下一个镜像
+MIRROR_CHECK_WINDOW = 5.0               # 测速窗口（秒）
+MIRROR_MAX_SWITCHES = 3                 # 单个分段因低速切换镜像的最多次数
+# 断点续传：未完成的分片保存在程序目录下的隐藏文件夹中，并用旁路日志记录已完成的字节区间
+RESUME_DOWNLOADS = True
+PARTIAL_DIR_NAME = '.bili_partial'
+JOURNAL_FLUSH_INTERVAL = 2.0
+# 批量流水线：同时下载的视频数、同时运行的 ffmpeg 合并数
+MAX_CONCURRENT_DOWNLOADS = 2
+MAX_CONCURRENT_MUXES = 1
+# 流式合并：边下载边通过命名管道送入 ffmpeg，不写临时 .m4s 文件（仅 macOS / Linux，且不支持断点续传）
+STREAMING_MUX = False
+# 本地合并：音视频均为 fMP4（H.264/HEVC/AV1 + AAC）时直接拼接分片，不启动 ffmpeg；其它情况自动退回 ffmpeg
+LOCAL_REMUX = True
+# 视频信息缓存：按BV号缓存标题和DASH流列表，重复运行时无需联网即可判断文件是否已存在
+METADATA_CACHE_FILE = '.bili_metadata.json'
+METADATA_CACHE_TTL = 7 * 24 * 3600      # 标题和流列表保留时间
+STREAM_URL_TTL = 3600                   # 链接中没有 deadline 参数时，假定的有效期
+STREAM_URL_MARGIN = 300                 # 距离过期不足该秒数的链接视为已失效
+METADATA_FLUSH_INTERVAL = 30.0
+# 链接展开：多P视频、合集/系列、收藏夹在下载前展开为单个视频，并发请求的数量
+EXPAND_CONCURRENCY = 8
+# 持久化任务队列：非交互模式下任务状态保存在 SQLite 中，程序重启后从断点继续
+QUEUE_DB_FILE = '.bili_queue.db'
+# 下载库索引：记录已下载文件的BV号、清晰度、大小和抽样哈希，用于跳过判断、完整性校验和查找重复
+LIBRARY_DB_FILE = '.bili_library.db'
+LIBRARY_HASH_CHUNK = 1024 * 1024
+# 性能统计：每个视频各阶段耗时和各流的吞吐量以 JSON Lines 追加到该文件，批量结束时打印汇总报告
+METRICS_FILE = '.bili_metrics.jsonl'
+# 异步引擎：安装了 aiohttp 时使用，整批任务共用一个长连接池
+USE_ASYNC_ENGINE = True
+ASYNC_MAX_CONNECTIONS = 64
+ASYNC_MAX_CONNECTIONS_PER_HOST = 16
+# 请求调度：每个主机一个令牌桶限速，页面/接口和CDN分别使用下面的 (每秒请求数, 突发请求数)
+PAGE_RATE_LIMIT = (2.0, 4)
+CDN_RATE_LIMIT = (20.0, 40)
+PAGE_HOST_SUFFIX = 'bilibili.com'
+# 可重试的状态码按指数退避（带随机抖动）重试；412/429 表示被限流，同时触发全局降速
+RETRY_STATUS_CODES = (412, 429, 500, 502, 503, 504)
+THROTTLE_STATUS_CODES = (412, 429)
+THROTTLE_API_CODES = (-412, -509, -799)  # 接口以 HTTP 200 返回的“请求过于频繁”错误码
+REQUEST_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# 熔断：被限流后所有请求暂停 THROTTLE_COOLDOWN 秒，限速减半；之后每次成功请求逐步恢复
+THROTTLE_COOLDOWN = 15.0
+MIN_RATE_FACTOR = 0.125
+RATE_RECOVERY_STEP = 0.02
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数，burst 为桶容量。reserve() 预订一个令牌并返回需要等待的秒数。"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self, factor=1.0):
+        """按 rate * factor 的速度补充令牌后取走一个，令牌不足时允许透支，由调用方等待相应时间。"""
+        now = time.monotonic()
+        rate = self.rate * factor
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / rate if self.tokens < 0 else 0.0
+
+
+class RequestGovernor:
+    """
+    全部请求共用的调度器：按主机限速，遇到限流时熔断并降低全局速率，之后随成功请求逐步恢复。
+    同步请求经 GovernedAdapter 接入，异步请求经 governed_request 接入。
+    """
+    def __init__(self):
+        self.buckets = {}
+        self.rate_factor = 1.0
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, url):
+        """预订一次对 url 的请求，返回发出请求前需要等待的秒数。"""
+        host = urlsplit(url).hostname or ''
+        with self._lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                limit = PAGE_RATE_LIMIT if host.endswith(PAGE_HOST_SUFFIX) else CDN_RATE_LIMIT
+                bucket = self.buckets[host] = TokenBucket(*limit)
+            return max(bucket.reserve(self.rate_factor), self.paused_until - time.monotonic())
+
+    def wait(self, url):
+        delay = self.reserve(url)
+        if delay > 0: time.sleep(delay)
+
+    async def async_wait(self, url):
+        delay = self.reserve(url)
+        if delay > 0: await asyncio.sleep(delay)
+
+    def on_response(self, url, status):
+        """登记响应状态：限流时熔断，成功时逐步恢复速率。"""
+        with self._lock:
+            if status in THROTTLE_STATUS_CODES:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.rate_factor = max(MIN_RATE_FACTOR, self.rate_factor / 2)
+                    print(f"\n警告: {urlsplit(url).hostname} 返回 HTTP {status}（请求过于频繁），"
+                          f"暂停 {THROTTLE_COOLDOWN:.0f}s 并降速至 {self.rate_factor:.0%}")
+                self.paused_until = now + THROTTLE_COOLDOWN
+            elif status < 400 and self.rate_factor < 1.0:
+                self.rate_factor = min(1.0, self.rate_factor + RATE_RECOVERY_STEP)
+
+    @staticmethod
+    def backoff(attempt, retry_after=None):
+        """第 attempt 次重试前的等待秒数：指数增长并带随机抖动，服务器给出 Retry-After 时不少于该值。"""
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+        if retry_after and str(retry_after).isdigit():
+            delay = max(delay, min(BACKOFF_MAX, int(retry_after)))
+        return delay
+
+
+GOVERNOR = RequestGovernor()
+
+
+class GovernedAdapter(requests.adapters.HTTPAdapter):
+    """每次发送前经 GOVERNOR 限速，遇到可重试的状态码时退避后重新发送。"""
+    def send(self, request, **kwargs):
+        for attempt in range(REQUEST_RETRIES + 1):
+            GOVERNOR.wait(request.url)
+            response = super().send(request, **kwargs)
+            GOVERNOR.on_response(request.url, response.status_code)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == REQUEST_RETRIES:
+                return response
+            delay = GOVERNOR.backoff(attempt, response.headers.get('Retry-After'))
+            response.close()
+            time.sleep(delay)
+
+
+def create_session():
+    """创建带连接池的 requests.Session，所有同步请求复用长连接，避免每次重新握手。"""
+    session = requests.Session()
+    pool_size = DOWNLOAD_SEGMENTS * 2 * (MAX_CONCURRENT_DOWNLOADS + MAX_CONCURRENT_MUXES)
+    adapter = GovernedAdapter(pool_connections=8, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+SESSION = create_session()
 
 
 # ---- 辅助函数 ----
@@ -39,47 +216,389 @@ def get_ffmpeg_path():
         return 'ffmpeg'
 
 
-def download_with_threading(url, filename, headers):
-    """多线程下载函数，带Tqdm进度条。"""
+def get_program_dir():
+    """获取程序所在目录：打包后为可执行文件所在目录，否则为脚本所在目录。"""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def get_media_key(url):
+    """从URL中提取稳定的视频标识（BV号，多P视频附带分P序号），提取失败返回 None。"""
+    match = re.search(r'BV[0-9A-Za-z]{10}', url)
+    if not match: return None
+    page = re.search(r'[?&]p=(\d+)', url)
+    if page and int(page.group(1)) > 1:
+        return f"{match.group(0)}_p{page.group(1)}"
+    return match.group(0)
+
+
+def split_ranges(total_size, segments, offset=0):
+    """按 content-length 把文件切分为若干闭区间 (start, end)，offset 为起始字节位置。"""
+    segments = max(1, min(segments, -(-total_size // MIN_SEGMENT_SIZE)))
+    step = -(-total_size // segments)
+    return [(offset + start, offset + min(start + step, total_size) - 1) for start in range(0, total_size, step)]
+
+
+class DownloadJournal:
+    """
+    断点续传日志：以 JSON 旁路文件记录某个分片文件中已写入磁盘的字节区间。
+    区间为闭区间 [start, end]，写入后自动合并；保存采用“写临时文件再替换”，避免日志损坏。
+    """
+
+    def __init__(self, path, total_size):
+        self.path = path
+        self.total_size = total_size
+        self.done = []
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('total_size') == total_size:
+                self.done = [tuple(r) for r in saved.get('done', [])]
+        except (OSError, ValueError):
+            pass
+
+    @property
+    def done_bytes(self):
+        return sum(end - start + 1 for start, end in self.done)
+
+    def missing(self):
+        """返回尚未下载的字节区间列表。"""
+        gaps, pos = [], 0
+        for start, end in self.done:
+            if start > pos: gaps.append((pos, start - 1))
+            pos = max(pos, end + 1)
+        if pos < self.total_size: gaps.append((pos, self.total_size - 1))
+        return gaps
+
+    def add(self, start, end):
+        """登记一个已写入的区间，并按 JOURNAL_FLUSH_INTERVAL 节流落盘。"""
+        with self._lock:
+            merged = []
+            for r_start, r_end in sorted(self.done + [(start, end)]):
+                if merged and r_start <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], r_end))
+                else:
+                    merged.append((r_start, r_end))
+            self.done = merged
+            if time.time() - self._last_flush >= JOURNAL_FLUSH_INTERVAL:
+                self._save_locked()
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'total_size': self.total_size, 'done': self.done}, f)
+        os.replace(tmp_path, self.path)
+        self._last_flush = time.time()
+
+    def mark_complete(self):
+        """整个文件已下载完成。日志保留到合并成功后随分片一起删除，合并失败时下次运行可直接跳过该流。"""
+        with self._lock:
+            self.done = [(0, self.total_size - 1)] if self.total_size > 0 else []
+            self._save_locked()
+
+    def remove(self):
+        if os.path.exists(self.path): os.remove(self.path)
+
+
+def remove_partial(filename):
+    """删除分片文件及其续传日志。"""
+    for path in (filename, filename + '.journal'):
+        if os.path.exists(path): os.remove(path)
+
+
+def get_stream_mirrors(stream):
+    """返回DASH流的全部镜像链接：baseUrl 在前，随后是 backupUrl 列表（去重）。"""
+    urls = [stream['baseUrl']] + list(stream.get('backupUrl') or stream.get('backup_url') or [])
+    return list(dict.fromkeys(urls))
+
+
+class MirrorPool:
+    """
+    一个文件的候选镜像（按测速结果从快到慢排列），并统计每个镜像实际下载的字节数和耗时。
+    分段按序号轮流分配到各镜像；某个镜像出错或低速时，分段切换到下一个镜像。
+    """
+
+    def __init__(self, urls):
+        self.urls = list(urls)
+        self.stats = {url: [0, 0.0] for url in self.urls}
+        self.retries = 0
+        self.switches = 0
+        self.head_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def pick(self, index):
+        return self.urls[index % len(self.urls)]
+
+    def next_after(self, url):
+        return self.urls[(self.urls.index(url) + 1) % len(self.urls)]
+
+    def record(self, url, nbytes, seconds):
+        with self._lock:
+            self.stats[url][0] += nbytes
+            self.stats[url][1] += seconds
+
+    def record_retry(self, switched=False):
+        """登记一次出错重试（switched=True 表示因低速切换镜像）。"""
+        with self._lock:
+            if switched: self.switches += 1
+            else: self.retries += 1
+
+    @property
+    def total_bytes(self):
+        return sum(nbytes for nbytes, _ in self.stats.values())
+
+    @staticmethod
+    def is_slow(nbytes, seconds):
+        return seconds >= MIRROR_CHECK_WINDOW and nbytes / seconds < MIRROR_MIN_SPEED
+
+    def summary(self):
+        """每个实际使用过的镜像：主机名、下载量、平均速度。"""
+        parts = []
+        for url in self.urls:
+            nbytes, seconds = self.stats[url]
+            if nbytes:
+                speed = nbytes / seconds / 1024 / 1024 if seconds > 0 else 0.0
+                parts.append(f"{urlsplit(url).netloc} {nbytes / 1024 / 1024:.1f}MB @ {speed:.2f}MB/s")
+        return '；'.join(parts) or '无'
+
+
+def probe_mirror(url, headers):
+    """下载开头 MIRROR_PROBE_BYTES 字节测速，返回 B/s，失败返回 0。"""
+    start = time.perf_counter()
+    received = 0
+    try:
+        probe_headers = {**headers, 'Range': f'bytes=0-{MIRROR_PROBE_BYTES - 1}'}
+        with SESSION.get(url, headers=probe_headers, stream=True, timeout=MIRROR_PROBE_TIMEOUT) as resp:
+            if resp.status_code not in (200, 206): return 0
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                received += len(chunk)
+                if received >= MIRROR_PROBE_BYTES: break
+    except requests.exceptions.RequestException:
+        return 0
+    return received / max(time.perf_counter() - start, 1e-6)
+
+
+def rank_mirrors(urls, headers):
+    """同时对所有镜像测速，按速度从快到慢排序；全部测速失败时保持原顺序。"""
+    if len(urls) <= 1: return list(urls)
+    speeds = {}
+
+    def probe_worker(url):
+        speeds[url] = probe_mirror(url, headers)
+
+    workers = [threading.Thread(target=probe_worker, args=(url,)) for url in urls]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+    ranked = sorted((url for url in urls if speeds[url] > 0), key=lambda url: speeds[url], reverse=True)
+    return ranked or list(urls)
+
+
+def best_mirror_url(stream):
+    """单连接场景（如流式合并）下使用的链接：开启镜像竞速时取测速最快的镜像。"""
+    if not MIRROR_RACING: return stream['baseUrl']
+    return rank_mirrors(get_stream_mirrors(stream), HEADERS)[0]
+
+
+def probe_range_support(url, headers):
+    """用 Range: bytes=0-0 试探服务器是否支持分段请求（返回206才算支持）。"""
+    try:
+        with SESSION.get(url, headers={**headers, 'Range': 'bytes=0-0'}, stream=True, timeout=10) as resp:
+            return resp.status_code == 206
+    except requests.exceptions.RequestException:
+        return False
+
+
+_pwrite_lock = threading.Lock()
+
+
+def pwrite(fd, data, offset):
+    """在指定偏移处写入数据，多个线程可同时写同一个文件。"""
+    if hasattr(os, 'pwrite'):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view, offset = view[written:], offset + written
+    else:
+        # Windows 没有 os.pwrite，退化为加锁的 seek + write
+        with _pwrite_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+
+
+def download_segmented(pool, filename, headers, total_size, ranges, pbar, journal=None):
+    """
+    多线程分段下载：每个线程用 Range 请求一个区间，并写入预分配文件的对应偏移。
+    分段轮流分配到 pool 中的各个镜像，出错或低于 MIRROR_MIN_SPEED 时换下一个镜像继续。
+    传入 journal 时，每写完一块就登记到断点续传日志中。
+    """
+    fd = os.open(filename, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0))
     try:
-        head_resp = requests.head(url, headers=headers, timeout=10)
+        os.ftruncate(fd, total_size)
+        results = [False] * len(ranges)
+
+        def segment_worker(index, start, end):
+            pos = start
+            url = pool.pick(index)
+            attempt = switches = 0
+            while attempt < SEGMENT_RETRIES:
+                slow = False
+                window_start, window_bytes = time.perf_counter(), 0
+                try:
+                    seg_headers = {**headers, 'Range': f'bytes={pos}-{end}'}
+                    with SESSION.get(url, headers=seg_headers, stream=True, timeout=20) as response:
+                        if response.status_code != 206:
+                            raise IOError(f"服务器未按Range返回数据 (HTTP {response.status_code})")
+                        for chunk in response.iter_content(chunk_size=1024 * 1024):
+                            if not chunk: continue
+                            chunk = chunk[:end + 1 - pos]
+                            pwrite(fd, chunk, pos)
+                            if journal: journal.add(pos, pos + len(chunk) - 1)
+                            pos += len(chunk)
+                            pbar.update(len(chunk))
+                            window_bytes += len(chunk)
+                            if pos > end: break
+                            elapsed = time.perf_counter() - window_start
+                            if elapsed >= MIRROR_CHECK_WINDOW:
+                                pool.record(url, window_bytes, elapsed)
+                                slow = pool.is_slow(window_bytes, elapsed) and len(pool.urls) > 1 \
+                                    and switches < MIRROR_MAX_SWITCHES
+                                window_start, window_bytes = time.perf_counter(), 0
+                                if slow: break
+                    pool.record(url, window_bytes, time.perf_counter() - window_start)
+                    if pos > end:
+                        results[index] = True
+                        return
+                    if slow:
+                        switches += 1
+                        pool.record_retry(switched=True)
+                        url = pool.next_after(url)
+                        continue
+                    raise IOError("连接提前结束")
+                except (requests.exceptions.RequestException, IOError) as e:
+                    attempt += 1
+                    pool.record_retry()
+                    print(f"\n分段 {index + 1} 第 {attempt}/{SEGMENT_RETRIES} 次尝试出错: {e}")
+                    url = pool.next_after(url)
+                    time.sleep(GOVERNOR.backoff(attempt))
+
+        workers = [threading.Thread(target=segment_worker, args=(i, start, end)) for i, (start, end) in enumerate(ranges)]
+        for worker in workers: worker.start()
+        for worker in workers: worker.join()
+    finally:
+        os.close(fd)
+        if journal: journal.save()
+    return all(results)
+
+
+def plan_ranges(filename, total_size, segments, resume):
+    """
+    规划需要下载的字节区间，返回 (ranges, journal)。
+    续传模式下只为续传日志中缺失的部分分段；journal 不为 None 且 ranges 为空表示文件已完整。
+    """
+    if total_size <= 0: return [], None
+    if not resume: return split_ranges(total_size, segments), None
+
+    journal = DownloadJournal(filename + '.journal', total_size)
+    if not os.path.exists(filename): journal.done = []
+    gaps = journal.missing()
+    missing_size = sum(end - start + 1 for start, end in gaps)
+    ranges = [r for start, end in gaps
+              for r in split_ranges(end - start + 1, max(1, round(segments * (end - start + 1) / missing_size)), start)]
+    return ranges, journal
+
+
+def download_with_threading(url, filename, headers, segments=None, resume=False, mirrors=None, metrics=None):
+    """
+    多线程下载函数，带Tqdm进度条。服务器支持Range时分段并行下载，否则退化为单连接流式下载。
+    resume=True 时使用 '<filename>.journal' 记录进度，下次调用只补齐缺失的字节区间。
+    mirrors 为同一文件的多个镜像链接，测速后分段分摊到各镜像，完成后打印各镜像的下载量和速度。
+    传入 metrics (VideoMetrics) 时记录该流的字节数、耗时、吞吐量和重试次数。
+    """
+    started = time.perf_counter()
+    pool = MirrorPool(rank_mirrors(mirrors, headers) if mirrors else [url])
+    try:
+        return download_from_pool(pool, filename, headers, segments or DOWNLOAD_SEGMENTS, resume)
+    finally:
+        if metrics: metrics.add_stream(os.path.basename(filename).split('.')[0], pool, time.perf_counter() - started)
+
+
+def download_from_pool(pool, filename, headers, segments, resume):
+    """download_with_threading 的实际下载过程，pool 为已测速排序的镜像。"""
+    url = pool.urls[0]
+    name = os.path.basename(filename).split('.')[0]
+    head_started = time.perf_counter()
+    try:
+        head_resp = SESSION.head(url, headers=headers, timeout=10)
         head_resp.raise_for_status()
         total_size = int(head_resp.headers.get('content-length', 0))
     except requests.exceptions.RequestException:
         try:
-            response = requests.get(url, headers=headers, stream=True, timeout=10)
+            response = SESSION.get(url, headers=headers, stream=True, timeout=10)
             response.raise_for_status()
             total_size = int(response.headers.get('content-length', 0))
+            response.close()
         except requests.exceptions.RequestException as e:
             print(f"\n无法获取文件大小: {e}")
             return False
+    finally:
+        pool.head_seconds += time.perf_counter() - head_started
 
     if total_size == 0:
         print("\n警告: 无法获取文件大小，进度条将不可用。")
 
-    pbar = tqdm(total=total_size, unit='iB', unit_scale=True, desc=os.path.basename(filename).split('.')[0])
+    ranges, journal = plan_ranges(filename, total_size, segments, resume)
+    if journal and not ranges:
+        print(f"\n'{os.path.basename(filename)}' 已在上次完整下载，跳过。")
+        return True
+
+    pbar = tqdm(total=total_size, unit='iB', unit_scale=True, desc=name)
+
+    if (journal or len(ranges) > 1) and probe_range_support(url, headers):
+        if journal and journal.done:
+            pbar.update(journal.done_bytes)
+            print(f"\n检测到未完成的下载，从已完成的 {journal.done_bytes / total_size:.1%} 处继续。")
+        download_success = download_segmented(pool, filename, headers, total_size, ranges, pbar, journal)
+        pbar.close()
+        print(f"\n{name} 镜像统计: {pool.summary()}")
+        if not download_success: return False
+        return os.path.getsize(filename) == total_size
+
+    if journal:
+        # 服务器不支持 Range，无法续传，只能从头下载
+        journal.remove()
 
     download_success = True
 
     def download_worker():
         nonlocal download_success
+        started, received = time.perf_counter(), 0
         try:
-            response = requests.get(url, headers=headers, stream=True, timeout=20)
+            response = SESSION.get(url, headers=headers, stream=True, timeout=20)
             response.raise_for_status()
             with open(filename, 'wb') as f:
                 for chunk in response.iter_content(chunk_size=1024 * 1024):
                     if chunk:
                         f.write(chunk)
+                        received += len(chunk)
                         pbar.update(len(chunk))
         except requests.exceptions.RequestException as e:
             pbar.close()
             print(f"\n下载线程出错: {e}")
             download_success = False
+        pool.record(url, received, time.perf_counter() - started)
 
     downloader_thread = threading.Thread(target=download_worker)
     downloader_thread.start()
     downloader_thread.join()
     pbar.close()
+    print(f"\n{name} 镜像统计: {pool.summary()}")
 
     if not download_success: return False
 
@@ -88,116 +607,1126 @@ def download_with_threading(url, filename, headers):
         if final_size < total_size:
             print(f"\n警告: 文件下载不完整! 期望大小: {total_size}, 实际大小: {final_size}")
             return False
+        if journal: journal.mark_complete()
 
     return os.path.exists(filename)
 
 
-# ---- 核心处理逻辑：处理单个视频 ----
-def process_single_video(url, preferred_quality_id):
-    """处理单个视频的下载和合并。返回 True 表示成功，False 表示失败。"""
-    temp_video_file = f"temp_video_{os.getpid()}.m4s"
-    temp_audio_file = f"temp_audio_{os.getpid()}.m4s"
+def download_streams(tasks, resume=False, metrics=None):
+    """同时下载多个流。tasks 为 [(名称, DASH流, 文件名), ...]，返回下载失败的流名称列表。"""
+    results = {}
+
+    def stream_worker(name, stream, filename):
+        mirrors = get_stream_mirrors(stream) if MIRROR_RACING else None
+        results[name] = download_with_threading(stream['baseUrl'], filename, HEADERS, resume=resume, mirrors=mirrors,
+                                                metrics=metrics)
+
+    workers = [threading.Thread(target=stream_worker, args=task) for task in tasks]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+    return [name for name, _, _ in tasks if not results.get(name)]
 
+
+# ---- 流式合并：通过命名管道边下载边合并 ----
+def unblock_fifo(path):
+    """以非阻塞方式打开并关闭管道读端，让卡在 open() 上的写入线程得以返回。"""
     try:
-        print(f"\n{'=' * 20}\n正在处理URL: {url}")
-        res = requests.get(url, headers=HEADERS, timeout=15).text
+        os.close(os.open(path, os.O_RDONLY | os.O_NONBLOCK))
+    except OSError:
+        pass
+
 
-        # 1. 解析视频标题和ID
+def stream_mux(video_url, audio_url, output_file, headers):
+    """
+    流式合并：视频流和音频流各用一个线程下载，并直接写入 ffmpeg 读取的命名管道，
+    下载结束时合并也随即完成，磁盘上只会出现最终的 .mp4。返回 True 表示成功。
+    """
+    fifo_dir = tempfile.mkdtemp(prefix='bili_fifo_')
+    video_fifo = os.path.join(fifo_dir, 'video.m4s')
+    audio_fifo = os.path.join(fifo_dir, 'audio.m4s')
+    os.mkfifo(video_fifo)
+    os.mkfifo(audio_fifo)
+    command = [get_ffmpeg_path(), '-i', video_fifo, '-i', audio_fifo, '-c', 'copy', '-y', output_file]
+    errors = []
+
+    try:
+        try:
+            proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            print_ffmpeg_not_found()
+            return False
+
+        def pipe_worker(name, url, fifo_path):
+            try:
+                with SESSION.get(url, headers=headers, stream=True, timeout=20) as response:
+                    response.raise_for_status()
+                    total_size = int(response.headers.get('content-length', 0))
+                    with tqdm(total=total_size, unit='iB', unit_scale=True, desc=name) as pbar, \
+                            open(fifo_path, 'wb') as fifo:
+                        for chunk in response.iter_content(chunk_size=1024 * 1024):
+                            if chunk:
+                                fifo.write(chunk)
+                                pbar.update(len(chunk))
+            except (requests.exceptions.RequestException, OSError) as e:
+                errors.append(f"{name}: {e}")
+                # 任意一路出错就终止 ffmpeg，另一路随后会因管道断开而退出
+                proc.kill()
+
+        workers = [threading.Thread(target=pipe_worker, args=('视频流', video_url, video_fifo)),
+                   threading.Thread(target=pipe_worker, args=('音频流', audio_url, audio_fifo))]
+        for worker in workers: worker.start()
+        returncode = proc.wait()
+        # ffmpeg 退出后，尚未结束的写入线程可能卡在 open() 上，反复解除阻塞直到全部退出
+        while any(worker.is_alive() for worker in workers):
+            unblock_fifo(video_fifo)
+            unblock_fifo(audio_fifo)
+            for worker in workers: worker.join(timeout=0.2)
+
+        if errors or returncode != 0:
+            print(f"\n错误: 流式合并失败: {'; '.join(errors) or f'ffmpeg 返回码 {returncode}'}")
+            if os.path.exists(output_file): os.remove(output_file)
+            return False
+        return True
+    finally:
+        for path in (video_fifo, audio_fifo):
+            if os.path.exists(path): os.remove(path)
+        os.rmdir(fifo_dir)
+
+
+# ---- 视频信息缓存 ----
+class MetadataCache:
+    """
+    按视频标识（BV号，多P附带分P序号）缓存标题、DASH流列表和抓取时间，持久化为程序目录下的 JSON 文件。
+    条目超过 METADATA_CACHE_TTL 被淘汰；流链接带签名，按其 deadline 参数单独判断是否仍可直接用于下载。
+    展开链接时获取的分P列表也按BV号缓存（键为 'parts:' + BV号），重复运行同一批链接时不再逐个请求分P接口。
+    """
+    STREAM_FIELDS = ('id', 'codecid', 'height', 'bandwidth', 'baseUrl', 'backupUrl')
+    PARTS_PREFIX = 'parts:'
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_flush = time.time()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self.evict()
+
+    @staticmethod
+    def url_deadline(url, fetched_at):
+        match = re.search(r'[?&]deadline=(\d+)', url)
+        return int(match.group(1)) if match else fetched_at + STREAM_URL_TTL
+
+    def evict(self):
+        """淘汰超过 METADATA_CACHE_TTL 的条目。"""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self.entries.items() if now - entry['fetched_at'] > METADATA_CACHE_TTL]
+            for key in expired: del self.entries[key]
+            self._dirty = self._dirty or bool(expired)
+
+    def get(self, key):
+        """返回 (title, video_streams, audio_streams, urls_fresh)，未命中返回 None。"""
+        with self._lock:
+            entry = self.entries.get(key)
+        if not entry or time.time() - entry['fetched_at'] > METADATA_CACHE_TTL: return None
+        deadline = min(self.url_deadline(stream['baseUrl'], entry['fetched_at'])
+                       for stream in entry['video'] + entry['audio'])
+        urls_fresh = time.time() < deadline - STREAM_URL_MARGIN
+        return entry['title'], [dict(v) for v in entry['video']], [dict(a) for a in entry['audio']], urls_fresh
+
+    def put(self, key, title, video_streams, audio_streams):
+        def slim(stream): return {k: stream[k] for k in self.STREAM_FIELDS if k in stream}
+
+        with self._lock:
+            self.entries[key] = {'title': title, 'fetched_at': time.time(),
+                                 'video': [slim(v) for v in video_streams], 'audio': [slim(a) for a in audio_streams]}
+            self._dirty = True
+            if time.time() - self._last_flush >= METADATA_FLUSH_INTERVAL:
+                self._flush_locked()
+
+    def get_parts(self, bvid):
+        """返回缓存的分P列表 [(cid, 分P序号, 分P标题), ...]，未命中返回 None。"""
+        with self._lock:
+            entry = self.entries.get(self.PARTS_PREFIX + bvid)
+        if not entry or time.time() - entry['fetched_at'] > METADATA_CACHE_TTL: return None
+        return [tuple(part) for part in entry['parts']]
+
+    def put_parts(self, bvid, parts):
+        with self._lock:
+            self.entries[self.PARTS_PREFIX + bvid] = {'fetched_at': time.time(), 'parts': [list(p) for p in parts]}
+            self._dirty = True
+            if time.time() - self._last_flush >= METADATA_FLUSH_INTERVAL:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            if self._dirty: self._flush_locked()
+
+    def _flush_locked(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._last_flush = time.time()
+
+
+_metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    """获取全局视频信息缓存（首次调用时从磁盘加载）。"""
+    global _metadata_cache
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            _metadata_cache = MetadataCache(os.path.join(get_program_dir(), METADATA_CACHE_FILE))
+        return _metadata_cache
+
+
+def check_cached_video(url, media_key, preferred_quality_id):
+    """
+    联网之前先用缓存判断输出文件是否已存在。
+    返回 (parsed, skip)：skip 为 True 表示文件已存在可直接跳过；
+    parsed 为链接仍有效的缓存 (title, video_streams, audio_streams)，可省去页面请求，否则为 None。
+    """
+    cached = get_metadata_cache().get(media_key) if media_key else None
+    if not cached: return None, False
+    title, video_streams, audio_streams, urls_fresh = cached
+    selected_stream = select_video_stream(video_streams, preferred_quality_id, quiet=True)
+    output_file, _ = build_output_file(resolve_part_title(url, title), selected_stream)
+    if is_downloaded(media_key, selected_stream, output_file, note='（缓存命中）', quiet=True): return None, True
+    if not urls_fresh: return None, False
+    print("使用缓存的视频信息，跳过页面请求。")
+    return (title, video_streams, audio_streams), False
+
+
+# ---- 下载库索引：已下载文件的完整性校验与去重 ----
+def fast_hash(path, size):
+    """抽样哈希：文件大小 + 开头、中间、结尾各 LIBRARY_HASH_CHUNK 字节，大文件也只读取几MB。"""
+    digest = xxhash.xxh3_64() if xxhash is not None else hashlib.blake2b(digest_size=8)
+    digest.update(str(size).encode())
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - LIBRARY_HASH_CHUNK // 2), max(0, size - LIBRARY_HASH_CHUNK)}):
+            f.seek(offset)
+            digest.update(f.read(LIBRARY_HASH_CHUNK))
+    return digest.hexdigest()
+
+
+def mp4_is_complete(path):
+    """检查 MP4 顶层 box 是否首尾相接地覆盖整个文件且包含 moov，用于识别合并中断留下的残缺文件。"""
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            pos, kinds = 0, set()
+            while pos < file_size:
+                f.seek(pos)
+                header = f.read(16)
+                if len(header) < 8: return False
+                size, kind = struct.unpack_from('>I4s', header)
+                if size == 1 and len(header) == 16: size = struct.unpack_from('>Q', header, 8)[0]
+                elif size == 0: size = file_size - pos
+                if size < 8: return False
+                kinds.add(kind)
+                pos += size
+            return pos == file_size and b'moov' in kinds and b'ftyp' in kinds
+    except OSError:
+        return False
+
+
+class LibraryIndex:
+    """
+    保存在 SQLite 中的下载库索引：(媒体键, 清晰度ID) -> 输出路径、大小、修改时间和抽样哈希。
+    跳过判断只需一次索引查询加一次 stat；大小或哈希不符的文件视为损坏，需要重新下载。
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS library (
+                media_key TEXT NOT NULL,
+                quality INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (media_key, quality)
+            )""")
+
+    def lookup(self, media_key, quality):
+        """返回 (路径, 大小, 修改时间, 哈希)，未收录时返回 None。"""
+        with self._lock:
+            return self._conn.execute('SELECT path, size, mtime_ns, hash FROM library WHERE media_key = ? AND quality = ?',
+                                      (media_key, quality)).fetchone()
+
+    def other_qualities(self, media_key, quality):
+        """同一视频已收录的其它清晰度，返回 [(清晰度ID, 路径), ...]。"""
+        with self._lock:
+            return self._conn.execute('SELECT quality, path FROM library WHERE media_key = ? AND quality != ?',
+                                      (media_key, quality)).fetchall()
+
+    def verify(self, media_key, quality):
+        """
+        校验已收录的文件，返回 'ok' / 'missing' / 'corrupt'，未收录时返回 None。
+        大小和修改时间都没变时直接视为完好；修改时间变化时重新计算抽样哈希。
+        """
+        row = self.lookup(media_key, quality)
+        if row is None: return None
+        path, size, mtime_ns, expected_hash = row
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return 'missing'
+        if stat.st_size != size: return 'corrupt'
+        if stat.st_mtime_ns == mtime_ns: return 'ok'
+        if fast_hash(path, size) != expected_hash: return 'corrupt'
+        with self._lock:
+            self._conn.execute('UPDATE library SET mtime_ns = ? WHERE media_key = ? AND quality = ?',
+                               (stat.st_mtime_ns, media_key, quality))
+        return 'ok'
+
+    def record(self, media_key, quality, path):
+        """收录（或更新）一个已下载完成的文件。"""
+        stat = os.stat(path)
+        file_hash = fast_hash(path, stat.st_size)
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO library VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (media_key, quality, os.path.abspath(path), stat.st_size, stat.st_mtime_ns, file_hash,
+                                time.time()))
+
+    def remove(self, media_key, quality):
+        with self._lock:
+            self._conn.execute('DELETE FROM library WHERE media_key = ? AND quality = ?', (media_key, quality))
+
+    def duplicates(self):
+        """同一视频收录了多个清晰度的情况，返回 {媒体键: [(清晰度ID, 路径, 大小), ...]}。"""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT media_key, quality, path, size FROM library
+                WHERE media_key IN (SELECT media_key FROM library GROUP BY media_key HAVING COUNT(*) > 1)
+                ORDER BY media_key, quality DESC""").fetchall()
+        result = {}
+        for media_key, quality, path, size in rows:
+            result.setdefault(media_key, []).append((quality, path, size))
+        return result
+
+    def close(self):
+        self._conn.close()
+
+
+_library_index = None
+_library_index_lock = threading.Lock()
+
+
+def get_library_index():
+    """获取全局下载库索引（首次调用时打开数据库）。"""
+    global _library_index
+    with _library_index_lock:
+        if _library_index is None:
+            _library_index = LibraryIndex(os.path.join(get_program_dir(), LIBRARY_DB_FILE))
+        return _library_index
+
+
+def quarantine_file(path):
+    """把不能确认来源的残缺文件改名为 '<原文件名>.incomplete-<时间戳>'（不删除用户数据），返回新路径。"""
+    target = f"{path}.incomplete-{time.strftime('%Y%m%d%H%M%S')}"
+    os.replace(path, target)
+    return target
+
+
+def is_downloaded(media_key, stream, output_file, note='', quiet=False):
+    """
+    判断视频是否已下载完成，可以跳过。有 BV 号时查询下载库索引：文件损坏或缺失时删除记录并返回 False 以重新下载，
+    只有索引记录的路径就是本次的输出文件时才删除损坏的文件。
+    索引中没有记录但文件存在时（旧版本下载的文件），结构完整则补录索引，否则改名隔离后重新下载。
+    quiet=True 时不提示该视频已有的其它清晰度版本。
+    """
+    if media_key is None:
+        if not os.path.exists(output_file): return False
+        print(f"文件 '{output_file}' 已存在{note}，跳过下载。")
+        return True
+
+    index = get_library_index()
+    quality = stream['id']
+    for other_quality, path in [] if quiet else index.other_qualities(media_key, quality):
+        print(f"提示: 该视频已有其它清晰度的版本 ({QUALITY_MAP.get(other_quality, other_quality)}): {path}")
+    row = index.lookup(media_key, quality)
+    status = index.verify(media_key, quality)
+    if status == 'ok':
+        print(f"文件 '{output_file}' 已存在{note}，跳过下载。")
+        return True
+    if status is not None:
+        indexed_path = row[0]
+        print(f"文件 '{indexed_path}' {'已被删除' if status == 'missing' else '已损坏或不完整'}，重新下载。")
+        index.remove(media_key, quality)
+        if os.path.abspath(output_file) == indexed_path:
+            if status == 'corrupt' and os.path.exists(indexed_path): os.remove(indexed_path)
+            return False
+        # 索引记录的是另一个文件（例如标题变了），本次的输出文件按未收录处理
+    if not os.path.exists(output_file): return False
+    if not mp4_is_complete(output_file):
+        moved = quarantine_file(output_file)
+        print(f"文件 '{output_file}' 不完整（可能是合并中断留下的），已改名为 '{moved}'，重新下载。")
+        return False
+    index.record(media_key, quality, output_file)
+    print(f"文件 '{output_file}' 已存在{note}，已加入下载库索引，跳过下载。")
+    return True
+
+
+def record_download(media_key, stream, output_file):
+    """合并成功后把输出文件收录到下载库索引。"""
+    if media_key is None: return
+    try:
+        get_library_index().record(media_key, stream['id'], output_file)
+    except (OSError, sqlite3.Error) as e:
+        print(f"\n警告: 更新下载库索引失败: {e}")
+
+
+# ---- 链接展开：多P视频、合集/系列、收藏夹 ----
+API_VIDEO_PAGES = 'https://api.bilibili.com/x/player/pagelist'
+API_COLLECTION = 'https://api.bilibili.com/x/polymer/web-space/seasons_archives_list'
+API_SERIES = 'https://api.bilibili.com/x/series/archives'
+API_FAVORITES = 'https://api.bilibili.com/x/v3/fav/resource/list'
+VIDEO_URL_TEMPLATE = 'https://www.bilibili.com/video/{}'
+
+# 展开多P视频时记录的分P标题，键为 get_media_key 的结果
+part_titles = {}
+
+
+def api_get(url, params):
+    """请求B站接口并返回 data 字段，接口返回错误码时抛出 ValueError；“请求过于频繁”按限流处理后重试。"""
+    for attempt in range(REQUEST_RETRIES + 1):
+        resp = SESSION.get(url, params=params, headers=HEADERS, timeout=15)
+        resp.raise_for_status()
+        payload = resp.json()
+        if payload.get('code') not in THROTTLE_API_CODES or attempt == REQUEST_RETRIES: break
+        GOVERNOR.on_response(url, THROTTLE_STATUS_CODES[0])
+        time.sleep(GOVERNOR.backoff(attempt))
+    if payload.get('code') != 0:
+        raise ValueError(f"接口返回错误 {payload.get('code')}: {payload.get('message')}")
+    return payload.get('data') or {}
+
+
+def fetch_all_pages(fetch_page, page_size, get_total, get_items):
+    """先取第一页得到总数，其余各页并发请求，按页码顺序拼接结果。"""
+    first = fetch_page(1)
+    page_count = -(-get_total(first) // page_size)
+    with ThreadPoolExecutor(max_workers=EXPAND_CONCURRENCY) as executor:
+        rest = list(executor.map(fetch_page, range(2, page_count + 1)))
+    return [item for page in [first] + rest for item in get_items(page)]
+
+
+def list_collection_bvids(mid, season_id):
+    """合集（视频列表）中的全部BV号。"""
+    return fetch_all_pages(
+        lambda pn: api_get(API_COLLECTION, {'mid': mid, 'season_id': season_id, 'page_num': pn, 'page_size': 100}),
+        100, lambda data: data.get('page', {}).get('total', 0),
+        lambda data: [a['bvid'] for a in data.get('archives') or []])
+
+
+def list_series_bvids(mid, series_id):
+    """系列中的全部BV号。"""
+    return fetch_all_pages(
+        lambda pn: api_get(API_SERIES, {'mid': mid, 'series_id': series_id, 'pn': pn, 'ps': 100}),
+        100, lambda data: data.get('page', {}).get('total', 0),
+        lambda data: [a['bvid'] for a in data.get('archives') or []])
+
+
+def list_favorite_bvids(media_id):
+    """收藏夹中的全部视频BV号（跳过音频等非视频内容）。"""
+    return fetch_all_pages(
+        lambda pn: api_get(API_FAVORITES, {'media_id': media_id, 'pn': pn, 'ps': 20, 'platform': 'web'}),
+        20, lambda data: data.get('info', {}).get('media_count', 0),
+        lambda data: [m['bvid'] for m in data.get('medias') or [] if m.get('type') == 2 and m.get('bvid')])
+
+
+def list_video_parts(bvid):
+    """视频的分P列表 [(cid, 分P序号, 分P标题), ...]。先查视频信息缓存，未命中时请求接口并写入缓存。"""
+    cache = get_metadata_cache()
+    parts = cache.get_parts(bvid)
+    if parts is None:
+        parts = [(p['cid'], p['page'], p.get('part', '')) for p in api_get(API_VIDEO_PAGES, {'bvid': bvid})]
+        cache.put_parts(bvid, parts)
+    return parts
+
+
+def list_source_bvids(url):
+    """如果是合集/系列/收藏夹链接，返回其中的BV号列表；否则返回 None。"""
+    match = re.search(r'space\.bilibili\.com/(\d+)/(?:channel/collectiondetail\?sid=|lists/)(\d+)', url)
+    if match and 'seriesdetail' not in url and 'type=series' not in url:
+        return list_collection_bvids(*match.groups())
+    match = re.search(r'space\.bilibili\.com/(\d+)/(?:channel/seriesdetail\?sid=|lists/)(\d+)', url)
+    if match:
+        return list_series_bvids(*match.groups())
+    match = re.search(r'favlist\?.*?fid=(\d+)|/ml(\d+)', url)
+    if match:
+        return list_favorite_bvids(match.group(1) or match.group(2))
+    return None
+
+
+def resolve_part_title(url, title):
+    """URL 指定了分P (?p=N) 时，在标题后附加分P序号和分P标题，避免各分P文件名相同。"""
+    match = re.search(r'[?&]p=(\d+)', url)
+    if not match: return title
+    part = part_titles.get(get_media_key(url), '')
+    return f"{title} P{match.group(1)} {part}".strip()
+
+
+def expand_urls(urls):
+    """
+    把用户输入的链接展开为单个视频的下载链接：合集/系列/收藏夹展开为其中的全部视频，
+    多P视频展开为每一个分P。各级请求都以 EXPAND_CONCURRENCY 为上限并发执行，结果按 BV号 + cid 去重。
+    分P列表优先取自视频信息缓存，已下载过的一批链接重新运行时展开阶段不需要联网。
+    """
+    def expand_source(url):
+        try:
+            bvids = list_source_bvids(url)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"  -> 展开 {url} 失败: {e}")
+            return []
+        if bvids is None: return [url]
+        print(f"  -> {url} 共包含 {len(bvids)} 个视频")
+        return [VIDEO_URL_TEMPLATE.format(bvid) for bvid in bvids]
+
+    def expand_parts(url):
+        match = re.search(r'BV[0-9A-Za-z]{10}', url)
+        if not match: return [(url, None, None)]
+        bvid = match.group(0)
+        page_match = re.search(r'[?&]p=(\d+)', url)
+        try:
+            parts = list_video_parts(bvid)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"  -> 获取 {bvid} 的分P列表失败，按原链接下载: {e}")
+            return [(url, bvid, page_match and f"p{page_match.group(1)}")]
+
+        if page_match:
+            # 已指定分P的链接只下载该分P
+            for cid, page, part in parts:
+                if page == int(page_match.group(1)):
+                    part_titles[get_media_key(url)] = re.sub(r'[\\/:*?"<>|]', '_', part)
+                    return [(url, bvid, cid)]
+            return [(url, bvid, f"p{page_match.group(1)}")]
+        if len(parts) <= 1: return [(url, bvid, parts[0][0] if parts else None)]
+
+        expanded = []
+        for cid, page, part in parts:
+            part_url = f"{VIDEO_URL_TEMPLATE.format(bvid)}?p={page}"
+            part_titles[get_media_key(part_url)] = re.sub(r'[\\/:*?"<>|]', '_', part)
+            expanded.append((part_url, bvid, cid))
+        print(f"  -> {bvid} 共有 {len(parts)} 个分P")
+        return expanded
+
+    def source_key(url):
+        match = re.search(r'BV[0-9A-Za-z]{10}', url)
+        page_match = re.search(r'[?&]p=(\d+)', url)
+        return (match.group(0), page_match and page_match.group(1)) if match else url
+
+    with ThreadPoolExecutor(max_workers=EXPAND_CONCURRENCY) as executor:
+        video_urls = [u for expanded in executor.map(expand_source, urls) for u in expanded]
+        # 同一视频的不同写法（末尾斜杠、追踪参数等）只展开一次
+        unique_sources = {}
+        for u in video_urls: unique_sources.setdefault(source_key(u), u)
+        video_urls = list(unique_sources.values())
+        items = [item for expanded in executor.map(expand_parts, video_urls) for item in expanded]
+
+    get_metadata_cache().flush()
+    seen, result = set(), []
+    for url, bvid, cid in items:
+        key = (bvid, cid) if bvid else url
+        if key in seen: continue
+        seen.add(key)
+        result.append(url)
+    return result
+
+
+# ---- 页面解析与文件命名（线程版和异步版共用） ----
+PLAYINFO_MARKER = '<script>window.__playinfo__='
+PLAYINFO_END = '</script>'
+DASH_KEY_PATTERN = re.compile(r'"dash"\s*:\s*')
+_json_decoder = json.JSONDecoder()
+
+
+class PlayinfoExtractor:
+    """
+    增量解析视频页面：逐块喂入响应内容，找到 window.__playinfo__ 所在的 script 标签结束后即可停止读取，
+    不必把整个页面保存在内存中。只解码 data.dash 子树，其余字段（support_formats 等）不做 JSON 解析。
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._head = ''
+        self._payload = None
+        self.title = None
+        self.done = False
+
+    def feed(self, chunk):
+        """喂入一块响应内容（bytes 或 str），playinfo 已完整时返回 True。"""
+        if self.done: return True
+        text = self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+
+        if self._payload is None:
+            self._head += text
+            if self.title is None and '</title>' in self._head:
+                self.title = self._parse_title(self._head)
+            index = self._head.find(PLAYINFO_MARKER)
+            if index < 0:
+                # 只保留可能被截断的标记前缀，丢弃其余页面内容
+                if self.title is not None: self._head = self._head[-len(PLAYINFO_MARKER):]
+                return False
+            if self.title is None: self.title = self._parse_title(self._head[:index])
+            text = self._head[index + len(PLAYINFO_MARKER):]
+            self._head = ''
+            self._payload = ''
+
+        # 只在新到的内容（含可能跨块的结束标记）中查找 </script>
+        search_from = max(0, len(self._payload) - len(PLAYINFO_END))
+        self._payload += text
+        end = self._payload.find(PLAYINFO_END, search_from)
+        if end >= 0:
+            self._payload = self._payload[:end]
+            self.done = True
+        return self.done
+
+    @staticmethod
+    def _parse_title(head):
         title = ""
         try:
-            match = re.search(r'<title.*?>(.*?)_哔哩哔哩_bilibili</title>', res)
+            match = re.search(r'<title.*?>(.*?)_哔哩哔哩_bilibili</title>', head)
             if match:
                 title = match.group(1).strip()
             else:
-                match = re.search(r'<title>(.*?)</title>', res)
+                match = re.search(r'<title>(.*?)</title>', head)
                 if match: title = match.group(1).split('_哔哩哔哩_bilibili')[0].strip()
-            if not title: title = f"bilivideo_{int(time.time())}"
         except Exception:
-            title = f"bilivideo_{int(time.time())}"
+            pass
+        return title
 
-        playinfo_match = re.search(r'<script>window.__playinfo__=({.*?})</script>', res)
-        if not playinfo_match:
-            print("错误: 无法在页面中找到视频信息('window.__playinfo__')。可能是付费/地区限制视频，或URL无效。")
-            return False
+    def decode_dash(self):
+        """只解码 data.dash 子树；找不到 "dash" 键时退回完整解析 playinfo。"""
+        match = DASH_KEY_PATTERN.search(self._payload)
+        if match:
+            try:
+                return _json_decoder.raw_decode(self._payload, match.end())[0] or {}
+            except ValueError:
+                pass
+        return json.loads(self._payload).get('data', {}).get('dash') or {}
 
-        playinfo_json = json.loads(playinfo_match.group(1))
-        data_node = playinfo_json.get('data', {})
-        dash_data = data_node.get('dash', {})
+    def result(self):
+        """返回 (title, video_streams, audio_streams)，解析失败时打印原因并返回 None。"""
+        title = self.title or f"bilivideo_{int(time.time())}"
+        if not self.done:
+            print("错误: 无法在页面中找到视频信息('window.__playinfo__')。可能是付费/地区限制视频，或URL无效。")
+            return None
 
+        dash_data = self.decode_dash()
         if not dash_data:
             print("错误: 未找到DASH格式的视频流。该视频可能不支持此种下载方式。")
-            return False
+            return None
 
-        video_streams = dash_data.get('video', [])
-        audio_streams = dash_data.get('audio', [])
+        video_streams = dash_data.get('video') or []
+        audio_streams = dash_data.get('audio') or []
 
         if not video_streams or not audio_streams:
             print("错误: 视频或音频流列表为空。")
-            return False
+            return None
 
-        print(f"视频标题: {title}")
+        return title, video_streams, audio_streams
 
-        # 2. 选择视频流
-        video_streams.sort(key=lambda x: x['id'], reverse=True)
-        selected_stream = None
-        if preferred_quality_id != 0:
-            for stream in video_streams:
-                if stream['id'] == preferred_quality_id:
-                    selected_stream = stream
-                    print(f"已匹配到期望清晰度: {QUALITY_MAP.get(stream['id'], '未知')}")
-                    break
 
-        if not selected_stream:
-            selected_stream = video_streams[0]
-            print(f"未找到期望清晰度，自动选择最高可用清晰度: {QUALITY_MAP.get(selected_stream['id'], '未知')}")
+def parse_video_page(res):
+    """从完整的视频页面HTML中解析标题和DASH流列表。成功返回 (title, video_streams, audio_streams)，失败返回 None。"""
+    extractor = PlayinfoExtractor()
+    extractor.feed(res)
+    return extractor.result()
 
-        video_url = selected_stream['baseUrl']
-        audio_url = audio_streams[0]['baseUrl']
-        selected_quality_name = QUALITY_MAP.get(selected_stream['id'], f"{selected_stream.get('height')}P")
 
-        # 3. 构建文件名并下载
-        sanitized_title = re.sub(r'[\\/:*?"<>|]', '_', title)
-        sanitized_quality = re.sub(r'[\\/:*?"<>|]', '_', selected_quality_name)
-
-        # --- 这是实现目标的关键代码 ---
-        # 判断程序是作为脚本运行还是被打包了
-        if getattr(sys, 'frozen', False):
-            # 如果是打包后的可执行文件，获取其所在目录
-            program_dir = os.path.dirname(sys.executable)
-        else:
-            # 如果是作为 .py 脚本运行，获取脚本所在目录
-            program_dir = os.path.dirname(os.path.abspath(__file__))
+def fetch_video_info(url):
+    """流式请求视频页面，读到 playinfo 结束即断开连接，返回值同 parse_video_page。"""
+    extractor = PlayinfoExtractor()
+    with SESSION.get(url, headers=HEADERS, timeout=15, stream=True) as response:
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            if extractor.feed(chunk): break
+    return extractor.result()
 
-        # 将文件名和程序目录组合成一个完整的绝对路径
-        output_file = os.path.join(program_dir, f"[{sanitized_quality}] {sanitized_title}.mp4")
-        # --- 关键代码结束 ---
 
-        if os.path.exists(output_file):
-            print(f"文件 '{output_file}' 已存在，跳过下载。")
-            return True
+def select_video_stream(video_streams, preferred_quality_id, quiet=False):
+    """按期望清晰度选择视频流，找不到时选择最高清晰度。"""
+    video_streams.sort(key=lambda x: x['id'], reverse=True)
+    if preferred_quality_id != 0:
+        for stream in video_streams:
+            if stream['id'] == preferred_quality_id:
+                if not quiet: print(f"已匹配到期望清晰度: {QUALITY_MAP.get(stream['id'], '未知')}")
+                return stream
+
+    selected_stream = video_streams[0]
+    if not quiet:
+        print(f"未找到期望清晰度，自动选择最高可用清晰度: {QUALITY_MAP.get(selected_stream['id'], '未知')}")
+    return selected_stream
+
+
+def build_output_file(title, selected_stream):
+    """构建最终输出文件的绝对路径，返回 (output_file, sanitized_title)。"""
+    selected_quality_name = QUALITY_MAP.get(selected_stream['id'], f"{selected_stream.get('height')}P")
+    sanitized_title = re.sub(r'[\\/:*?"<>|]', '_', title)
+    sanitized_quality = re.sub(r'[\\/:*?"<>|]', '_', selected_quality_name)
+    # 将文件名和程序目录组合成一个完整的绝对路径
+    return os.path.join(get_program_dir(), f"[{sanitized_quality}] {sanitized_title}.mp4"), sanitized_title
+
+
+def build_partial_files(media_key, selected_stream, audio_stream):
+    """续传模式下分片文件以 BV号 + 流ID 命名，失败后保留，下次运行继续下载。"""
+    partial_dir = os.path.join(get_program_dir(), PARTIAL_DIR_NAME)
+    os.makedirs(partial_dir, exist_ok=True)
+    video_stream_id = f"{selected_stream['id']}_{selected_stream.get('codecid', 0)}"
+    return (os.path.join(partial_dir, f"{media_key}_video_{video_stream_id}.m4s"),
+            os.path.join(partial_dir, f"{media_key}_audio_{audio_stream['id']}.m4s"))
+
+
+def print_ffmpeg_not_found():
+    if sys.platform == "win32":
+        print(
+            "\n**错误**: 未找到 'ffmpeg'。请确保 **ffmpeg.exe** 已安装并位于系统PATH中，或与此脚本在同一目录下。")
+    else:
+        print("\n**错误**: 未找到 'ffmpeg'。请使用包管理器安装它 (例如在 macOS 上: 'brew install ffmpeg')。")
+
+
+# ---- 本地合并：视频和音频都是 fMP4 时不调用 ffmpeg，直接拼接 ----
+class RemuxUnsupported(ValueError):
+    """输入不是本地合并能处理的 fMP4 音视频组合，需要交给 ffmpeg。"""
+
+
+REMUX_VIDEO_CODECS = {b'avc1', b'avc3', b'hev1', b'hvc1', b'av01'}
+REMUX_AUDIO_CODECS = {b'mp4a'}
+TFHD_BASE_DATA_OFFSET = 0x000001
+
+
+def parse_boxes(data, start=0, end=None):
+    """解析 data[start:end] 中的同级 box，返回 [(类型, 起始偏移, 头部长度, 总长度), ...]。"""
+    end = len(data) if end is None else end
+    boxes, pos = [], start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            size, header = struct.unpack_from('>Q', data, pos + 8)[0], 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end: raise RemuxUnsupported(f"box {kind!r} 长度异常")
+        boxes.append((kind, pos, header, size))
+        pos += size
+    return boxes
+
+
+def find_box(data, *path, start=0, end=None):
+    """按路径查找嵌套的 box（如 find_box(trak, b'mdia', b'mdhd')），返回 (起始偏移, 头部长度, 总长度)。"""
+    for kind in path:
+        match = next((box for box in parse_boxes(data, start, end) if box[0] == kind), None)
+        if match is None: raise RemuxUnsupported(f"缺少 '{kind.decode()}' box")
+        _, start, header, size = match
+        end, start = start + size, start + header
+    return start - header, header, size
+
+
+def full_box_field(data, box, offset_v0, offset_v1, fmt='>I'):
+    """FullBox 中按版本号定位字段：返回 (字段偏移, 字段值)。"""
+    start, header, _ = box
+    offset = start + header + (offset_v1 if data[start + header] == 1 else offset_v0)
+    return offset, struct.unpack_from(fmt, data, offset)[0]
+
+
+def make_box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+class Fmp4Track:
+    """单轨 fMP4 文件（B站 DASH 分片）：只把 moov 和各 moof 读入内存，mdat 只记录位置和长度。"""
+    def __init__(self, path):
+        self.path = path
+        self.fragments = []     # [(解码时间/秒, moof, [(mdat偏移, mdat长度), ...]), ...]
+        self.duration = 0.0     # 由 sidx 得到的总时长（秒），没有 sidx 时为 0
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            pos = 0
+            while pos < file_size:
+                f.seek(pos)
+                header = f.read(16)
+                if len(header) < 8: raise RemuxUnsupported("文件结尾不完整")
+                size, kind = struct.unpack_from('>I4s', header)
+                if pos == 0 and kind != b'ftyp': raise RemuxUnsupported("不是 MP4 文件")
+                if size == 1: size = struct.unpack_from('>Q', header, 8)[0]
+                elif size == 0: size = file_size - pos
+                if size < 8 or pos + size > file_size: raise RemuxUnsupported(f"box {kind!r} 长度异常")
+                if kind == b'mdat':
+                    if not self.fragments or self.fragments[-1][3] != pos:
+                        raise RemuxUnsupported("mdat 前没有对应的 moof")
+                    time_, moof, mdats, _ = self.fragments[-1]
+                    self.fragments[-1] = (time_, moof, mdats + [(pos, size)], pos + size)
+                elif kind in (b'ftyp', b'moov', b'moof', b'sidx'):
+                    f.seek(pos)
+                    data = bytearray(f.read(size))
+                    if kind == b'ftyp': self.ftyp = bytes(data)
+                    elif kind == b'moov': self._parse_moov(data)
+                    elif kind == b'moof': self.fragments.append((self._fragment_time(data), data, [], pos + size))
+                    else: self._add_sidx(data)
+                pos += size
+        if not hasattr(self, 'moov') or not self.fragments: raise RemuxUnsupported("不是分片 MP4 (fMP4)")
+        self.fragments = [(time_, moof, mdats) for time_, moof, mdats, _ in self.fragments]
+
+    def _parse_moov(self, moov):
+        traks = [box for box in parse_boxes(moov, 8) if box[0] == b'trak']
+        if len(traks) != 1: raise RemuxUnsupported("只支持单轨文件")
+        _, start, _, size = traks[0]
+        self.moov = moov
+        self.trak = bytearray(moov[start:start + size])
+        trex_start, _, trex_size = find_box(moov, b'mvex', b'trex', start=8)
+        self.trex = bytearray(moov[trex_start:trex_start + trex_size])
+        tkhd = find_box(self.trak, b'tkhd', start=8)
+        self.track_id = full_box_field(self.trak, tkhd, 12, 20)[1]
+        self.timescale = full_box_field(self.trak, find_box(self.trak, b'mdia', b'mdhd', start=8), 12, 20)[1]
+        hdlr_start, hdlr_header, _ = find_box(self.trak, b'mdia', b'hdlr', start=8)
+        self.handler = bytes(self.trak[hdlr_start + hdlr_header + 8:hdlr_start + hdlr_header + 12])
+        stsd_start, stsd_header, stsd_size = find_box(self.trak, b'mdia', b'minf', b'stbl', b'stsd', start=8)
+        entries = parse_boxes(self.trak, stsd_start + stsd_header + 8, stsd_start + stsd_size)
+        if len(entries) != 1: raise RemuxUnsupported("只支持单一编码的轨道")
+        self.codec = entries[0][0]
+
+    def _fragment_time(self, moof):
+        traf = [box for box in parse_boxes(moof, 8) if box[0] == b'traf']
+        if len(traf) != 1: raise RemuxUnsupported("moof 中的轨道数量异常")
+        _, start, header, size = traf[0]
+        tfhd = find_box(moof, b'tfhd', start=start + header, end=start + size)
+        flags = int.from_bytes(moof[tfhd[0] + tfhd[1] + 1:tfhd[0] + tfhd[1] + 4], 'big')
+        if flags & TFHD_BASE_DATA_OFFSET: raise RemuxUnsupported("tfhd 使用了绝对数据偏移")
+        tfdt = find_box(moof, b'tfdt', start=start + header, end=start + size)
+        return full_box_field(moof, tfdt, 4, 4, '>Q' if moof[tfdt[0] + tfdt[1]] == 1 else '>I')[1] / self.timescale
+
+    def _add_sidx(self, sidx):
+        box = (0, 8, len(sidx))
+        timescale = full_box_field(sidx, box, 8, 8)[1]
+        # earliest_presentation_time 和 first_offset 在 version 1 中为 64 位，其后是 2 字节保留字段和引用数
+        count_offset = 8 + (22 if sidx[8] == 0 else 30)
+        count = struct.unpack_from('>H', sidx, count_offset)[0]
+        durations = struct.unpack_from('>' + '4xI4x' * count, sidx, count_offset + 2)
+        self.duration += sum(durations) / timescale
+
+    def set_track_id(self, track_id):
+        """修改 tkhd、trex 和每个 tfhd 中的轨道编号（长度不变，mdat 的相对偏移仍然有效）。"""
+        self.track_id = track_id
+        struct.pack_into('>I', self.trak, full_box_field(self.trak, find_box(self.trak, b'tkhd', start=8), 12, 20)[0],
+                         track_id)
+        struct.pack_into('>I', self.trex, 12, track_id)
+        for _, moof, _ in self.fragments:
+            _, start, header, size = next(box for box in parse_boxes(moof, 8) if box[0] == b'traf')
+            tfhd_start, tfhd_header, _ = find_box(moof, b'tfhd', start=start + header, end=start + size)
+            struct.pack_into('>I', moof, tfhd_start + tfhd_header + 4, track_id)
+
+
+def check_remux_pair(video, audio):
+    """只处理“一条 H.264/HEVC/AV1 视频轨 + 一条 AAC 音频轨”的组合，其它情况抛出 RemuxUnsupported。"""
+    if video.handler != b'vide' or video.codec not in REMUX_VIDEO_CODECS:
+        raise RemuxUnsupported(f"不支持的视频轨 ({video.handler!r}/{video.codec!r})")
+    if audio.handler != b'soun' or audio.codec not in REMUX_AUDIO_CODECS:
+        raise RemuxUnsupported(f"不支持的音频轨 ({audio.handler!r}/{audio.codec!r})")
+
+
+def build_merged_moov(video, audio):
+    """以视频的 moov 为基础加入音频 trak 和 trex，更新 next_track_ID，并按 sidx 时长写入 mehd。"""
+    children, mvhd = [], None
+    for kind, start, header, size in parse_boxes(video.moov, 8):
+        box = bytearray(video.moov[start:start + size])
+        if kind == b'mvhd':
+            mvhd = box
+            timescale = full_box_field(box, (0, header, size), 12, 20)[1]
+            struct.pack_into('>I', box, size - 4, max(video.track_id, audio.track_id) + 1)
+        elif kind == b'mvex':
+            entries = [box[s:s + n] for k, s, _, n in parse_boxes(box, header) if k != b'mehd']
+            duration = max(video.duration, audio.duration)
+            if duration: entries.insert(0, make_box(b'mehd', struct.pack('>IQ', 1 << 24, round(duration * timescale))))
+            box = make_box(b'mvex', b''.join(entries) + audio.trex)
+        elif kind == b'trak':
+            box = video.trak + audio.trak
+        children.append(bytes(box))
+    if mvhd is None: raise RemuxUnsupported("缺少 mvhd")
+    return make_box(b'moov', b''.join(children))
+
+
+def copy_range(src_fd, dst_fd, offset, count):
+    """把 src_fd 中 [offset, offset+count) 追加写入 dst_fd 的当前位置，尽量在内核中完成拷贝。"""
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while count > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, count, offset)
+                if copied == 0: break
+                offset, count = offset + copied, count - copied
+        except OSError:
+            pass
+    if count > 0 and sys.platform.startswith('linux'):
+        try:
+            while count > 0:
+                copied = os.sendfile(dst_fd, src_fd, offset, count)
+                if copied == 0: break
+                offset, count = offset + copied, count - copied
+        except OSError:
+            pass
+    while count > 0:
+        os.lseek(src_fd, offset, os.SEEK_SET)
+        chunk = os.read(src_fd, min(count, 1024 * 1024))
+        if not chunk: raise IOError("源文件长度不足")
+        os.write(dst_fd, chunk)
+        offset, count = offset + len(chunk), count - len(chunk)
+
+
+def remux_fmp4(video_file, audio_file, output_file):
+    """
+    不经 ffmpeg 合并B站 DASH 的音视频分片：写入视频的 ftyp、合并后的 moov，
+    再按解码时间交错写入两条轨道的 moof（重编 mfhd 序号），mdat 用 copy_range 在内核中拷贝。
+    输入不符合要求时抛出 RemuxUnsupported，调用方应改用 ffmpeg。
+    """
+    video, audio = Fmp4Track(video_file), Fmp4Track(audio_file)
+    check_remux_pair(video, audio)
+    if audio.track_id == video.track_id: audio.set_track_id(video.track_id + 1)
+    moov = build_merged_moov(video, audio)
+
+    sources = {id(video): os.open(video_file, os.O_RDONLY | getattr(os, 'O_BINARY', 0)),
+               id(audio): os.open(audio_file, os.O_RDONLY | getattr(os, 'O_BINARY', 0))}
+    out_fd = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        os.write(out_fd, video.ftyp + moov)
+        fragments = heapq.merge(*([(time_, order, track, moof, mdats) for time_, moof, mdats in track.fragments]
+                                  for order, track in enumerate((video, audio))), key=lambda item: item[:2])
+        for sequence, (_, _, track, moof, mdats) in enumerate(fragments, 1):
+            mfhd_start, mfhd_header, _ = find_box(moof, b'mfhd', start=8)
+            struct.pack_into('>I', moof, mfhd_start + mfhd_header + 4, sequence)
+            os.write(out_fd, moof)
+            for offset, size in mdats: copy_range(sources[id(track)], out_fd, offset, size)
+    except BaseException:
+        os.close(out_fd)
+        os.remove(output_file)
+        raise
+    else:
+        os.close(out_fd)
+    finally:
+        for fd in sources.values(): os.close(fd)
+
+
+def local_remux(video_file, audio_file, output_file):
+    """尝试本地合并，成功返回 True；不支持或出错时返回 False，由调用方退回 ffmpeg。"""
+    if not LOCAL_REMUX: return False
+    try:
+        remux_fmp4(video_file, audio_file, output_file)
+        return True
+    except (RemuxUnsupported, OSError, struct.error) as e:
+        print(f"\n本地合并不可用，改用 FFmpeg: {e}")
+        return False
+
+
+# ---- 性能统计：各阶段耗时与吞吐量 ----
+def percentile(values, q):
+    """线性插值的百分位数，q 取 0~100。"""
+    ordered = sorted(values)
+    if not ordered: return 0.0
+    pos = (len(ordered) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+class VideoMetrics:
+    """
+    单个视频的耗时记录。stages 为各阶段累计秒数：metadata（缓存检查和页面解析）、download、mux，
+    以及等待下载/合并名额的 download_wait、mux_wait；streams 为每个流的字节数、耗时、吞吐量和重试次数。
+    """
+    def __init__(self, url, batch=None):
+        self.url = url
+        self.batch = batch
+        self.stages = {}
+        self.streams = []
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_stream(self, name, pool, seconds):
+        """登记一个流的下载结果，pool 为该流使用的 MirrorPool。"""
+        nbytes = pool.total_bytes
+        with self._lock:
+            self.streams.append({'name': name, 'bytes': nbytes, 'seconds': round(seconds, 3),
+                                 'mb_per_s': round(nbytes / seconds / 1024 / 1024, 3) if seconds > 0 else 0.0,
+                                 'head_seconds': round(pool.head_seconds, 3), 'retries': pool.retries,
+                                 'mirror_switches': pool.switches})
+
+    @contextmanager
+    def stage(self, name, slots=None):
+        """计时 name 阶段；传入信号量 slots 时先获取名额，等待时间单独记为 '<name>_wait'。"""
+        requested = time.perf_counter()
+        with slots or nullcontext():
+            acquired = time.perf_counter()
+            if slots is not None: self.add_time(f'{name}_wait', acquired - requested)
+            try:
+                yield
+            finally:
+                self.add_time(name, time.perf_counter() - acquired)
+
+    @asynccontextmanager
+    async def async_stage(self, name, slots=None):
+        """stage 的异步版本，slots 为 asyncio.Semaphore。"""
+        requested = time.perf_counter()
+        async with slots or nullcontext():
+            acquired = time.perf_counter()
+            if slots is not None: self.add_time(f'{name}_wait', acquired - requested)
+            try:
+                yield
+            finally:
+                self.add_time(name, time.perf_counter() - acquired)
+
+    def finish(self, ok):
+        """结束计时并交给所属批次写入统计文件。"""
+        record = {'url': self.url, 'ok': bool(ok), 'finished_at': round(time.time(), 3),
+                  'total_seconds': round(time.perf_counter() - self._started, 3),
+                  'stages': {stage: round(seconds, 3) for stage, seconds in self.stages.items()},
+                  'streams': self.streams}
+        if self.batch: self.batch.add(record)
+        return record
+
+
+class BatchMetrics:
+    """一次批量任务的统计：每个视频完成时以一行 JSON 追加到 path，report() 汇总整批结果。"""
+    STAGES = ('metadata', 'download_wait', 'download', 'mux_wait', 'mux')
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def start_video(self, url):
+        return VideoMetrics(url, self)
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+            if not self.path: return
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            except OSError as e:
+                print(f"\n警告: 写入性能统计文件失败: {e}")
+
+    def report(self):
+        """返回整批的汇总文本：总字节数、各流吞吐量的 p50/p95，以及各阶段耗时占比。"""
+        if not self.records: return "性能统计: 本批次没有处理任何视频。"
+        streams = [s for r in self.records for s in r['streams'] if s['bytes'] > 0]
+        speeds = [s['mb_per_s'] for s in streams]
+        total_mb = sum(s['bytes'] for s in streams) / 1024 / 1024
+        wall = time.perf_counter() - self._started
+        lines = [f"性能统计: {len(self.records)} 个视频，共下载 {total_mb:.1f} MB，总耗时 {wall:.1f}s "
+                 f"(平均 {total_mb / wall if wall > 0 else 0:.2f} MB/s)"]
+        if speeds:
+            lines.append(f"  单流吞吐量: p50 {percentile(speeds, 50):.2f} MB/s，p95 {percentile(speeds, 95):.2f} MB/s，"
+                         f"重试 {sum(s['retries'] for s in streams)} 次，"
+                         f"镜像切换 {sum(s['mirror_switches'] for s in streams)} 次")
+        totals = {stage: sum(r['stages'].get(stage, 0.0) for r in self.records) for stage in self.STAGES}
+        stage_sum = sum(totals.values())
+        if stage_sum > 0:
+            lines.append("  各阶段耗时: " + "，".join(
+                f"{stage} {seconds:.1f}s ({seconds / stage_sum:.0%})" for stage, seconds in totals.items()))
+        head = sum(s['head_seconds'] for r in self.records for s in r['streams'])
+        lines.append(f"  其中 HEAD 请求共 {head:.2f}s")
+        return '\n'.join(lines)
+
+
+def create_batch_metrics():
+    """创建批量统计，记录追加到程序目录下的 METRICS_FILE。"""
+    return BatchMetrics(os.path.join(get_program_dir(), METRICS_FILE))
+
+
+# ---- 核心处理逻辑：处理单个视频 ----
+def process_single_video(url, preferred_quality_id, download_slots=None, mux_slots=None, on_stage=None,
+                         metrics=None):
+    """
+    处理单个视频的下载和合并。返回 True 表示成功，False 表示失败。
+    视频流与音频流同时下载；download_slots / mux_slots 为批量任务共享的信号量，
+    用于限制同时下载和同时合并的视频数量（见 run_batch）。
+    on_stage(stage, output_file) 在开始合并时以 stage='muxing' 调用，供任务队列记录状态。
+    metrics (VideoMetrics) 记录各阶段耗时和各流的吞吐量，由调用方负责 finish()。
+    """
+    metrics = metrics or VideoMetrics(url)
+    # 文件名带上线程ID，避免批量并行时多个任务共用同一个临时文件
+    temp_video_file = f"temp_video_{os.getpid()}_{threading.get_ident()}.m4s"
+    temp_audio_file = f"temp_audio_{os.getpid()}_{threading.get_ident()}.m4s"
+    media_key = get_media_key(url)
+    resume = RESUME_DOWNLOADS and media_key is not None
+    merged = False
+
+    try:
+        print(f"\n{'=' * 20}\n正在处理URL: {url}")
+        with metrics.stage('metadata'):
+            parsed, skip = check_cached_video(url, media_key, preferred_quality_id)
+            if skip: return True
+
+            # 1. 解析视频标题和ID
+            if not parsed:
+                parsed = fetch_video_info(url)
+                if not parsed: return False
+                if media_key: get_metadata_cache().put(media_key, *parsed)
+        title, video_streams, audio_streams = parsed
+        title = resolve_part_title(url, title)
+        print(f"视频标题: {title}")
+
+        # 2. 选择视频流
+        selected_stream = select_video_stream(video_streams, preferred_quality_id)
+
+        # 3. 构建文件名并下载
+        output_file, sanitized_title = build_output_file(title, selected_stream)
+        if is_downloaded(media_key, selected_stream, output_file): return True
         print(f"最终文件名: {output_file}")
 
-        print("\n开始下载视频流...")
-        if not download_with_threading(video_url, temp_video_file, HEADERS): raise IOError("视频文件下载失败")
+        if STREAMING_MUX and hasattr(os, 'mkfifo'):
+            # 流式合并同时占用下载名额和合并名额
+            with download_slots or nullcontext(), metrics.stage('mux', mux_slots):
+                print(f"\n正在边下载边合并（流式模式）: {sanitized_title}")
+                if on_stage: on_stage('muxing', output_file)
+                merged = stream_mux(best_mirror_url(selected_stream), best_mirror_url(audio_streams[0]),
+                                    output_file, HEADERS)
+            if merged:
+                record_download(media_key, selected_stream, output_file)
+                print(f"视频合并完成！已保存为: {output_file}")
+            return merged
 
-        print("\n开始下载音频流...")
-        if not download_with_threading(audio_url, temp_audio_file, HEADERS): raise IOError("音频文件下载失败")
+        if resume:
+            temp_video_file, temp_audio_file = build_partial_files(media_key, selected_stream, audio_streams[0])
 
-        # 4. 合并
-        print("\n正在使用 FFmpeg 合并音视频...")
-        ffmpeg_path = get_ffmpeg_path()
-        command = [ffmpeg_path, '-i', temp_video_file, '-i', temp_audio_file, '-c', 'copy', '-y', output_file]
+        with metrics.stage('download', download_slots):
+            print("\n开始同时下载视频流和音频流...")
+            failed = download_streams([('视频', selected_stream, temp_video_file),
+                                       ('音频', audio_streams[0], temp_audio_file)], resume=resume, metrics=metrics)
+        if failed: raise IOError(f"{'、'.join(failed)}文件下载失败")
 
+        # 4. 合并：优先本地拼接 fMP4，不支持时使用 FFmpeg
         try:
-            subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            with metrics.stage('mux', mux_slots):
+                print(f"\n正在合并音视频: {sanitized_title}")
+                if on_stage: on_stage('muxing', output_file)
+                if not local_remux(temp_video_file, temp_audio_file, output_file):
+                    command = [get_ffmpeg_path(), '-i', temp_video_file, '-i', temp_audio_file, '-c', 'copy', '-y',
+                               output_file]
+                    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            merged = True
+            record_download(media_key, selected_stream, output_file)
             print(f"视频合并完成！已保存为: {output_file}")
             return True
         except FileNotFoundError:
-            if sys.platform == "win32":
-                print(
-                    "\n**错误**: 未找到 'ffmpeg'。请确保 **ffmpeg.exe** 已安装并位于系统PATH中，或与此脚本在同一目录下。")
-            else:
-                print("\n**错误**: 未找到 'ffmpeg'。请使用包管理器安装它 (例如在 macOS 上: 'brew install ffmpeg')。")
+            print_ffmpeg_not_found()
             return False
         except subprocess.CalledProcessError as e:
             print(f"\n错误: ffmpeg 合并文件时出错: {e}。")
@@ -207,8 +1736,573 @@ def process_single_video(url, preferred_quality_id):
         print(f"\n处理URL时发生严重错误: {e}")
         return False
     finally:
-        if os.path.exists(temp_video_file): os.remove(temp_video_file)
-        if os.path.exists(temp_audio_file): os.remove(temp_audio_file)
+        # 续传模式下只有合并成功才清理分片和续传日志，失败时保留供下次续传
+        if merged or not resume:
+            remove_partial(temp_video_file)
+            remove_partial(temp_audio_file)
+
+
+# ---- 批量任务：流水线调度 ----
+def run_batch(urls, preferred_quality_id, max_downloads=None, max_muxes=None):
+    """
+    以流水线方式批量处理视频：同一时间最多 max_downloads 个视频在下载、max_muxes 个在合并，
+    当前视频合并期间，后续视频的页面解析和下载同时进行。返回 (成功数, 失败数)。
+    """
+    max_downloads = max_downloads or MAX_CONCURRENT_DOWNLOADS
+    max_muxes = max_muxes or MAX_CONCURRENT_MUXES
+    download_slots = threading.BoundedSemaphore(max_downloads)
+    mux_slots = threading.BoundedSemaphore(max_muxes)
+    total_videos = len(urls)
+    batch_metrics = create_batch_metrics()
+
+    def pipeline_worker(index, url):
+        print(f"\n--- 开始处理第 {index + 1} / {total_videos} 个视频 ---")
+        metrics = batch_metrics.start_video(url)
+        ok = process_single_video(url, preferred_quality_id, download_slots, mux_slots, metrics=metrics)
+        metrics.finish(ok)
+        if not ok: print(f"--- 第 {index + 1} / {total_videos} 个视频处理失败 ---")
+        return ok
+
+    # 在途任务数 = 下载槽 + 合并槽，保证合并时总有后续任务在解析或下载
+    with ThreadPoolExecutor(max_workers=max_downloads + max_muxes) as executor:
+        results = list(executor.map(pipeline_worker, range(total_videos), urls))
+    get_metadata_cache().flush()
+    print(f"\n{batch_metrics.report()}")
+    success_count = sum(results)
+    return success_count, total_videos - success_count
+
+
+# ---- 异步下载引擎（aiohttp）：整批任务共用一个长连接池 ----
+def create_async_client():
+    """创建整批任务共用的 aiohttp 客户端，连接池保持长连接。"""
+    connector = aiohttp.TCPConnector(limit=ASYNC_MAX_CONNECTIONS, limit_per_host=ASYNC_MAX_CONNECTIONS_PER_HOST,
+                                     keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=20)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+@asynccontextmanager
+async def governed_request(client, method, url, **kwargs):
+    """GovernedAdapter 的异步版本：经 GOVERNOR 限速后发出请求，可重试的状态码退避后重新发送。"""
+    for attempt in range(REQUEST_RETRIES + 1):
+        await GOVERNOR.async_wait(url)
+        response = await client.request(method, url, **kwargs)
+        GOVERNOR.on_response(url, response.status)
+        if response.status not in RETRY_STATUS_CODES or attempt == REQUEST_RETRIES: break
+        delay = GOVERNOR.backoff(attempt, response.headers.get('Retry-After'))
+        response.release()
+        await asyncio.sleep(delay)
+    try:
+        yield response
+    finally:
+        response.release()
+
+
+async def async_get_total_size(client, url, headers):
+    """HEAD 获取文件大小，失败时退化为 GET 读取响应头。"""
+    try:
+        async with governed_request(client, 'HEAD', url, headers=headers) as resp:
+            resp.raise_for_status()
+            return int(resp.headers.get('content-length', 0))
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        async with governed_request(client, 'GET', url, headers=headers) as resp:
+            resp.raise_for_status()
+            return int(resp.headers.get('content-length', 0))
+
+
+async def async_probe_mirror(client, url, headers):
+    """probe_mirror 的异步版本，返回 B/s，失败返回 0。"""
+    start = time.perf_counter()
+    received = 0
+    try:
+        probe_headers = {**headers, 'Range': f'bytes=0-{MIRROR_PROBE_BYTES - 1}'}
+        async with governed_request(client, 'GET', url, headers=probe_headers,
+                                    timeout=aiohttp.ClientTimeout(total=MIRROR_PROBE_TIMEOUT)) as resp:
+            if resp.status not in (200, 206): return 0
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                received += len(chunk)
+                if received >= MIRROR_PROBE_BYTES: break
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return 0
+    return received / max(time.perf_counter() - start, 1e-6)
+
+
+async def async_rank_mirrors(client, urls, headers):
+    """rank_mirrors 的异步版本。"""
+    if len(urls) <= 1: return list(urls)
+    speeds = dict(zip(urls, await asyncio.gather(*(async_probe_mirror(client, url, headers) for url in urls))))
+    ranked = sorted((url for url in urls if speeds[url] > 0), key=lambda url: speeds[url], reverse=True)
+    return ranked or list(urls)
+
+
+async def async_probe_range_support(client, url, headers):
+    try:
+        async with governed_request(client, 'GET', url, headers={**headers, 'Range': 'bytes=0-0'}) as resp:
+            return resp.status == 206
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+
+async def async_download(client, url, filename, headers, segments=None, resume=False, mirrors=None, metrics=None):
+    """download_with_threading 的异步版本：各分段为协程而非线程，共用 client 的连接池。"""
+    started = time.perf_counter()
+    pool = MirrorPool(await async_rank_mirrors(client, mirrors, headers) if mirrors else [url])
+    try:
+        return await async_download_from_pool(client, pool, filename, headers, segments or DOWNLOAD_SEGMENTS, resume)
+    finally:
+        if metrics: metrics.add_stream(os.path.basename(filename).split('.')[0], pool, time.perf_counter() - started)
+
+
+async def async_download_from_pool(client, pool, filename, headers, segments, resume):
+    """download_from_pool 的异步版本。"""
+    url = pool.urls[0]
+    name = os.path.basename(filename).split('.')[0]
+    head_started = time.perf_counter()
+    try:
+        total_size = await async_get_total_size(client, url, headers)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"\n无法获取文件大小: {e}")
+        return False
+    finally:
+        pool.head_seconds += time.perf_counter() - head_started
+
+    ranges, journal = plan_ranges(filename, total_size, segments, resume)
+    if journal and not ranges:
+        print(f"\n'{os.path.basename(filename)}' 已在上次完整下载，跳过。")
+        return True
+
+    pbar = tqdm(total=total_size, unit='iB', unit_scale=True, desc=name)
+    try:
+        if (journal or len(ranges) > 1) and await async_probe_range_support(client, url, headers):
+            if journal and journal.done: pbar.update(journal.done_bytes)
+            fd = os.open(filename, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0))
+            try:
+                os.ftruncate(fd, total_size)
+
+                async def segment_task(index, start, end):
+                    pos = start
+                    seg_url = pool.pick(index)
+                    attempt = switches = 0
+                    while attempt < SEGMENT_RETRIES:
+                        slow = False
+                        window_start, window_bytes = time.perf_counter(), 0
+                        try:
+                            seg_headers = {**headers, 'Range': f'bytes={pos}-{end}'}
+                            async with governed_request(client, 'GET', seg_url, headers=seg_headers) as response:
+                                if response.status != 206:
+                                    raise IOError(f"服务器未按Range返回数据 (HTTP {response.status})")
+                                async for chunk in response.content.iter_chunked(1024 * 1024):
+                                    chunk = chunk[:end + 1 - pos]
+                                    # 写入页缓存很快，直接在事件循环中执行
+                                    pwrite(fd, chunk, pos)
+                                    if journal: journal.add(pos, pos + len(chunk) - 1)
+                                    pos += len(chunk)
+                                    pbar.update(len(chunk))
+                                    window_bytes += len(chunk)
+                                    if pos > end: break
+                                    elapsed = time.perf_counter() - window_start
+                                    if elapsed >= MIRROR_CHECK_WINDOW:
+                                        pool.record(seg_url, window_bytes, elapsed)
+                                        slow = pool.is_slow(window_bytes, elapsed) and len(pool.urls) > 1 \
+                                            and switches < MIRROR_MAX_SWITCHES
+                                        window_start, window_bytes = time.perf_counter(), 0
+                                        if slow: break
+                            pool.record(seg_url, window_bytes, time.perf_counter() - window_start)
+                            if pos > end: return True
+                            if slow:
+                                switches += 1
+                                pool.record_retry(switched=True)
+                                seg_url = pool.next_after(seg_url)
+                                continue
+                            raise IOError("连接提前结束")
+                        except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+                            attempt += 1
+                            pool.record_retry()
+                            print(f"\n分段 {index + 1} 第 {attempt}/{SEGMENT_RETRIES} 次尝试出错: {e}")
+                            seg_url = pool.next_after(seg_url)
+                            await asyncio.sleep(GOVERNOR.backoff(attempt))
+                    return False
+
+                results = await asyncio.gather(*(segment_task(i, start, end) for i, (start, end) in enumerate(ranges)))
+            finally:
+                os.close(fd)
+                if journal: journal.save()
+            pbar.close()
+            print(f"\n{name} 镜像统计: {pool.summary()}")
+            if not all(results): return False
+            return os.path.getsize(filename) == total_size
+
+        if journal: journal.remove()
+        started, received = time.perf_counter(), 0
+        async with governed_request(client, 'GET', url, headers=headers) as response:
+            response.raise_for_status()
+            with open(filename, 'wb') as f:
+                async for chunk in response.content.iter_chunked(1024 * 1024):
+                    f.write(chunk)
+                    received += len(chunk)
+                    pbar.update(len(chunk))
+        pool.record(url, received, time.perf_counter() - started)
+        pbar.close()
+        print(f"\n{name} 镜像统计: {pool.summary()}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"\n下载出错: {e}")
+        return False
+    finally:
+        pbar.close()
+
+    final_size = os.path.getsize(filename)
+    if total_size > 0 and final_size < total_size:
+        print(f"\n警告: 文件下载不完整! 期望大小: {total_size}, 实际大小: {final_size}")
+        return False
+    if journal and total_size > 0: journal.mark_complete()
+    return True
+
+
+async def async_fetch_video_info(client, url):
+    """fetch_video_info 的异步版本。"""
+    extractor = PlayinfoExtractor()
+    async with governed_request(client, 'GET', url, headers=HEADERS) as response:
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            if extractor.feed(chunk): break
+    return extractor.result()
+
+
+async def async_process_single_video(client, url, preferred_quality_id, download_slots=None, mux_slots=None,
+                                     on_stage=None, metrics=None):
+    """process_single_video 的异步版本，返回 True 表示成功，False 表示失败。"""
+    metrics = metrics or VideoMetrics(url)
+    token = f"{os.getpid()}_{id(asyncio.current_task())}"
+    temp_video_file = f"temp_video_{token}.m4s"
+    temp_audio_file = f"temp_audio_{token}.m4s"
+    media_key = get_media_key(url)
+    resume = RESUME_DOWNLOADS and media_key is not None
+    merged = False
+
+    try:
+        print(f"\n{'=' * 20}\n正在处理URL: {url}")
+        async with metrics.async_stage('metadata'):
+            parsed, skip = check_cached_video(url, media_key, preferred_quality_id)
+            if skip: return True
+
+            if not parsed:
+                parsed = await async_fetch_video_info(client, url)
+                if not parsed: return False
+                if media_key: get_metadata_cache().put(media_key, *parsed)
+        title, video_streams, audio_streams = parsed
+        title = resolve_part_title(url, title)
+        print(f"视频标题: {title}")
+
+        selected_stream = select_video_stream(video_streams, preferred_quality_id)
+        output_file, sanitized_title = build_output_file(title, selected_stream)
+        if is_downloaded(media_key, selected_stream, output_file): return True
+        print(f"最终文件名: {output_file}")
+
+        if STREAMING_MUX and hasattr(os, 'mkfifo'):
+            async with download_slots or nullcontext(), metrics.async_stage('mux', mux_slots):
+                print(f"\n正在边下载边合并（流式模式）: {sanitized_title}")
+                if on_stage: on_stage('muxing', output_file)
+                # 管道写入是阻塞操作，流式合并放到线程中执行
+                merged = await asyncio.to_thread(
+                    lambda: stream_mux(best_mirror_url(selected_stream), best_mirror_url(audio_streams[0]),
+                                       output_file, HEADERS))
+            if merged:
+                record_download(media_key, selected_stream, output_file)
+                print(f"视频合并完成！已保存为: {output_file}")
+            return merged
+
+        if resume:
+            temp_video_file, temp_audio_file = build_partial_files(media_key, selected_stream, audio_streams[0])
+
+        async with metrics.async_stage('download', download_slots):
+            video_ok, audio_ok = await asyncio.gather(*(
+                async_download(client, stream['baseUrl'], filename, HEADERS, resume=resume,
+                               mirrors=get_stream_mirrors(stream) if MIRROR_RACING else None, metrics=metrics)
+                for stream, filename in ((selected_stream, temp_video_file), (audio_streams[0], temp_audio_file))))
+        if not video_ok: raise IOError("视频文件下载失败")
+        if not audio_ok: raise IOError("音频文件下载失败")
+
+        async with metrics.async_stage('mux', mux_slots):
+            print(f"\n正在合并音视频: {sanitized_title}")
+            if on_stage: on_stage('muxing', output_file)
+            returncode = 0
+            if not await asyncio.to_thread(local_remux, temp_video_file, temp_audio_file, output_file):
+                command = [get_ffmpeg_path(), '-i', temp_video_file, '-i', temp_audio_file, '-c', 'copy', '-y',
+                           output_file]
+                try:
+                    proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.DEVNULL,
+                                                                stderr=asyncio.subprocess.DEVNULL)
+                except FileNotFoundError:
+                    print_ffmpeg_not_found()
+                    return False
+                returncode = await proc.wait()
+        if returncode != 0:
+            print(f"\n错误: ffmpeg 合并文件时出错 (返回码 {returncode})。")
+            return False
+        merged = True
+        record_download(media_key, selected_stream, output_file)
+        print(f"视频合并完成！已保存为: {output_file}")
+        return True
+
+    except Exception as e:
+        print(f"\n处理URL时发生严重错误: {e}")
+        return False
+    finally:
+        if merged or not resume:
+            remove_partial(temp_video_file)
+            remove_partial(temp_audio_file)
+
+
+async def async_run_batch(urls, preferred_quality_id, max_downloads=None, max_muxes=None):
+    """
+    异步批量处理：固定数量的协程从队列中取任务，全部共用一个 aiohttp 连接池。
+    队列长度不影响并发量，数百个URL也只占用 max_downloads + max_muxes 个在途任务。返回 (成功数, 失败数)。
+    """
+    max_downloads = max_downloads or MAX_CONCURRENT_DOWNLOADS
+    max_muxes = max_muxes or MAX_CONCURRENT_MUXES
+    download_slots = asyncio.Semaphore(max_downloads)
+    mux_slots = asyncio.Semaphore(max_muxes)
+    total_videos = len(urls)
+    queue = asyncio.Queue()
+    for item in enumerate(urls): queue.put_nowait(item)
+    results = []
+    batch_metrics = create_batch_metrics()
+
+    async with create_async_client() as client:
+        async def pipeline_worker():
+            while not queue.empty():
+                index, url = queue.get_nowait()
+                print(f"\n--- 开始处理第 {index + 1} / {total_videos} 个视频 ---")
+                metrics = batch_metrics.start_video(url)
+                ok = await async_process_single_video(client, url, preferred_quality_id, download_slots, mux_slots,
+                                                      metrics=metrics)
+                metrics.finish(ok)
+                if not ok: print(f"--- 第 {index + 1} / {total_videos} 个视频处理失败 ---")
+                results.append(ok)
+
+        await asyncio.gather(*(pipeline_worker() for _ in range(min(total_videos, max_downloads + max_muxes))))
+    get_metadata_cache().flush()
+    print(f"\n{batch_metrics.report()}")
+
+    success_count = sum(results)
+    return success_count, total_videos - success_count
+
+
+def run_batch_async(urls, preferred_quality_id, max_downloads=None, max_muxes=None):
+    """供交互式 main() 调用的同步入口。"""
+    return asyncio.run(async_run_batch(urls, preferred_quality_id, max_downloads, max_muxes))
+
+
+# ---- 持久化任务队列（SQLite） ----
+class JobQueue:
+    """
+    保存在 SQLite 中的下载任务队列，每个任务的状态为 pending / downloading / muxing / done / failed。
+    程序崩溃或重启后，未完成的任务由 recover() 重新置为 pending；分片文件由断点续传日志接着下载。
+    """
+    STATES = ('pending', 'downloading', 'muxing', 'done', 'failed')
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL UNIQUE,
+                quality INTEGER NOT NULL DEFAULT 0,
+                part_title TEXT,
+                state TEXT NOT NULL DEFAULT 'pending',
+                output_file TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, id)')
+
+    def add(self, urls, quality, retry_failed=False):
+        """加入任务，已存在的URL不重复加入（retry_failed=True 时把失败的任务重新置为待处理）。返回新增数量。"""
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            for url in urls:
+                self._conn.execute(
+                    'INSERT OR IGNORE INTO jobs (url, quality, part_title, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                    (url, quality, part_titles.get(get_media_key(url)), now, now))
+            added = self._conn.total_changes - before
+            if retry_failed:
+                self._conn.execute("UPDATE jobs SET state = 'pending', updated_at = ? WHERE state = 'failed'", (now,))
+        return added
+
+    def recover(self):
+        """
+        把上次运行中断的任务恢复为 pending，返回恢复的任务数。合并中断的任务：输出文件结构完整（合并已完成、
+        只是状态没来得及更新）时直接标记为 done，否则把残缺文件改名隔离后重新处理。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, state, output_file FROM jobs WHERE state IN ('downloading', 'muxing')").fetchall()
+            recovered = 0
+            for job_id, state, output_file in rows:
+                new_state = 'pending'
+                if state == 'muxing' and output_file and os.path.exists(output_file):
+                    if mp4_is_complete(output_file):
+                        new_state = 'done'
+                    else:
+                        print(f"合并中断的文件 '{output_file}' 不完整，已改名为 '{quarantine_file(output_file)}'。")
+                self._conn.execute('UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?',
+                                   (new_state, time.time(), job_id))
+                recovered += new_state == 'pending'
+        return recovered
+
+    def claim(self):
+        """取出下一个待处理任务并标记为 downloading，队列为空时返回 None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, url, quality, part_title FROM jobs WHERE state = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None: return None
+            self._conn.execute(
+                "UPDATE jobs SET state = 'downloading', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (time.time(), row[0]))
+        return row
+
+    def set_state(self, job_id, state, output_file=None):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, output_file = COALESCE(?, output_file), updated_at = ? WHERE id = ?',
+                (state, output_file, time.time(), job_id))
+
+    def counts(self):
+        with self._lock:
+            rows = dict(self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return {state: rows.get(state, 0) for state in self.STATES}
+
+    def close(self):
+        self._conn.close()
+
+
+def run_queue(queue, max_downloads=None, max_muxes=None):
+    """
+    以 max_downloads 个下载、max_muxes 个合并的并发处理队列中所有待处理任务，直到队列为空。
+    安装了 aiohttp 时使用异步引擎。返回本次运行的 (成功数, 失败数)。
+    """
+    max_downloads = max_downloads or MAX_CONCURRENT_DOWNLOADS
+    max_muxes = max_muxes or MAX_CONCURRENT_MUXES
+    recovered = queue.recover()
+    if recovered: print(f"检测到 {recovered} 个上次中断的任务，已重新加入队列。")
+    results = []
+    batch_metrics = create_batch_metrics()
+
+    def start_job(job):
+        job_id, url, quality, part_title = job
+        if part_title: part_titles[get_media_key(url)] = part_title
+        print(f"\n--- 开始处理任务 #{job_id} ---")
+        return (job_id, url, quality, lambda stage, output_file: queue.set_state(job_id, stage, output_file),
+                batch_metrics.start_video(url))
+
+    def finish_job(job_id, ok, metrics):
+        metrics.finish(ok)
+        queue.set_state(job_id, 'done' if ok else 'failed')
+        if not ok: print(f"--- 任务 #{job_id} 处理失败 ---")
+        results.append(ok)
+
+    if USE_ASYNC_ENGINE and aiohttp is not None:
+        async def run_async():
+            download_slots = asyncio.Semaphore(max_downloads)
+            mux_slots = asyncio.Semaphore(max_muxes)
+            async with create_async_client() as client:
+                async def queue_worker():
+                    while (job := queue.claim()) is not None:
+                        job_id, url, quality, on_stage, metrics = start_job(job)
+                        finish_job(job_id, await async_process_single_video(
+                            client, url, quality, download_slots, mux_slots, on_stage, metrics), metrics)
+
+                await asyncio.gather(*(queue_worker() for _ in range(max_downloads + max_muxes)))
+
+        asyncio.run(run_async())
+    else:
+        download_slots = threading.BoundedSemaphore(max_downloads)
+        mux_slots = threading.BoundedSemaphore(max_muxes)
+
+        def queue_worker():
+            while (job := queue.claim()) is not None:
+                job_id, url, quality, on_stage, metrics = start_job(job)
+                finish_job(job_id, process_single_video(url, quality, download_slots, mux_slots, on_stage, metrics),
+                           metrics)
+
+        with ThreadPoolExecutor(max_workers=max_downloads + max_muxes) as executor:
+            for future in [executor.submit(queue_worker) for _ in range(max_downloads + max_muxes)]:
+                future.result()
+
+    get_metadata_cache().flush()
+    print(f"\n{batch_metrics.report()}")
+    success_count = sum(results)
+    return success_count, len(results) - success_count
+
+
+def run_download_batch(urls, preferred_quality_id, max_downloads=None, max_muxes=None):
+    """展开链接后交给下载引擎执行（安装了 aiohttp 时使用异步引擎），返回 (成功数, 失败数)。"""
+    print("\n正在展开多P视频、合集和收藏夹链接...")
+    video_urls = expand_urls(urls)
+    print(f"共 {len(video_urls)} 个视频待处理。")
+    if USE_ASYNC_ENGINE and aiohttp is not None:
+        return run_batch_async(video_urls, preferred_quality_id, max_downloads, max_muxes)
+    return run_batch(video_urls, preferred_quality_id, max_downloads, max_muxes)
+
+
+# ---- 命令行入口：非交互批量模式（可用于 cron 等定时任务） ----
+def cli(argv=None):
+    """非交互模式：从命令行参数或URL列表文件读取链接，下载完成后退出。全部成功返回 0，否则返回 1。"""
+    quality_help = '，'.join(f"{qid}={name}" for qid, name in QUALITY_MAP.items())
+    parser = argparse.ArgumentParser(description='B站视频批量下载器（非交互模式）')
+    parser.add_argument('urls', nargs='*', help='视频/多P视频/合集/系列/收藏夹链接或BV号')
+    parser.add_argument('-i', '--input', help='URL列表文件，每行一个，# 开头的行为注释；为 - 时从标准输入读取')
+    parser.add_argument('-q', '--quality', type=int, default=0, help=f'期望清晰度ID，0 为自动选择最高 ({quality_help})')
+    parser.add_argument('--max-downloads', type=int, default=MAX_CONCURRENT_DOWNLOADS, help='同时下载的视频数')
+    parser.add_argument('--max-muxes', type=int, default=MAX_CONCURRENT_MUXES, help='同时合并的视频数')
+    parser.add_argument('--queue', nargs='?', const='', metavar='DB',
+                        help=f'使用持久化任务队列（默认 {QUEUE_DB_FILE}），重启后继续未完成的任务；不带URL时只执行队列中剩余任务')
+    parser.add_argument('--retry-failed', action='store_true', help='配合 --queue：把失败的任务重新加入队列')
+    parser.add_argument('--duplicates', action='store_true', help='列出下载库中同一视频的多个清晰度版本后退出')
+    args = parser.parse_args(argv)
+
+    if args.duplicates:
+        duplicates = get_library_index().duplicates()
+        for media_key, versions in duplicates.items():
+            print(media_key)
+            for quality, path, size in versions:
+                print(f"  [{QUALITY_MAP.get(quality, quality)}] {size / 1024 / 1024:.1f} MB  {path}")
+        print(f"共 {len(duplicates)} 个视频有多个清晰度版本。")
+        return 0
+
+    urls = list(args.urls)
+    if args.input:
+        f = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8')
+        with f:
+            urls += [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    urls = [u if u.startswith('http') else VIDEO_URL_TEMPLATE.format(u) for u in dict.fromkeys(urls)]
+
+    if args.queue is not None:
+        queue = JobQueue(args.queue or os.path.join(get_program_dir(), QUEUE_DB_FILE))
+        try:
+            if urls:
+                print("\n正在展开多P视频、合集和收藏夹链接...")
+                print(f"已加入 {queue.add(expand_urls(urls), args.quality, args.retry_failed)} 个新任务。")
+            elif args.retry_failed:
+                queue.add([], args.quality, retry_failed=True)
+            success_count, fail_count = run_queue(queue, args.max_downloads, args.max_muxes)
+            counts = queue.counts()
+        finally:
+            queue.close()
+        print(f"\n{'=' * 20}\n队列执行完毕！本次成功: {success_count}，失败: {fail_count}")
+        print('队列状态: ' + '，'.join(f"{state} {count}" for state, count in counts.items()))
+        return 0 if fail_count == 0 else 1
+
+    if not urls:
+        parser.error('没有提供任何URL')
+
+    success_count, fail_count = run_download_batch(urls, args.quality, args.max_downloads, args.max_muxes)
+    print(f"\n{'=' * 20}\n任务已完成！成功: {success_count}，失败: {fail_count}")
+    return 0 if fail_count == 0 else 1
 
 
 # ---- 主函数：重构为“收集-执行”循环 ----
@@ -221,7 +2315,7 @@ def main():
         print("\n" + "#" * 60)
         print("### BiliBili 批量下载器 (命令触发版) ###".center(60))
         print("#" * 60)
-        print("请逐行输入B站视频URL，每输入一个后按回车。")
+        print("请逐行输入B站视频URL（也支持BV号、多P视频、合集/系列和收藏夹链接），每输入一个后按回车。")
         print("\n可用命令:")
         print("  'ok' 或 'start'   : 开始下载已添加的全部视频")
         print("  'list'            : 查看已添加的URL列表")
@@ -260,7 +2354,8 @@ def main():
                 print("URL列表已清空。")
                 continue
 
-            elif user_input.startswith('http'):
+            elif user_input.startswith('http') or re.fullmatch(r'BV[0-9A-Za-z]{10}', user_input):
+                if not user_input.startswith('http'): user_input = VIDEO_URL_TEMPLATE.format(user_input)
                 if user_input not in urls_to_download:
                     urls_to_download.append(user_input)
                     print(f"  -> 已添加第 {len(urls_to_download)} 个URL。")
@@ -301,18 +2396,9 @@ def main():
         else:
             print("\n已选择: **自动选择最高清晰度**")
 
-        # --- STAGE 3: 执行下载任务 ---
-        success_count = 0
-        fail_count = 0
-        total_videos = len(urls_to_download)
-
-        for i, url in enumerate(urls_to_download):
-            print(f"\n--- 开始处理第 {i + 1} / {total_videos} 个视频 ---")
-            if process_single_video(url, preferred_quality_id):
-                success_count += 1
-            else:
-                fail_count += 1
-                print(f"--- 第 {i + 1} / {total_videos} 个视频处理失败 ---")
+        # --- STAGE 3: 展开链接并执行下载任务（流水线：下载与合并并行） ---
+        success_count, fail_count = run_download_batch(urls_to_download, preferred_quality_id)
+        total_videos = success_count + fail_count
 
         # --- STAGE 4: 总结并准备下一轮 ---
         print(f"\n{'=' * 20}\n本轮任务已完成！")
@@ -327,4 +2413,7 @@ def main():
 
 
 if __name__ == "__main__":
+    # 带命令行参数时以非交互模式运行，否则进入交互式菜单
+    if len(sys.argv) > 1:
+        sys.exit(cli())
     main()
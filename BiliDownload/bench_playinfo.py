@@ -0,0 +1,77 @@
+"""
+playinfo 解析基准测试：对比旧的“整页正则 + 完整 json.loads”与 PlayinfoExtractor 增量解析。
+
+用法:
+    python bench_playinfo.py [保存的页面.html ...]
+
+不传参数时使用一个合成的示例页面（约 1MB，结构与B站视频页一致）。
+输出每个页面的平均解析耗时和峰值内存（tracemalloc 统计）。
+"""
+import json
+import re
+import sys
+import time
+import tracemalloc
+
+from BiliDownload import PlayinfoExtractor
+
+CHUNK_SIZE = 64 * 1024
+
+
+def legacy_parse(res):
+    """旧实现：整页保存为字符串，正则匹配标题和 playinfo，再完整 json.loads。"""
+    match = re.search(r'<title.*?>(.*?)_哔哩哔哩_bilibili</title>', res)
+    title = match.group(1).strip() if match else ""
+    playinfo = json.loads(re.search(r'<script>window.__playinfo__=({.*?})</script>', res).group(1))
+    dash = playinfo.get('data', {}).get('dash', {})
+    return title, dash.get('video', []), dash.get('audio', [])
+
+
+def extractor_parse(chunks):
+    """新实现：逐块喂入，playinfo 结束后停止读取。"""
+    extractor = PlayinfoExtractor()
+    for chunk in chunks:
+        if extractor.feed(chunk): break
+    return extractor.result()
+
+
+def make_sample_page():
+    stream = {'id': 80, 'codecid': 7, 'height': 1080, 'bandwidth': 3000000,
+              'baseUrl': 'https://upos-sz-mirror.bilivideo.com/upgcxcode/x.m4s?deadline=1999999999&' + 'e' * 300,
+              'backupUrl': ['https://upos-sz-mirrorcos.bilivideo.com/x.m4s?' + 'e' * 300] * 2,
+              'segment_base': {'initialization': '0-1000', 'index_range': '1001-2000'}}
+    playinfo = {'code': 0, 'data': {
+        'support_formats': [{'quality': q, 'new_description': '清晰度', 'codecs': ['avc1', 'hev1']} for q in range(40)],
+        'dash': {'duration': 600, 'video': [dict(stream, id=q) for q in (120, 116, 80, 64, 32, 16) for _ in range(3)],
+                 'audio': [dict(stream, id=a) for a in (30280, 30232, 30216)]}}}
+    return ('<html><head><title data-vue-meta="true">示例视频_哔哩哔哩_bilibili</title>'
+            + '<meta content="x">' * 2000 + '</head><body>'
+            + '<script>window.__playinfo__=' + json.dumps(playinfo, ensure_ascii=False) + '</script>'
+            + '<script>window.__INITIAL_STATE__=' + json.dumps({'comments': ['评论' * 50] * 5000}, ensure_ascii=False)
+            + '</script></body></html>')
+
+
+def measure(func, arg, repeat):
+    tracemalloc.start()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for _ in range(repeat): func(arg)
+    return (time.perf_counter() - start) / repeat * 1000, peak / 1024 / 1024
+
+
+def main():
+    pages = [(path, open(path, 'rb').read()) for path in sys.argv[1:]] or [('合成示例页面', make_sample_page().encode())]
+    print(f"{'页面':<24}{'大小(MB)':>10}{'方法':>12}{'耗时(ms)':>12}{'峰值内存(MB)':>16}")
+    for name, raw in pages:
+        chunks = [raw[i:i + CHUNK_SIZE] for i in range(0, len(raw), CHUNK_SIZE)]
+        # 旧实现需要先把整页解码为字符串（对应 requests 的 .text），这部分也计入
+        for label, func, arg in (('正则', lambda r: legacy_parse(r.decode('utf-8')), raw),
+                                 ('增量解析', extractor_parse, chunks)):
+            elapsed, peak = measure(func, arg, repeat=20)
+            print(f"{name[:22]:<24}{len(raw) / 1024 / 1024:>10.2f}{label:>12}{elapsed:>12.2f}{peak:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
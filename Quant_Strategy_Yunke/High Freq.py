@@ -1,10 +1,9 @@
-import os
-import requests
-import pandas as pd
-import numpy as np
-import datetime as dt
 import backtrader as bt
 import warnings
+from ohlcv_store import load_binance_klines_many
+from indicators import RollingQuantile
+from result_cache import run_cached
+from analytics import summarize, format_duration
 
 # 忽略警告
 warnings.filterwarnings("ignore")
@@ -15,7 +14,7 @@ warnings.filterwarnings("ignore")
 # 建议使用 SOL vs ETH，波动率更高，空间更大
 SYMBOL_A = 'SOLUSDT'
 SYMBOL_B = 'ETHUSDT'
-INTERVAL = '1m'
+INTERVAL = '1m'  # 秒级 ('1s' / '5s') K 线可用 trade_bars.py 从逐笔成交生成后写入行情仓库
 START_DATE = '2026-01-01'
 END_DATE = '2026-01-10'
 
@@ -24,44 +23,12 @@ END_DATE = '2026-01-10'
 COMMISSION = 0.0004
 START_CASH = 100000.0
 PORTFOLIO_USE_PERCENT = 0.2  # 每次动用 20% 资金
+USE_RESULT_CACHE = True  # 策略代码、参数、资金设置和行情都没变时直接读取上次的回测结果
 
 
 # ==========================================
 # 【2. 数据引擎：抓取与相似度预检】
 # ==========================================
-def fetch_binance_1m(symbol, start_str, end_str):
-    cache_file = f"binance_{symbol}_{INTERVAL}_{start_str}_{end_str}.csv"
-    if os.path.exists(cache_file):
-        return pd.read_csv(cache_file, index_col=0, parse_dates=True)
-
-    url = 'https://api.binance.com/api/v3/klines'
-    start_dt = dt.datetime.strptime(start_str, '%Y-%m-%d')
-    end_dt = dt.datetime.strptime(end_str, '%Y-%m-%d')
-    all_dfs = []
-    curr_start = start_dt
-
-    print(f"正在从币安抓取 {symbol} 1分钟数据...")
-    while curr_start < end_dt:
-        params = {'symbol': symbol, 'interval': INTERVAL,
-                  'startTime': int(curr_start.timestamp() * 1000), 'limit': 1000}
-        try:
-            res = requests.get(url, params=params).json()
-            if not res or 'code' in res: break
-            df = pd.DataFrame(res).iloc[:, :6]
-            df.columns = ['time', 'open', 'high', 'low', 'close', 'volume']
-            df['time'] = pd.to_datetime(df['time'], unit='ms')
-            df.set_index('time', inplace=True)
-            all_dfs.append(df)
-            curr_start = df.index[-1] + dt.timedelta(minutes=1)
-        except:
-            break
-
-    if not all_dfs: return None
-    full_df = pd.concat(all_dfs).astype(float)
-    full_df.to_csv(cache_file)
-    return full_df
-
-
 def analyze_similarity(df_a, df_b):
     correlation = df_a['close'].corr(df_b['close'])
     print('\n' + '═' * 55)
@@ -87,26 +54,18 @@ class FeeAwareDynamicStrategy(bt.Strategy):
         self.mean = bt.ind.SMA(self.ratio, period=200)
         self.std = bt.ind.StdDev(self.ratio, period=200)
         self.zscore = (self.ratio - self.mean) / self.std
+        # 动态入场阈值：最近 lookback 根 z 值的分位数（指标预热完成前不会调用 next）
+        self.z_quantile = RollingQuantile(self.zscore, period=self.params.lookback, q=self.params.q_entry)
 
-        self.z_history = []
         self.current_level = 0
         self.entry_ratio = 0
         self.side = 0
 
     def next(self):
         z = self.zscore[0]
-        self.z_history.append(z)
-
-        # 确保历史数据足够
-        if len(self.z_history) < self.params.lookback:
-            return
-
-        recent_z = self.z_history[-self.params.lookback:]
-
-        # 动态计算入场阈值
-        upper_threshold = np.percentile(recent_z, self.params.q_entry * 100)
-        lower_threshold = np.percentile(recent_z, (1 - self.params.q_entry) * 100)
-        median_z = np.percentile(recent_z, 50)
+        upper_threshold = self.z_quantile.upper[0]
+        lower_threshold = self.z_quantile.lower[0]
+        median_z = self.z_quantile.median[0]
 
         # 仓位大小计算
         cash = self.broker.getvalue()
@@ -156,9 +115,9 @@ class FeeAwareDynamicStrategy(bt.Strategy):
 # 【4. 运行回测与报告】
 # ==========================================
 if __name__ == '__main__':
-    # 数据加载
-    df_a = fetch_binance_1m(SYMBOL_A, START_DATE, END_DATE)
-    df_b = fetch_binance_1m(SYMBOL_B, START_DATE, END_DATE)
+    # 数据加载：从共享行情仓库读取，两个标的缺失的时段同时并发抓取
+    frames = load_binance_klines_many([SYMBOL_A, SYMBOL_B], INTERVAL, START_DATE, END_DATE)
+    df_a, df_b = (frames[s] if not frames[s].empty else None for s in (SYMBOL_A, SYMBOL_B))
 
     if df_a is not None and df_b is not None:
         common = df_a.index.intersection(df_b.index)
@@ -173,27 +132,17 @@ if __name__ == '__main__':
         cerebro.broker.setcash(START_CASH)
         cerebro.broker.setcommission(commission=COMMISSION)
 
-        # 分析器
-        cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='ta')
-        cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe', annualize=True)
-        cerebro.addanalyzer(bt.analyzers.DrawDown, _name='dd')
-
         print("🚀 正在执行优化后的高频回测...")
-        results = cerebro.run()
-        strat = results[0]
-
-        # 输出结果
-        ta = strat.analyzers.ta.get_analysis()
-        total_trades = ta.total.closed if 'total' in ta else 0
-        final_v = cerebro.broker.getvalue()
-        sharpe = strat.analyzers.sharpe.get_analysis().get('sharperatio', 0)
-        max_dd = strat.analyzers.dd.get_analysis().max.drawdown
-
-        # 计算 CAGR
-        start_dt = dt.datetime.strptime(START_DATE, '%Y-%m-%d')
-        end_dt = dt.datetime.strptime(END_DATE, '%Y-%m-%d')
-        years = (end_dt - start_dt).days / 365.25
-        cagr = (pow(final_v / START_CASH, 1 / years) - 1) * 100 if years > 0 else 0
+        record = run_cached(cerebro, refresh=not USE_RESULT_CACHE)
+        if record.cached: print("（策略与行情均未变化，使用缓存的回测结果）")
+
+        # 输出结果（按 1m K 线的真实间隔年化）
+        stats = summarize(record.recording, riskfreerate=0.01)
+        total_trades = stats['trades']
+        final_v = record.final_value
+        sharpe = stats['sharpe']
+        sortino = stats['sortino']
+        underwater = format_duration(stats['max_drawdown_duration'])
 
         print('\n' + '█' * 55)
         print(f'   【 优化版高频套利报告: {SYMBOL_A} / {SYMBOL_B} 】')
@@ -203,15 +152,18 @@ if __name__ == '__main__':
         print(f' • 初始资产     :  {START_CASH:,.2f}')
         print(f' • 最终资产     :  {final_v:,.2f}')
         print(f' • 累计收益率   :  {(final_v - START_CASH) / START_CASH * 100:.2f}%')
-        print(f' • 年化收益率   :  {cagr:.2f}%')
-        print(f' • 夏普比率     :  {sharpe:.2f}')
-        print(f' • 最大回撤     :  {max_dd:.2f}%')
+        print(f' • 年化收益率   :  {stats["cagr"]:.2f}%')
+        print(f' • 夏普比率     :  {sharpe:.2f}' if sharpe is not None else ' • 夏普比率     :  N/A')
+        print(f' • 索提诺比率   :  {sortino:.2f}' if sortino is not None else ' • 索提诺比率   :  N/A')
+        print(f' • 最大回撤     :  {stats["max_drawdown"]:.2f}% (最长水下 {underwater})')
+        print(f' • 手续费合计   :  {stats["fees"]:,.2f}')
         print('█' * 55 + '\n')
 
-        # 绘图
-        try:
-            cerebro.plot(style='candle', lookback=1000)
-        except:
-            print("绘图失败，请检查环境。")
+        # 绘图（命中缓存时回测没有运行，无法绘图）
+        if not record.cached:
+            try:
+                cerebro.plot(style='candle', lookback=1000)
+            except:
+                print("绘图失败，请检查环境。")
     else:
         print("数据获取失败。")
\ No newline at end of file
@@ -1,4 +1,3 @@
-import os
 import pandas as pd
 import datetime as dt
 import warnings
@@ -6,6 +5,10 @@ import yfinance as yf
 import backtrader as bt
 import matplotlib.pyplot as plt
 import akshare as ak  # 新增 A 股数据源
+from ohlcv_store import STORE, empty_fetch_result
+from indicator_cache import cached_feed, cached_line
+from result_cache import run_cached
+from analytics import summarize
 
 # ==========================================
 # 【1. 全局配置开关】
@@ -16,6 +19,7 @@ STRATEGY_CHOICE = 'MOM'
 
 SHOW_TRADE_LOG = False
 SHOW_FINAL_REPORT = True
+USE_RESULT_CACHE = True  # 策略代码、参数、资金设置和行情都没变时直接读取上次的回测结果
 
 START_CASH = 100000.0
 # A股佣金通常在万分之三左右，印花税卖出时千分之一
@@ -76,26 +80,32 @@ def fetch_akshare_data(symbol, start_str, end_str):
         return None
 
 
-def load_data_unified(symbol):
-    if not symbol: return None
-    cache_file = f"{DATA_SOURCE}_{symbol}_{START_DATE}_{END_DATE}.csv"
-
-    if os.path.exists(cache_file):
-        return pd.read_csv(cache_file, index_col=0, parse_dates=True)
-
+def download_data(symbol, start, end):
+    """
+    从数据源下载 [start, end) 的日线，由行情仓库在缺少该时段时调用。返回 None 表示下载失败（不登记覆盖，下次重试）。
+    """
     df = None
     if DATA_SOURCE == 'AKSHARE':
-        df = fetch_akshare_data(symbol, START_DATE, END_DATE)
+        # AKShare 的结束日期包含当天；请求成功但没有数据（休市）时返回空表，该时段照常登记
+        df = fetch_akshare_data(symbol, start.strftime('%Y%m%d'), (end - dt.timedelta(days=1)).strftime('%Y%m%d'))
+        if df is not None and df.empty: return pd.DataFrame(columns=['open', 'high', 'low', 'close', 'volume'])
     elif DATA_SOURCE == 'YAHOO':
         # Yahoo Finance A股需加后缀 .SZ (深证) 或 .SS (上证)
         yf_symbol = symbol + (".SZ" if symbol.startswith("0") or symbol.startswith("3") else ".SS")
-        df = yf.download(yf_symbol, start=START_DATE, end=END_DATE, auto_adjust=True)
+        df = yf.download(yf_symbol, start=start, end=end, auto_adjust=True)
+        # yfinance 出错时只打印错误并返回空表，无法与休市区分，按时段长短判断
+        if df is not None and df.empty: return empty_fetch_result(start, end)
+    return clean_dataframe(df) if df is not None and not df.empty else None
 
-    if df is not None and not df.empty:
-        df = clean_dataframe(df)
-        df.to_csv(cache_file)
-        return df
-    return None
+
+def load_data_unified(symbol):
+    if not symbol: return None
+    # END_DATE 按 A 股习惯包含当天，行情仓库的区间为左闭右开
+    end = dt.datetime.strptime(END_DATE, '%Y%m%d') + dt.timedelta(days=1)
+    # AKShare qfq 与 yfinance auto_adjust 都是复权价，仓库补缺口时检查复权基准是否变化
+    df = STORE.load(DATA_SOURCE, symbol, '1d', START_DATE, end, lambda start, end: download_data(symbol, start, end),
+                    adjusted=True)
+    return df if not df.empty else None
 
 
 # ==========================================
@@ -113,8 +123,8 @@ class MaCrossStrategy(BaseStrategy):
     params = (('fast', 5), ('slow', 30))
 
     def __init__(self):
-        self.inds = {d: bt.ind.CrossOver(bt.ind.SMA(d, period=self.params.fast),
-                                         bt.ind.SMA(d, period=self.params.slow)) for d in self.datas}
+        self.inds = {d: bt.ind.CrossOver(cached_line(d, 'sma', period=self.params.fast),
+                                         cached_line(d, 'sma', period=self.params.slow)) for d in self.datas}
 
     def next(self):
         for d in self.datas:
@@ -130,7 +140,7 @@ class UltimateStrategy(BaseStrategy):
     params = (('p1', 7), ('p2', 14), ('p3', 28), ('low', 30), ('high', 70))
 
     def __init__(self):
-        self.ult = {d: bt.ind.UltimateOscillator(d, p1=self.params.p1, p2=self.params.p2, p3=self.params.p3) for d in
+        self.ult = {d: cached_line(d, 'ultosc', p1=self.params.p1, p2=self.params.p2, p3=self.params.p3) for d in
                     self.datas}
 
     def next(self):
@@ -152,7 +162,8 @@ if __name__ == '__main__':
         cerebro = bt.Cerebro()
 
         # 加载数据
-        data_feed = bt.feeds.PandasData(dataname=target_data)
+        # 均线预先计算并缓存，作为额外的 line 随数据源传入策略
+        data_feed = cached_feed(target_data, [('sma', dict(period=5)), ('sma', dict(period=30))])
         cerebro.adddata(data_feed, name=TARGET_SYMBOL)
 
         # A股交易规则：最少买100股 (1手)
@@ -168,21 +179,16 @@ if __name__ == '__main__':
         # 模拟 A 股印花税和佣金：这里设置 0.1% 综合费率
         cerebro.broker.setcommission(commission=COMMISSION)
 
-        # 分析器
-        cerebro.addanalyzer(bt.analyzers.DrawDown, _name='dd')
-        cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe',
-                            riskfreerate=0.03, annualize=True, timeframe=bt.TimeFrame.Days)
-
         print(f"--- 启动回测 | 策略: {STRATEGY_CHOICE} | 目标: {TARGET_SYMBOL} (格力电器) ---")
-        results = cerebro.run()
-        strat = results[0]
+        # 打开交易日志时总是重新运行，否则策略与行情都没变时直接读取上次的回测结果
+        record = run_cached(cerebro, refresh=SHOW_TRADE_LOG or not USE_RESULT_CACHE)
+        if record.cached: print("（策略与行情均未变化，使用缓存的回测结果）")
 
         if SHOW_FINAL_REPORT:
-            final_v = cerebro.broker.getvalue()
+            final_v = record.final_value
             total_ret = (final_v - START_CASH) / START_CASH
 
-            dd_stats = strat.analyzers.dd.get_analysis()
-            sharpe_stats = strat.analyzers.sharpe.get_analysis()
+            stats = summarize(record.recording, riskfreerate=0.03)
 
             print('\n' + '█' * 50)
             print(f'   【 A 股市场回测总结报告 】')
@@ -191,14 +197,16 @@ if __name__ == '__main__':
             print(f' • 初始资产     :  {START_CASH:,.2f}')
             print(f' • 最终资产     :  {final_v:,.2f}')
             print(f' • 累计收益率   :  {total_ret * 100:.2f}%')
-            print(f' • 最大资金回撤 :  {dd_stats.max.drawdown:.2f}%')
-            print(f' • 夏普比率     :  {sharpe_stats.get("sharperatio", 0):.2f}')
+            print(f' • 年化收益率   :  {stats["cagr"]:.2f}% (CAGR)')
+            print(f' • 最大资金回撤 :  {stats["max_drawdown"]:.2f}%')
+            print(f' • 夏普比率     :  {stats["sharpe"] or 0.0:.2f}')
             print('█' * 50 + '\n')
 
-        # 解决 macOS/Windows 绘图可能报错的问题
-        try:
-            cerebro.plot(style='candle', iplot=False)
-        except:
-            print("绘图失败，请检查图形库配置。")
+        # 解决 macOS/Windows 绘图可能报错的问题（命中缓存时回测没有运行，无法绘图）
+        if not record.cached:
+            try:
+                cerebro.plot(style='candle', iplot=False)
+            except:
+                print("绘图失败，请检查图形库配置。")
     else:
         print("错误：数据加载失败。")
\ No newline at end of file
@@ -1,11 +1,12 @@
-import os
-import requests
 import pandas as pd
-import datetime as dt
 import warnings
 import yfinance as yf
 import backtrader as bt
 import matplotlib.pyplot as plt
+from ohlcv_store import STORE, empty_fetch_result, fetch_binance_klines
+from indicator_cache import cached_feed, cached_line
+from result_cache import run_cached
+from analytics import summarize
 
 # ==========================================
 # 【1. 全局配置开关】
@@ -15,10 +16,12 @@ STRATEGY_CHOICE = 'MA'
 
 SHOW_TRADE_LOG = False
 SHOW_FINAL_REPORT = True
+USE_RESULT_CACHE = True  # 策略代码、参数、资金设置和行情都没变时直接读取上次的回测结果
 
 START_CASH = 100000.0
 COMMISSION = 0.001
 POSITION_PERCENT = 50
+USE_INDICATOR_CACHE = True  # 指标预先计算并缓存，作为额外的 line 随数据源传入策略
 
 # --- 时间与标的 ---
 START_DATE = '2022-06-01'
@@ -50,46 +53,24 @@ def clean_dataframe(df):
     return df.astype(float)
 
 
-def fetch_binance_data(symbol, start_str, end_str):
-    url = 'https://api.binance.com/api/v3/klines'
-    start_dt = dt.datetime.strptime(start_str, '%Y-%m-%d')
-    end_dt = dt.datetime.strptime(end_str, '%Y-%m-%d')
-    all_dfs = []
-    curr_start = start_dt
-    while curr_start < end_dt:
-        start_ms = int(curr_start.timestamp() * 1000)
-        end_ms = int(end_dt.timestamp() * 1000)
-        params = {'symbol': symbol, 'interval': '1d', 'startTime': start_ms, 'endTime': end_ms, 'limit': 1000}
-        try:
-            res = requests.get(url, params=params)
-            data = res.json()
-            if not data or 'code' in data: break
-            tmp_df = pd.DataFrame(data).iloc[:, 0:6]
-            tmp_df.columns = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
-            tmp_df.index = pd.to_datetime(tmp_df['timestamp'], unit='ms')
-            all_dfs.append(tmp_df)
-            curr_start = tmp_df.index[-1] + dt.timedelta(minutes=1)
-            if len(tmp_df) < 1000: break
-        except:
-            break
-    return pd.concat(all_dfs) if all_dfs else None
+def download_data(symbol, start, end):
+    """
+    从数据源下载 [start, end) 的日线，由行情仓库在缺少该时段时调用。返回 None 表示下载失败（不登记覆盖，下次重试）。
+    """
+    if DATA_SOURCE == 'BINANCE':
+        df = fetch_binance_klines(symbol, '1d', start, end)  # 失败时抛出异常，空表表示该时段确实没有数据
+        return clean_dataframe(df) if not df.empty else df
+    # yfinance 出错时只打印错误并返回空表，无法与休市区分，按时段长短判断
+    df = yf.download(symbol, start=start, end=end, auto_adjust=True)
+    return clean_dataframe(df) if df is not None and not df.empty else empty_fetch_result(start, end)
 
 
 def load_data_unified(symbol):
     if not symbol: return None
-    cache_file = f"{DATA_SOURCE}_{symbol}_{START_DATE}_{END_DATE}.csv"
-    if os.path.exists(cache_file):
-        return pd.read_csv(cache_file, index_col=0, parse_dates=True)
-    df = None
-    if DATA_SOURCE == 'BINANCE':
-        df = fetch_binance_data(symbol, START_DATE, END_DATE)
-    else:
-        df = yf.download(symbol, start=START_DATE, end=END_DATE, auto_adjust=True)
-    if df is not None and not df.empty:
-        df = clean_dataframe(df)
-        df.to_csv(cache_file)
-        return df
-    return None
+    # yfinance 的 auto_adjust 价格为复权价，仓库补缺口时检查复权基准是否变化
+    df = STORE.load(DATA_SOURCE, symbol, '1d', START_DATE, END_DATE,
+                    lambda start, end: download_data(symbol, start, end), adjusted=DATA_SOURCE != 'BINANCE')
+    return df if not df.empty else None
 
 
 # ==========================================
@@ -107,8 +88,8 @@ class MaCrossStrategy(BaseStrategy):
     params = (('fast', 5), ('slow', 30))
 
     def __init__(self):
-        self.inds = {d: bt.ind.CrossOver(bt.ind.SMA(d, period=self.params.fast),
-                                         bt.ind.SMA(d, period=self.params.slow)) for d in self.datas}
+        self.inds = {d: bt.ind.CrossOver(cached_line(d, 'sma', period=self.params.fast),
+                                         cached_line(d, 'sma', period=self.params.slow)) for d in self.datas}
 
     def next(self):
         for d in self.datas:
@@ -123,7 +104,7 @@ class UltimateStrategy(BaseStrategy):
     params = (('p1', 7), ('p2', 14), ('p3', 28), ('low', 30), ('high', 70))
 
     def __init__(self):
-        self.ult = {d: bt.ind.UltimateOscillator(d, p1=self.params.p1, p2=self.params.p2, p3=self.params.p3) for d in
+        self.ult = {d: cached_line(d, 'ultosc', p1=self.params.p1, p2=self.params.p2, p3=self.params.p3) for d in
                     self.datas}
 
     def next(self):
@@ -139,7 +120,7 @@ class MomentumStrategy(BaseStrategy):
     params = (('low', 30), ('high', 70))
 
     def __init__(self):
-        self.ultosc = bt.ind.UltimateOscillator(self.datas[0])
+        self.ultosc = cached_line(self.datas[0], 'ultosc', p1=7, p2=14, p3=28)
         self.market_close = self.datas[1].close
 
     def next(self):
@@ -150,6 +131,14 @@ class MomentumStrategy(BaseStrategy):
             self.close(data=self.datas[0])
 
 
+# 各策略默认参数下用到的指标 (与 cached_line 的调用对应)
+STRATEGY_INDICATORS = {
+    'MA': [('sma', dict(period=5)), ('sma', dict(period=30))],
+    'ULTOSC': [('ultosc', dict(p1=7, p2=14, p3=28))],
+    'MOM': [('ultosc', dict(p1=7, p2=14, p3=28))],
+}
+
+
 # ==========================================
 # 【4. 主运行程序】
 # ==========================================
@@ -159,7 +148,10 @@ if __name__ == '__main__':
 
     if target_data is not None:
         cerebro = bt.Cerebro()
-        cerebro.adddata(bt.feeds.PandasData(dataname=target_data), name=TARGET_SYMBOL)
+        if USE_INDICATOR_CACHE:
+            cerebro.adddata(cached_feed(target_data, STRATEGY_INDICATORS[STRATEGY_CHOICE]), name=TARGET_SYMBOL)
+        else:
+            cerebro.adddata(bt.feeds.PandasData(dataname=target_data), name=TARGET_SYMBOL)
         if STRATEGY_CHOICE == 'MOM' and market_data is not None:
             cerebro.adddata(bt.feeds.PandasData(dataname=market_data), name=MARKET_SYMBOL)
 
@@ -169,35 +161,21 @@ if __name__ == '__main__':
         cerebro.broker.setcommission(commission=COMMISSION)
         cerebro.addsizer(bt.sizers.PercentSizer, percents=POSITION_PERCENT)
 
-        # 分析器
-        cerebro.addanalyzer(bt.analyzers.DrawDown, _name='dd')
-        cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe', riskfreerate=0.02, annualize=True,
-                            timeframe=bt.TimeFrame.Days)
-
         print(f"--- 启动回测 | 策略: {STRATEGY_CHOICE} | 目标: {TARGET_SYMBOL} ---")
-        results = cerebro.run()
-        strat = results[0]
+        # 打开交易日志时总是重新运行，否则策略与行情都没变时直接读取上次的回测结果
+        record = run_cached(cerebro, refresh=SHOW_TRADE_LOG or not USE_RESULT_CACHE)
+        if record.cached: print("（策略与行情均未变化，使用缓存的回测结果）")
 
         # --- 总结计算 ---
         if SHOW_FINAL_REPORT:
-            final_v = cerebro.broker.getvalue()
+            final_v = record.final_value
             total_ret = (final_v - START_CASH) / START_CASH
 
-            # 1. 计算回测跨越的年数
-            start_dt = dt.datetime.strptime(START_DATE, '%Y-%m-%d')
-            end_dt = dt.datetime.strptime(END_DATE, '%Y-%m-%d')
-            duration_years = (end_dt - start_dt).days / 365.25
-
-            # 2. 计算年化收益率 (CAGR)
-            # 公式: (最终价值/初始价值)^(1/年数) - 1
-            if duration_years > 0:
-                annual_ret = (pow(final_v / START_CASH, 1 / duration_years) - 1) * 100
-            else:
-                annual_ret = 0.0
-
-            dd_stats = strat.analyzers.dd.get_analysis()
-            sharpe_stats = strat.analyzers.sharpe.get_analysis()
-            sharpe_ratio = sharpe_stats.get('sharperatio', 0)
+            # 年数、年化收益率 (CAGR) 和夏普比率都按实际的首尾 K 线时间计算
+            stats = summarize(record.recording, riskfreerate=0.02)
+            duration_years = stats['years']
+            annual_ret = stats['cagr']
+            sharpe_ratio = stats['sharpe'] or 0.0
 
             print('\n' + '█' * 50)
             print(f'   【 {STRATEGY_CHOICE} 策略回测总结报告 】')
@@ -208,13 +186,14 @@ if __name__ == '__main__':
             print(f' • 最终资产     :  {final_v:,.2f}')
             print(f' • 累计收益率   :  {total_ret * 100:.2f}%')
             print(f' • 年化收益率   :  {annual_ret:.2f}% (CAGR)')
-            print(f' • 最大资金回撤 :  {dd_stats.max.drawdown:.2f}%')
+            print(f' • 最大资金回撤 :  {stats["max_drawdown"]:.2f}%')
             print(f' • 夏普比率     :  {sharpe_ratio:.2f}')
             print('█' * 50 + '\n')
 
-        try:
-            cerebro.plot(style='candle', iplot=False, barup='red', bardown='green')
-        except:
-            pass
+        if not record.cached:  # 命中缓存时回测没有运行，无法绘图
+            try:
+                cerebro.plot(style='candle', iplot=False, barup='red', bardown='green')
+            except:
+                pass
     else:
         print("错误：数据加载失败。")
\ No newline at end of file
@@ -1,10 +1,9 @@
-import os
-import requests
-import pandas as pd
-import numpy as np
-import datetime as dt
 import backtrader as bt
 import warnings
+from ohlcv_store import load_binance_klines
+from indicator_cache import cached_feed, cached_line
+from result_cache import run_cached
+from analytics import summarize, format_duration
 
 warnings.filterwarnings("ignore")
 
@@ -17,6 +16,8 @@ START_DATE = '2024-01-01'
 END_DATE = '2026-01-01'
 START_CASH = 100000.0
 COMMISSION = 0.0004
+USE_INDICATOR_CACHE = True  # 指标预先计算并缓存，作为额外的 line 随数据源传入策略
+USE_RESULT_CACHE = True  # 策略代码、参数、资金设置和行情都没变时直接读取上次的回测结果
 
 
 # ==========================================
@@ -33,16 +34,16 @@ class ScientificMultiFactor(bt.Strategy):
 
     def __init__(self):
         # 1. 核心过滤：长期均线
-        self.ema = bt.ind.EMA(period=self.params.ema_long)
+        self.ema = cached_line(self.data, 'ema', period=self.params.ema_long)
 
         # 2. 核心过滤：趋势强度
-        self.adx = bt.ind.ADX(period=self.params.adx_period)
+        self.adx = cached_line(self.data, 'adx', period=self.params.adx_period)
 
         # 3. 辅助动量：RSI
-        self.rsi = bt.ind.RSI(period=14)
+        self.rsi = cached_line(self.data, 'rsi', period=14)
 
         # 4. 仓位控制：ATR
-        self.atr = bt.ind.ATR(period=self.params.atr_period)
+        self.atr = cached_line(self.data, 'atr', period=self.params.atr_period)
 
         self.stop_price = 0
         self.highest_price = 0
@@ -84,63 +85,47 @@ class ScientificMultiFactor(bt.Strategy):
 
 
 # ==========================================
-# 【3. 运行逻辑】 (fetch_binance_data 保持不变)
+# 【3. 运行逻辑】 (K 线从共享行情仓库读取)
 # ==========================================
 def fetch_binance_data(symbol, interval, start_str, end_str):
-    cache_file = f"binance_{symbol}_{interval}_{start_str}_{end_str}.csv"
-    if os.path.exists(cache_file): return pd.read_csv(cache_file, index_col=0, parse_dates=True)
-    url = 'https://api.binance.com/api/v3/klines'
-    start_dt = dt.datetime.strptime(start_str, '%Y-%m-%d')
-    end_dt = dt.datetime.strptime(end_str, '%Y-%m-%d')
-    all_dfs = []
-    curr_start = start_dt
-    while curr_start < end_dt:
-        params = {'symbol': symbol, 'interval': interval, 'startTime': int(curr_start.timestamp() * 1000),
-                  'limit': 1000}
-        res = requests.get(url, params=params).json()
-        if not res or 'code' in res: break
-        df = pd.DataFrame(res).iloc[:, :6]
-        df.columns = ['time', 'open', 'high', 'low', 'close', 'volume']
-        df['time'] = pd.to_datetime(df['time'], unit='ms')
-        df.set_index('time', inplace=True)
-        all_dfs.append(df)
-        curr_start = df.index[-1] + dt.timedelta(hours=1)
-    full_df = pd.concat(all_dfs).astype(float)
-    full_df.to_csv(cache_file)
-    return full_df
+    return load_binance_klines(symbol, interval, start_str, end_str)
+
+
+def indicator_specs(ema_long=200, adx_period=14, atr_period=14):
+    """ScientificMultiFactor 在给定参数下用到的指标，传给 cached_feed。"""
+    return [('ema', dict(period=ema_long)), ('adx', dict(period=adx_period)), ('rsi', dict(period=14)),
+            ('atr', dict(period=atr_period))]
 
 
 if __name__ == '__main__':
     df_btc = fetch_binance_data(SYMBOL, INTERVAL, START_DATE, END_DATE)
     cerebro = bt.Cerebro()
-    cerebro.adddata(bt.feeds.PandasData(dataname=df_btc), name=SYMBOL)
+    feed = cached_feed(df_btc, indicator_specs()) if USE_INDICATOR_CACHE else bt.feeds.PandasData(dataname=df_btc)
+    cerebro.adddata(feed, name=SYMBOL)
     cerebro.addstrategy(ScientificMultiFactor)
     cerebro.broker.setcash(START_CASH)
     cerebro.broker.setcommission(commission=COMMISSION)
 
-    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='ta')
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe', annualize=True)
-    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='dd')
-
-    results = cerebro.run()
-    strat = results[0]
+    record = run_cached(cerebro, refresh=not USE_RESULT_CACHE)
+    if record.cached: print("（策略与行情均未变化，使用缓存的回测结果）")
 
     # --- 报告 ---
-    ta = strat.analyzers.ta.get_analysis()
-    final_v = cerebro.broker.getvalue()
-    total_closed = ta.total.closed if 'total' in ta else 0
-    sharpe = strat.analyzers.sharpe.get_analysis().get('sharperatio', 0)
-    max_dd = strat.analyzers.dd.get_analysis().max.drawdown
+    stats = summarize(record.recording, riskfreerate=0.01)  # 按 1h K 线的真实间隔年化
+    final_v = record.final_value
+    total_closed = stats['trades']
+    sharpe = stats['sharpe']
+    max_dd = stats['max_drawdown']
+    underwater = format_duration(stats['max_drawdown_duration'])
 
     print('\n' + '█' * 60)
     print(f'   【 科学调参版多因子策略报告 】')
     print('█' * 60)
     print(f' • 最终资产      :  {final_v:,.2f} ({((final_v - START_CASH) / START_CASH) * 100:.2f}%)')
-    print(f' • 夏普比率      :  {sharpe:.2f}')
-    print(f' • 最大回撤      :  {max_dd:.2f}%')
+    print(f' • 年化收益率    :  {stats["cagr"]:.2f}%')
+    print(f' • 夏普比率      :  {sharpe:.2f}' if sharpe is not None else ' • 夏普比率      :  N/A')
+    print(f' • 最大回撤      :  {max_dd:.2f}% (最长水下 {underwater})')
     print('------------------------------------------------------------')
     print(f' • 交易次数      :  {total_closed} 次 (目标：降低频率，单次重质)')
-
-    total_comm = abs(ta.pnl.net.total - ta.pnl.gross.total) if total_closed > 0 else 0
-    print(f' • 总手续费支出  :  {total_comm:,.2f}')
+    print(f' • 胜率/持仓占比 :  {stats["win_rate"]:.1f}% / {stats["exposure"]:.1f}%')
+    print(f' • 总手续费支出  :  {stats["fees"]:,.2f}')
     print('█' * 60 + '\n')
\ No newline at end of file
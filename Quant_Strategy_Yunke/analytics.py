@@ -0,0 +1,207 @@
+import math
+
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+# ==========================================
+# 【绩效分析】
+# 取代每根 K 线都在 Python 里更新的 TradeAnalyzer / SharpeRatio / DrawDown：
+# 回测时 Recorder 只记录每根 K 线的账户价值和每笔成交，结束后由 summarize() 一次性向量化计算
+# 夏普 / 索提诺比率、最大回撤及持续时间、年化收益率、换手率、手续费和交易统计。
+#
+# 年化按真实的 K 线时间计算：每年的 K 线数 = (K 线数 - 1) / 首尾间隔的年数，
+# 所以 1m / 1h 的加密货币（全天交易）和日线股票（每年约 252 根）都不需要手动指定周期。
+# 输入也可以是任意以时间为索引的资金曲线（如 vector_backtest 的结果），此时没有成交相关的统计。
+# ==========================================
+SECONDS_PER_YEAR = 365.25 * 86400
+BT_EPOCH_ORDINAL = 719163  # backtrader 浮点日期中 1970-01-01 的值
+
+
+class Recorder(bt.Analyzer):
+    """
+    每根 K 线只追加一次账户价值，成交在 notify_order 中记录为 (K 线序号, 数据源序号, 数量, 成交价, 手续费)。
+    get_analysis() 返回 {'equity': pd.Series, 'fills': DataFrame, 'start_cash': 初始资金}。
+    """
+    def start(self):
+        self.times, self.values, self.fills = [], [], []
+        self.start_cash = self.strategy.broker.startingcash
+        self.data_index = {data: i for i, data in enumerate(self.strategy.datas)}
+
+    def notify_order(self, order):
+        if order.status == order.Completed and order.executed.size:
+            executed = order.executed
+            self.fills.append((len(self.values), self.data_index[order.data], executed.size, executed.price,
+                               executed.comm))
+
+    def next(self):
+        self.times.append(self.data.datetime[0])
+        self.values.append(self.strategy.broker.getvalue())
+
+    def get_analysis(self):
+        days = np.asarray(self.times, dtype=float) - BT_EPOCH_ORDINAL
+        index = pd.DatetimeIndex(np.round(days * 86400e6).astype(np.int64) * 1000, name='time')  # 精确到微秒
+        fills = pd.DataFrame(self.fills, columns=['bar', 'asset', 'size', 'price', 'comm'])
+        return dict(equity=pd.Series(self.values, index=index, name='value'), fills=fills, start_cash=self.start_cash)
+
+
+# ==========================================
+# 【1. 逐项指标】 equity 为以时间为索引的账户价值序列
+# ==========================================
+def periods_per_year(index):
+    """按首尾时间估计每年的 K 线数。"""
+    if len(index) < 2: return 1.0
+    seconds = (index[-1] - index[0]).total_seconds()
+    return (len(index) - 1) / (seconds / SECONDS_PER_YEAR) if seconds > 0 else 1.0
+
+
+def bar_returns(equity, start_cash=None):
+    """每根 K 线的收益率。给出 start_cash 时第一根相对初始资金计算。"""
+    values = equity.to_numpy(dtype=float)
+    prev = np.r_[start_cash if start_cash is not None else values[0], values[:-1]]
+    return values / prev - 1.0
+
+
+def sharpe_ratio(returns, ppy, riskfreerate=0.0):
+    """年化夏普比率（年化无风险利率按复利折算到每根 K 线，样本标准差）。无法计算时返回 None。"""
+    excess = returns - (pow(1.0 + riskfreerate, 1.0 / ppy) - 1.0)
+    if len(excess) < 2: return None
+    dev = excess.std(ddof=1)
+    return float(excess.mean() / dev * math.sqrt(ppy)) if dev > 0 else None
+
+
+def sortino_ratio(returns, ppy, riskfreerate=0.0):
+    """年化索提诺比率：分母只计低于无风险收益的部分 (下行偏差)。"""
+    excess = returns - (pow(1.0 + riskfreerate, 1.0 / ppy) - 1.0)
+    if len(excess) < 2: return None
+    downside = math.sqrt(np.mean(np.minimum(excess, 0.0) ** 2))
+    return float(excess.mean() / downside * math.sqrt(ppy)) if downside > 0 else None
+
+
+def drawdown(equity):
+    """当前回撤 (%)，同 DrawDown 分析器：相对历史最高账户价值。"""
+    peak = np.maximum.accumulate(equity.to_numpy(dtype=float))
+    return pd.Series(100.0 * (peak - equity.to_numpy(dtype=float)) / peak, index=equity.index, name='drawdown')
+
+
+def max_drawdown_duration(equity):
+    """最长的水下时间：从创出新高到重新回到该高点（或数据结束）的间隔。"""
+    values = equity.to_numpy(dtype=float)
+    if not len(values): return pd.Timedelta(0)
+    at_peak = values >= np.maximum.accumulate(values)
+    peak_pos = np.maximum.accumulate(np.where(at_peak, np.arange(len(values)), 0))
+    prev_peak = np.r_[0, peak_pos[:-1]]
+    # 水下的 K 线以及刚回到高点的那一根，到上一次新高的时间
+    in_drawdown = ~at_peak | np.r_[False, ~at_peak[:-1]]
+    if not in_drawdown.any(): return pd.Timedelta(0)
+    times = equity.index.asi8
+    return pd.Timedelta(int((times[in_drawdown] - times[prev_peak[in_drawdown]]).max()), 'ns')
+
+
+def cagr(equity, start_cash=None):
+    """年化收益率 (%)，按首尾 K 线的真实时间。"""
+    if len(equity) < 2: return 0.0
+    years = (equity.index[-1] - equity.index[0]).total_seconds() / SECONDS_PER_YEAR
+    start = start_cash if start_cash is not None else float(equity.iloc[0])
+    return (pow(float(equity.iloc[-1]) / start, 1.0 / years) - 1.0) * 100.0 if years > 0 else 0.0
+
+
+def positions(fills, n_bars, n_assets=None):
+    """由成交还原每根 K 线收盘时各数据源的持仓，返回 (n_bars, n_assets) 数组。"""
+    n_assets = n_assets or (int(fills['asset'].max()) + 1 if len(fills) else 1)
+    delta = np.zeros((n_bars, n_assets))
+    np.add.at(delta, (fills['bar'].to_numpy(), fills['asset'].to_numpy()), fills['size'].to_numpy(dtype=float))
+    return np.cumsum(delta, axis=0)
+
+
+def trade_table(fills, eps=1e-12):
+    """
+    把成交按数据源拆成交易：持仓从 0 开始到回到 0 为一笔。返回每笔交易的
+    数据源、方向、开平仓 K 线、净盈亏（扣除手续费）和是否已平仓。一次成交直接反手的情况计入原来那笔交易。
+    """
+    if not len(fills):
+        return pd.DataFrame(columns=['asset', 'side', 'entry_bar', 'exit_bar', 'pnl', 'closed'])
+    df = fills.copy()
+    df['after'] = df.groupby('asset')['size'].cumsum()
+    df['opening'] = (df['after'] - df['size']).abs() <= eps
+    df['trade'] = df.groupby('asset')['opening'].cumsum()
+    df['flow'] = -df['size'] * df['price'] - df['comm']
+    trades = df.groupby(['asset', 'trade']).agg(side=('size', 'first'), entry_bar=('bar', 'first'),
+                                                 exit_bar=('bar', 'last'), pnl=('flow', 'sum'), after=('after', 'last'))
+    trades['side'] = np.sign(trades['side']).astype(int)
+    trades['closed'] = trades['after'].abs() <= eps
+    return trades.drop(columns='after').reset_index(level='asset').reset_index(drop=True)
+
+
+# ==========================================
+# 【2. 汇总】
+# ==========================================
+def summarize(recording, riskfreerate=0.0):
+    """
+    recording 为 Recorder.get_analysis() 的结果，或者一条资金曲线 (pd.Series)。返回指标 dict:
+    起止时间、年数、每年 K 线数、最终资产、累计 / 年化收益率 (%)、年化波动率 (%)、夏普、索提诺、
+    最大回撤 (%) 及最长水下时间、手续费、持仓时间占比 (%)、换手率（成交额 / 平均资产，年化）、
+    交易次数、胜率 (%)、盈亏比、平均每笔盈亏和持仓 K 线数。
+    """
+    if isinstance(recording, pd.Series): recording = dict(equity=recording, fills=None, start_cash=None)
+    equity, fills, start_cash = recording['equity'], recording['fills'], recording['start_cash']
+    if not len(equity): return {}
+    ppy = periods_per_year(equity.index)
+    returns = bar_returns(equity, start_cash)
+    start = start_cash if start_cash is not None else float(equity.iloc[0])
+    years = (equity.index[-1] - equity.index[0]).total_seconds() / SECONDS_PER_YEAR
+    stats = dict(
+        start=equity.index[0], end=equity.index[-1], years=years, periods_per_year=ppy,
+        final_value=float(equity.iloc[-1]), total_return=(float(equity.iloc[-1]) / start - 1.0) * 100.0,
+        cagr=cagr(equity, start_cash),
+        volatility=float(returns.std(ddof=1) * math.sqrt(ppy) * 100.0) if len(returns) > 1 else 0.0,
+        sharpe=sharpe_ratio(returns, ppy, riskfreerate), sortino=sortino_ratio(returns, ppy, riskfreerate),
+        max_drawdown=float(drawdown(equity).max()), max_drawdown_duration=max_drawdown_duration(equity),
+    )
+    if fills is None: return stats
+
+    held = np.abs(positions(fills, len(equity))).sum(axis=1) > 0
+    traded = float((fills['size'].abs() * fills['price']).sum())
+    trades = trade_table(fills)
+    closed = trades[trades['closed']]
+    wins, losses = closed['pnl'][closed['pnl'] > 0], closed['pnl'][closed['pnl'] <= 0]
+    stats.update(
+        fees=float(fills['comm'].sum()), exposure=100.0 * held.mean(),
+        turnover=traded / float(equity.mean()) / years if years > 0 else 0.0,
+        trades=len(closed), open_trades=len(trades) - len(closed),
+        win_rate=100.0 * len(wins) / len(closed) if len(closed) else 0.0,
+        profit_factor=float(wins.sum() / -losses.sum()) if losses.sum() < 0 else None,
+        avg_trade_pnl=float(closed['pnl'].mean()) if len(closed) else 0.0,
+        avg_bars_held=float((closed['exit_bar'] - closed['entry_bar']).mean()) if len(closed) else 0.0,
+    )
+    return stats
+
+
+def rolling_metrics(equity, window, riskfreerate=0.0):
+    """
+    滚动指标：window 为 K 线根数或时间长度（如 '30D'）。返回 DataFrame，列为窗口内的收益率 (%)、
+    年化波动率 (%)、夏普、索提诺和当前回撤 (%)。年化系数按整条曲线的 K 线密度计算。
+    """
+    ppy = periods_per_year(equity.index)
+    rate = pow(1.0 + riskfreerate, 1.0 / ppy) - 1.0
+    excess = pd.Series(bar_returns(equity) - rate, index=equity.index)
+    rolling = excess.rolling(window)
+    mean, std = rolling.mean(), rolling.std(ddof=1)
+    downside = np.sqrt((np.minimum(excess, 0.0) ** 2).rolling(window).mean())
+    log_growth = np.log1p(pd.Series(bar_returns(equity), index=equity.index)).rolling(window).sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.DataFrame({
+            'return': np.expm1(log_growth) * 100.0,
+            'volatility': std * math.sqrt(ppy) * 100.0,
+            'sharpe': (mean / std * math.sqrt(ppy)).where(std > 0),
+            'sortino': (mean / downside * math.sqrt(ppy)).where(downside > 0),
+            'drawdown': drawdown(equity),
+        })
+
+
+def format_duration(delta):
+    """水下时间的简短写法: '12天3小时' / '45分钟'。"""
+    minutes = int(delta.total_seconds() // 60)
+    days, hours, minutes = minutes // 1440, minutes // 60 % 24, minutes % 60
+    if days: return f"{days}天{hours}小时"
+    return f"{hours}小时{minutes}分钟" if hours else f"{minutes}分钟"
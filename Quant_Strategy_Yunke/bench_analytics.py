@@ -0,0 +1,111 @@
+"""
+绩效分析基准测试：同一个 backtrader 回测分别挂上 TradeAnalyzer + SharpeRatio + DrawDown 三个分析器，
+和只挂 analytics.Recorder、结束后用 summarize() 计算，检查最终资产、最大回撤、已平仓交易数和已平仓交易的
+净盈亏一致，并输出两者的耗时（Recorder 一列包含 summarize 的时间）。
+
+用法:
+    python bench_analytics.py [MULTI|HF|MA...]     # 默认全部
+
+夏普比率的口径不同，只列出供参考：SharpeRatio 默认按年度收益计算（不足两年时为空），
+summarize 按 K 线收益率计算、再按真实的 K 线间隔年化。
+"""
+import sys
+import time
+
+import backtrader as bt
+
+from analytics import Recorder, summarize, trade_table
+from bench_vector import load_csv, load_script
+
+METRIC_ATOL = 1e-6
+
+
+def run(strategy, frames, commission, sizer_percents, analyzers):
+    cerebro = bt.Cerebro()
+    for df in frames: cerebro.adddata(bt.feeds.PandasData(dataname=df))
+    cerebro.addstrategy(strategy)
+    cerebro.broker.setcash(100000.0)
+    cerebro.broker.setcommission(commission=commission)
+    if sizer_percents: cerebro.addsizer(bt.sizers.PercentSizer, percents=sizer_percents)
+    for name, cls, kwargs in analyzers: cerebro.addanalyzer(cls, _name=name, **kwargs)
+    strat = cerebro.run()[0]
+    return cerebro.broker.getvalue(), strat.analyzers
+
+
+def run_analyzers(strategy, frames, commission, sizer_percents=None):
+    value, analyzers = run(strategy, frames, commission, sizer_percents,
+                           [('ta', bt.analyzers.TradeAnalyzer, {}),
+                            ('sharpe', bt.analyzers.SharpeRatio, dict(annualize=True)),
+                            ('dd', bt.analyzers.DrawDown, {})])
+    ta = analyzers.ta.get_analysis()
+    closed = ta.total.closed if 'total' in ta else 0
+    return dict(final_value=value, max_drawdown=analyzers.dd.get_analysis().max.drawdown, trades=closed,
+                pnl=ta.pnl.net.total if closed else 0.0, sharpe=analyzers.sharpe.get_analysis().get('sharperatio'))
+
+
+def run_recorder(strategy, frames, commission, sizer_percents=None):
+    value, analyzers = run(strategy, frames, commission, sizer_percents, [('recorder', Recorder, {})])
+    recording = analyzers.recorder.get_analysis()
+    stats = summarize(recording)
+    trades = trade_table(recording['fills'])
+    return dict(final_value=value, max_drawdown=stats['max_drawdown'], trades=stats['trades'],
+                pnl=float(trades.loc[trades['closed'], 'pnl'].sum()), sharpe=stats['sharpe'])
+
+
+def build_cases():
+    """{名称: (行数, 策略, 行情列表, 手续费, 仓位比例)}。"""
+    mid_low = load_script('Mid-Low Freq.py')
+    multifactor = load_script('Multifactor.py')
+    high_freq = load_script('High Freq.py')
+    tsla = load_csv('YAHOO_TSLA_2022-06-01_2025-12-31.csv')
+    btc_1h = load_csv('binance_BTCUSDT_1h_2024-01-01_2026-01-01.csv')
+    sol, eth = (load_csv(f'binance_{s}_1m_2026-01-01_2026-01-10.csv') for s in ('SOLUSDT', 'ETHUSDT'))
+    common = sol.index.intersection(eth.index)
+    return {
+        'MULTI': (len(btc_1h), multifactor.ScientificMultiFactor, [btc_1h], multifactor.COMMISSION, None),
+        'HF': (len(common), high_freq.FeeAwareDynamicStrategy, [sol.loc[common], eth.loc[common]],
+               high_freq.COMMISSION, None),
+        'MA': (len(tsla), mid_low.MaCrossStrategy, [tsla], mid_low.COMMISSION, mid_low.POSITION_PERCENT),
+    }
+
+
+def close_enough(expected, actual):
+    if abs(expected['final_value'] - actual['final_value']) > METRIC_ATOL * abs(expected['final_value']): return False
+    if abs(expected['max_drawdown'] - actual['max_drawdown']) > METRIC_ATOL: return False
+    if expected['trades'] != actual['trades']: return False
+    return abs(expected['pnl'] - actual['pnl']) <= METRIC_ATOL * max(1.0, abs(expected['pnl']))
+
+
+def fmt(value):
+    return '-' if value is None else f"{value:,.2f}"
+
+
+def main():
+    cases = build_cases()
+    names = sys.argv[1:] or list(cases)
+    failed = []
+    print(f"{'策略':<8}{'行数':>7}{'回撤% 分析器 / 汇总':>24}{'交易数':>12}{'夏普 分析器 / 汇总':>22}"
+          f"{'分析器(s)':>11}{'Recorder(s)':>13}{'加速比':>8}")
+    for name in names:
+        rows, strategy, frames, commission, percents = cases[name]
+        start = time.perf_counter()
+        expected = run_analyzers(strategy, frames, commission, percents)
+        analyzer_time = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = run_recorder(strategy, frames, commission, percents)
+        recorder_time = time.perf_counter() - start
+        ok = close_enough(expected, actual)
+        if not ok: failed.append(name)
+        print(f"{name:<8}{rows:>7}{fmt(expected['max_drawdown']) + ' / ' + fmt(actual['max_drawdown']):>24}"
+              f"{str(expected['trades']) + ' / ' + str(actual['trades']):>12}"
+              f"{fmt(expected['sharpe']) + ' / ' + fmt(actual['sharpe']):>22}"
+              f"{analyzer_time:>11.2f}{recorder_time:>13.2f}{analyzer_time / recorder_time:>8.2f}"
+              f"{'' if ok else '  ✗ 不一致'}")
+    if failed:
+        print(f"\n不一致: {', '.join(failed)}")
+        sys.exit(1)
+    print("\n全部一致")
+
+
+if __name__ == '__main__':
+    main()
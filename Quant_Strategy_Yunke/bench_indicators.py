@@ -0,0 +1,78 @@
+"""
+指标缓存基准测试：只改变交易阈值反复运行 backtrader 策略，对比每次都重建指标的普通 PandasData
+与带预计算指标 line 的 cached_feed，检查两者的最终资产、夏普比率和最大回撤一致，并输出耗时。
+
+用法:
+    python bench_indicators.py [MULTI|MA|ULTOSC...]     # 默认全部
+
+MULTI 在 BTC 1h 上扫描 adx_min，MA / ULTOSC 在 TSLA 日线上分别扫描仓位比例和超卖阈值（均为随仓库附带的 CSV）。
+缓存使用临时目录，第一次运行为冷缓存（计算并写盘），之后全部命中内存。
+"""
+import sys
+import tempfile
+import time
+
+import backtrader as bt
+
+from bench_vector import load_csv, load_script
+from indicator_cache import IndicatorCache, cached_feed
+
+
+def run(strategy, feed_factory, commission, sizer_percents=None, **params):
+    cerebro = bt.Cerebro()
+    cerebro.adddata(feed_factory())
+    cerebro.addstrategy(strategy, **params)
+    cerebro.broker.setcash(100000.0)
+    cerebro.broker.setcommission(commission=commission)
+    if sizer_percents: cerebro.addsizer(bt.sizers.PercentSizer, percents=sizer_percents)
+    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='dd')
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe', annualize=True)
+    strat = cerebro.run()[0]
+    return (round(cerebro.broker.getvalue(), 6), strat.analyzers.sharpe.get_analysis().get('sharperatio'),
+            strat.analyzers.dd.get_analysis().max.drawdown)
+
+
+def build_cases():
+    """{名称: (策略, 行情, 指标 specs, 手续费, 各次运行的参数列表)}。"""
+    mid_low = load_script('Mid-Low Freq.py')
+    multifactor = load_script('Multifactor.py')
+    tsla = load_csv('YAHOO_TSLA_2022-06-01_2025-12-31.csv')
+    btc_1h = load_csv('binance_BTCUSDT_1h_2024-01-01_2026-01-01.csv')
+    return {
+        'MULTI': (multifactor.ScientificMultiFactor, btc_1h, multifactor.indicator_specs(), multifactor.COMMISSION,
+                  [dict(adx_min=v) for v in (15, 20, 25, 30, 35)]),
+        'MA': (mid_low.MaCrossStrategy, tsla, mid_low.STRATEGY_INDICATORS['MA'], mid_low.COMMISSION,
+               [dict(sizer_percents=v) for v in (20, 35, 50, 65, 80)]),
+        'ULTOSC': (mid_low.UltimateStrategy, tsla, mid_low.STRATEGY_INDICATORS['ULTOSC'], mid_low.COMMISSION,
+                   [dict(low=v) for v in (20, 25, 30, 35, 40)]),
+    }
+
+
+def main():
+    cases = build_cases()
+    names = sys.argv[1:] or list(cases)
+    print(f"{'策略':<10}{'行数':>7}{'次数':>6}{'重建指标(s)':>14}{'指标缓存(s)':>14}{'加速比':>8}")
+    failed = []
+    with tempfile.TemporaryDirectory() as root:
+        cache = IndicatorCache(root)
+        for name in names:
+            strategy, df, specs, commission, runs = cases[name]
+            start = time.perf_counter()
+            expected = [run(strategy, lambda: bt.feeds.PandasData(dataname=df), commission, **p) for p in runs]
+            plain_time = time.perf_counter() - start
+            start = time.perf_counter()
+            actual = [run(strategy, lambda: cached_feed(df, specs, cache), commission, **p) for p in runs]
+            cached_time = time.perf_counter() - start
+            ok = expected == actual
+            if not ok: failed.append(name)
+            print(f"{name:<10}{len(df):>7}{len(runs):>6}{plain_time:>14.2f}{cached_time:>14.2f}"
+                  f"{plain_time / cached_time:>8.1f}{'' if ok else '  ✗ 不一致'}")
+        print(f"\n缓存命中: 内存 {cache.hits} / 磁盘 {cache.disk_hits} / 计算 {cache.misses}")
+    if failed:
+        print(f"不一致: {', '.join(failed)}")
+        sys.exit(1)
+    print("全部一致")
+
+
+if __name__ == '__main__':
+    main()
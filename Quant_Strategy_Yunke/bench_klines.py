@@ -0,0 +1,118 @@
+"""
+币安 K 线分页下载基准测试：在子进程中启动一个模拟 /api/v3/klines 的服务器（每次请求固定延迟，
+返回与真实接口相同格式的数据和 X-MBX-USED-WEIGHT-1M 头），对比串行 (concurrency=1) 与并发分页下载。
+服务器缓存生成过的分页并在计时前预热，计时只反映网络往返和客户端解析。
+
+用法:
+    python bench_klines.py [每次请求延迟(毫秒), 默认 80]
+
+检查项：两种方式得到的数据完全一致、没有重复或缺失的 K 线；并输出耗时和加速比。
+"""
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import ohlcv_store
+from ohlcv_store import BINANCE_CONCURRENCY, fetch_binance_klines, interval_to_timedelta
+
+SYMBOLS = ['BTCUSDT', 'ETHUSDT', 'SOLUSDT']
+INTERVAL = '1m'
+START_DATE = '2025-12-01'
+END_DATE = '2026-01-01'
+
+
+class MockKlinesHandler(BaseHTTPRequestHandler):
+    latency = 0.08
+    weight_used = 0
+    lock = threading.Lock()
+    pages = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        body = self.pages.get(self.path)
+        if body is None: body = self.pages[self.path] = self.make_page(query)
+        time.sleep(self.latency)
+        with MockKlinesHandler.lock:
+            MockKlinesHandler.weight_used += 5
+            used = MockKlinesHandler.weight_used
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-MBX-USED-WEIGHT-1M', str(used))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def make_page(query):
+        step_ms = int(interval_to_timedelta(query['interval']).total_seconds() * 1000)
+        start_ms, end_ms, limit = int(query['startTime']), int(query['endTime']), int(query['limit'])
+        first = -(-start_ms // step_ms) * step_ms
+        seed = sum(map(ord, query['symbol']))
+        rows = [[t, *(str(seed + (t // step_ms) % 997 + k) for k in (0.0, 1.0, -1.0, 0.5)), '10.0',
+                 t + step_ms - 1, '0', 1, '0', '0', '0']
+                for t in range(first, end_ms + 1, step_ms)][:limit]
+        return json.dumps(rows).encode()
+
+
+def serve(latency, port_queue):
+    MockKlinesHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockKlinesHandler)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def run(base_url, concurrency):
+    start = time.perf_counter()
+    frames = {symbol: fetch_binance_klines(symbol, INTERVAL, START_DATE, END_DATE, base_url=base_url,
+                                           concurrency=concurrency) for symbol in SYMBOLS}
+    return frames, time.perf_counter() - start
+
+
+def run_concurrent(base_url):
+    """多个标的同时下载，分页请求共用连接池和权重限流。"""
+    start = time.perf_counter()
+    results = {}
+    threads = [threading.Thread(target=lambda s=symbol: results.__setitem__(s, fetch_binance_klines(
+        s, INTERVAL, START_DATE, END_DATE, base_url=base_url))) for symbol in SYMBOLS]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return results, time.perf_counter() - start
+
+
+def main():
+    latency = int(sys.argv[1]) / 1000 if len(sys.argv) > 1 else MockKlinesHandler.latency
+    # 基准测试只测下载本身，本地服务器不计权重上限
+    ohlcv_store._binance_limiter.budget = 10 ** 9
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(latency, port_queue), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{port_queue.get()}"
+
+    run_concurrent(base_url)  # 预热：让服务器生成并缓存全部分页
+    expected_bars = len(pd.date_range(START_DATE, END_DATE, freq=interval_to_timedelta(INTERVAL), inclusive='left'))
+    serial, serial_time = run(base_url, concurrency=1)
+    concurrent, concurrent_time = run_concurrent(base_url)
+    for symbol in SYMBOLS:
+        assert len(serial[symbol]) == expected_bars and serial[symbol].index.is_unique, symbol
+        assert serial[symbol].equals(concurrent[symbol]), symbol
+    server.terminate()
+
+    pages = len(SYMBOLS) * -(-expected_bars // ohlcv_store.BINANCE_PAGE_LIMIT)
+    print(f"{len(SYMBOLS)} 个标的 × {expected_bars} 根 {INTERVAL} K 线，共 {pages} 页，"
+          f"模拟延迟 {latency * 1000:.0f}ms，数据一致")
+    print(f"{'方式':<16}{'耗时(s)':>10}{'加速比':>10}")
+    print(f"{'串行':<16}{serial_time:>10.2f}{1:>10.1f}")
+    print(f"{f'并发 x{BINANCE_CONCURRENCY}/标的':<16}{concurrent_time:>10.2f}{serial_time / concurrent_time:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+滚动分位数基准测试：在 SOL/ETH 1m 比价的 z-score 序列上，对比 High Freq 原来的写法
+（无限增长的列表 + 每根 K 线切片后调用三次 np.percentile）与 IndexableSkiplist 滑动窗口。
+
+用法:
+    python bench_quantile.py [窗口长度, 默认 1000]
+
+数据从共享行情仓库读取（与 High Freq.py 相同的区间）。检查两种方式每根 K 线的三个阈值一致，并输出耗时和加速比。
+"""
+import sys
+import time
+
+import numpy as np
+
+from indicators import IndexableSkiplist
+from ohlcv_store import load_binance_klines_many
+
+SYMBOL_A, SYMBOL_B = 'SOLUSDT', 'ETHUSDT'
+INTERVAL = '1m'
+START_DATE = '2026-01-01'
+END_DATE = '2026-01-10'
+Q_ENTRY = 0.98
+ZSCORE_PERIOD = 200
+
+
+def load_zscore():
+    """与策略中 SMA / StdDev(200) 相同的比价 z-score（总体标准差）。"""
+    frames = load_binance_klines_many([SYMBOL_A, SYMBOL_B], INTERVAL, START_DATE, END_DATE)
+    df_a, df_b = frames[SYMBOL_A], frames[SYMBOL_B]
+    common = df_a.index.intersection(df_b.index)
+    ratio = df_a.loc[common, 'close'] / df_b.loc[common, 'close']
+    rolling = ratio.rolling(ZSCORE_PERIOD)
+    return ((ratio - rolling.mean()) / rolling.std(ddof=0)).dropna().to_numpy()
+
+
+def percentile_history(zscore, lookback):
+    z_history, out = [], []
+    for z in zscore:
+        z_history.append(z)
+        if len(z_history) < lookback: continue
+        recent_z = z_history[-lookback:]
+        out.append((np.percentile(recent_z, (1 - Q_ENTRY) * 100), np.percentile(recent_z, 50),
+                    np.percentile(recent_z, Q_ENTRY * 100)))
+    return np.array(out)
+
+
+def skiplist_window(zscore, lookback):
+    window, out = IndexableSkiplist(lookback), []
+    for i, z in enumerate(zscore):
+        if i >= lookback: window.remove(zscore[i - lookback])
+        window.insert(z)
+        if i + 1 < lookback: continue
+        out.append((window.quantile(1 - Q_ENTRY), window.quantile(0.5), window.quantile(Q_ENTRY)))
+    return np.array(out)
+
+
+def main():
+    lookback = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    zscore = load_zscore()
+    timings = {}
+    for label, func in (('列表 + np.percentile', percentile_history), ('跳表窗口', skiplist_window)):
+        start = time.perf_counter()
+        timings[label] = func(zscore, lookback), time.perf_counter() - start
+    (expected, base_time), (result, skip_time) = timings.values()
+    assert expected.shape == result.shape and np.allclose(expected, result, rtol=0, atol=1e-12)
+
+    print(f"{SYMBOL_A}/{SYMBOL_B} {INTERVAL} z-score {len(zscore)} 根，窗口 {lookback}，"
+          f"{len(result)} 组阈值一致 (最大误差 {np.abs(expected - result).max():.1e})")
+    print(f"{'方式':<20}{'耗时(s)':>10}{'每根(us)':>12}{'加速比':>10}")
+    for label, (_, elapsed) in timings.items():
+        print(f"{label:<20}{elapsed:>10.3f}{elapsed / len(zscore) * 1e6:>12.1f}{base_time / elapsed:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
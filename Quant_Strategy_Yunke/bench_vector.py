@@ -0,0 +1,137 @@
+"""
+向量化回测引擎一致性检查与基准测试：在随仓库附带的 CSV 行情上，分别用 backtrader 原策略和 vector_backtest
+运行各个策略，比较最终资产、夏普比率和最大回撤，并输出两者的耗时。
+
+用法:
+    python bench_vector.py [策略名...]     # 默认全部: MA ULTOSC MOM MA-A股 MULTI HF
+
+策略类直接从各脚本加载（脚本的依赖需已安装）；分析器设置与脚本中相同。
+任一指标超出容差 (最终资产相对误差 1e-6，夏普 / 回撤绝对误差 1e-6) 时以非零状态退出。
+"""
+import importlib.util
+import os
+import sys
+import time
+
+import backtrader as bt
+import pandas as pd
+
+import vector_backtest as vb
+from ohlcv_store import normalize_ohlcv
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+VALUE_RTOL = 1e-6
+METRIC_ATOL = 1e-6
+
+
+def load_script(filename):
+    """按文件路径导入策略脚本（文件名含空格，不能直接 import）。"""
+    name = os.path.splitext(filename)[0].replace(' ', '_').replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, os.path.join(BASE_DIR, filename))
+    module = sys.modules[name] = importlib.util.module_from_spec(spec)  # backtrader 按模块名查找参数
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_csv(filename):
+    df = pd.read_csv(os.path.join(BASE_DIR, filename), index_col=0, parse_dates=True)
+    df.columns = [str(col).lower() for col in df.columns]
+    return normalize_ohlcv(df)
+
+
+def run_backtrader(strategy, frames, commission, sizer_percents=None, sharpe_kwargs=None):
+    cerebro = bt.Cerebro()
+    for df in frames: cerebro.adddata(bt.feeds.PandasData(dataname=df))
+    cerebro.addstrategy(strategy)
+    cerebro.broker.setcash(vb.START_CASH)
+    cerebro.broker.setcommission(commission=commission)
+    if sizer_percents: cerebro.addsizer(bt.sizers.PercentSizer, percents=sizer_percents)
+    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='dd')
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe', **(sharpe_kwargs or {}))
+    strat = cerebro.run()[0]
+    return (cerebro.broker.getvalue(), strat.analyzers.sharpe.get_analysis().get('sharperatio'),
+            strat.analyzers.dd.get_analysis().max.drawdown)
+
+
+def build_cases():
+    """{名称: (行数, backtrader 运行函数, 向量化运行函数, SharpeRatio 参数)}。"""
+    mid_low = load_script('Mid-Low Freq.py')
+    multifactor = load_script('Multifactor.py')
+    high_freq = load_script('High Freq.py')
+    daily_sharpe = dict(riskfreerate=0.02, annualize=True, timeframe=bt.TimeFrame.Days)
+    default_sharpe = dict(annualize=True)
+
+    tsla = load_csv('YAHOO_TSLA_2022-06-01_2025-12-31.csv')
+    spy = load_csv('YAHOO_SPY_2020-01-01_2025-12-31.csv').reindex(tsla.index).ffill()
+    gree = load_csv('AKSHARE_000651_20200101_20251231.csv')
+    btc_1h = load_csv('binance_BTCUSDT_1h_2024-01-01_2026-01-01.csv')
+    sol, eth = (load_csv(f'binance_{s}_1m_2026-01-01_2026-01-10.csv') for s in ('SOLUSDT', 'ETHUSDT'))
+    common = sol.index.intersection(eth.index)
+    sol, eth = sol.loc[common], eth.loc[common]
+
+    daily = dict(commission=mid_low.COMMISSION, sizer_percents=mid_low.POSITION_PERCENT, sharpe_kwargs=daily_sharpe)
+    vec_daily = dict(commission=mid_low.COMMISSION, percents=mid_low.POSITION_PERCENT)
+    return {
+        'MA': (len(tsla), lambda: run_backtrader(mid_low.MaCrossStrategy, [tsla], **daily),
+               lambda: vb.run_ma_cross(tsla, **vec_daily), daily_sharpe),
+        'ULTOSC': (len(tsla), lambda: run_backtrader(mid_low.UltimateStrategy, [tsla], **daily),
+                   lambda: vb.run_ultimate(tsla, **vec_daily), daily_sharpe),
+        'MOM': (len(tsla), lambda: run_backtrader(mid_low.MomentumStrategy, [tsla, spy], **daily),
+                lambda: vb.run_momentum(tsla, spy, **vec_daily), daily_sharpe),
+        'MA-A股': (len(gree), lambda: run_backtrader(mid_low.MaCrossStrategy, [gree], **daily),
+                  lambda: vb.run_ma_cross(gree, **vec_daily), daily_sharpe),
+        'MULTI': (len(btc_1h), lambda: run_backtrader(multifactor.ScientificMultiFactor, [btc_1h],
+                                                      multifactor.COMMISSION, sharpe_kwargs=default_sharpe),
+                  lambda: vb.run_multifactor(btc_1h, commission=multifactor.COMMISSION), default_sharpe),
+        'HF': (len(sol), lambda: run_backtrader(high_freq.FeeAwareDynamicStrategy, [sol, eth],
+                                                high_freq.COMMISSION, sharpe_kwargs=default_sharpe),
+               lambda: vb.run_fee_aware(sol, eth, portfolio_use_percent=high_freq.PORTFOLIO_USE_PERCENT,
+                                        commission=high_freq.COMMISSION), default_sharpe),
+    }
+
+
+def vector_metrics(result, sharpe_kwargs):
+    timeframe = 'days' if sharpe_kwargs.get('timeframe') == bt.TimeFrame.Days else 'years'
+    sharpe = result.sharpe_ratio(timeframe, sharpe_kwargs.get('riskfreerate', 0.01), sharpe_kwargs['annualize'])
+    return result.final_value, sharpe, result.max_drawdown
+
+
+def close_enough(expected, actual):
+    (bt_value, bt_sharpe, bt_dd), (vec_value, vec_sharpe, vec_dd) = expected, actual
+    if abs(bt_value - vec_value) > VALUE_RTOL * abs(bt_value): return False
+    if (bt_sharpe is None) != (vec_sharpe is None): return False
+    if bt_sharpe is not None and abs(bt_sharpe - vec_sharpe) > METRIC_ATOL: return False
+    return abs(bt_dd - vec_dd) <= METRIC_ATOL
+
+
+def fmt(value):
+    return '-' if value is None else f"{value:,.4f}"
+
+
+def main():
+    cases = build_cases()
+    names = sys.argv[1:] or list(cases)
+    failed = []
+    print(f"{'策略':<10}{'行数':>7}{'最终资产 bt / 向量':>32}{'夏普 bt / 向量':>22}{'回撤% bt / 向量':>22}"
+          f"{'bt(s)':>8}{'向量(s)':>9}{'加速比':>8}")
+    for name in names:
+        rows, run_bt, run_vec, sharpe_kwargs = cases[name]
+        start = time.perf_counter()
+        expected = run_bt()
+        bt_time = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = vector_metrics(run_vec(), sharpe_kwargs)
+        vec_time = time.perf_counter() - start
+        ok = close_enough(expected, actual)
+        if not ok: failed.append(name)
+        print(f"{name:<10}{rows:>7}{fmt(expected[0]) + ' / ' + fmt(actual[0]):>32}"
+              f"{fmt(expected[1]) + ' / ' + fmt(actual[1]):>22}{fmt(expected[2]) + ' / ' + fmt(actual[2]):>22}"
+              f"{bt_time:>8.2f}{vec_time:>9.3f}{bt_time / vec_time:>8.0f}{'' if ok else '  ✗ 不一致'}")
+    if failed:
+        print(f"\n不一致: {', '.join(failed)}")
+        sys.exit(1)
+    print("\n全部一致")
+
+
+if __name__ == '__main__':
+    main()
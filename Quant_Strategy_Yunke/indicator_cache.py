@@ -0,0 +1,189 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import backtrader as bt
+
+import vector_backtest as vb
+from ohlcv_store import STORE_DIR, COLUMNS, unique_tmp_path
+
+# ==========================================
+# 【指标缓存】
+# 同一份行情上反复回测（重跑、只扫描 adx_min / risk_percent 之类的交易阈值）时，指标结果不会变。
+# 这里按 (行情指纹, 指标名, 参数) 缓存整段指标数组：内存中按 LRU 淘汰，磁盘上保存为 .npy，
+# 磁盘上同样按最近使用时间（文件修改时间，命中时刷新）淘汰，总大小不超过 DISK_CACHE_BYTES。
+# 再作为额外的 line 挂到扩展的 PandasData 上。策略用 cached_line() 取指标：数据源带有对应的 line 就直接读取，
+# 否则照旧创建 backtrader 指标，因此不用缓存的运行方式不受影响。
+#
+# 目录结构: ohlcv_data/_indicators/<行情指纹>/<line 名>.npy，line 名如 ema_200、ultosc_7_14_28。
+# 指标按 vector_backtest 的公式计算（预热期与 backtrader 指标一致，为 NaN），
+# NaN 与阈值比较总为 False，所以预热期内策略不会下单，结果与原来相同。
+# ==========================================
+INDICATOR_CACHE_DIR = os.path.join(STORE_DIR, '_indicators')
+MEMORY_CACHE_BYTES = 256 * 1024 * 1024   # 内存中最多保留的指标数组总字节数
+DISK_CACHE_BYTES = 2 * 1024 ** 3         # 磁盘上最多保留的 .npy 总字节数（参数扫描会不断产生新的参数组合）
+
+
+def _ohlc(df):
+    return (df[col].to_numpy(dtype=float) for col in ('high', 'low', 'close'))
+
+
+# 指标名 -> (backtrader 指标, 计算函数)。参数名与 backtrader 指标的 params 相同
+INDICATORS = {
+    'sma': (bt.ind.SMA, lambda df, period: vb.sma(df['close'].to_numpy(dtype=float), period)),
+    'ema': (bt.ind.EMA, lambda df, period: vb.ema(df['close'].to_numpy(dtype=float), period)),
+    'rsi': (bt.ind.RSI, lambda df, period: vb.rsi(df['close'].to_numpy(dtype=float), period)),
+    'atr': (bt.ind.ATR, lambda df, period: vb.atr(*_ohlc(df), period)),
+    'adx': (bt.ind.ADX, lambda df, period: vb.adx(*_ohlc(df), period)),
+    'ultosc': (bt.ind.UltimateOscillator, lambda df, p1, p2, p3: vb.ultimate_oscillator(*_ohlc(df), p1, p2, p3)),
+}
+
+
+def line_name(name, params):
+    """'ema', {'period': 200} -> 'ema_200'。参数按名称排序，作为 PandasData 的 line 名和缓存文件名。"""
+    return '_'.join([name] + [str(params[key]).replace('.', 'p').replace('-', 'm') for key in sorted(params)])
+
+
+def fingerprint(df):
+    """行情指纹：时间戳与 OHLCV 数值的哈希，数据有任何变动都会得到不同的指纹。"""
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update(df.index.as_unit('ns').asi8.tobytes())
+    digest.update(np.ascontiguousarray(df[COLUMNS].to_numpy(dtype=float)).tobytes())
+    return digest.hexdigest()
+
+
+class IndicatorCache:
+    def __init__(self, root=INDICATOR_CACHE_DIR, memory_bytes=MEMORY_CACHE_BYTES, disk_bytes=DISK_CACHE_BYTES):
+        self.root = root
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def _path(self, key, line):
+        return os.path.join(self.root, key, f"{line}.npy")
+
+    def _remember(self, cache_key, values):
+        with self.lock:
+            self.memory[cache_key] = values
+            self.memory.move_to_end(cache_key)
+            total = sum(array.nbytes for array in self.memory.values())
+            while total > self.memory_bytes and len(self.memory) > 1:
+                _, evicted = self.memory.popitem(last=False)
+                total -= evicted.nbytes
+
+    def get(self, df, name, key=None, **params):
+        """返回 df 上指标 name(**params) 的整段数组（只读）。key 为行情指纹，多次调用时可以预先算好传入。"""
+        key = key or fingerprint(df)
+        line = line_name(name, params)
+        cache_key = (key, line)
+        with self.lock:
+            values = self.memory.get(cache_key)
+            if values is not None:
+                self.memory.move_to_end(cache_key)
+                self.hits += 1
+                return values
+        path = self._path(key, line)
+        try:
+            values = np.load(path)
+            os.utime(path)  # 修改时间即最近使用时间
+            self.disk_hits += 1
+        except FileNotFoundError:  # 不存在，或刚被其它进程淘汰
+            values = np.asarray(INDICATORS[name][1](df, **params), dtype=float)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = unique_tmp_path(path)
+            with open(tmp_path, 'wb') as f:
+                np.save(f, values)
+            os.replace(tmp_path, path)
+            self.misses += 1
+            self.evict_disk()
+        values.flags.writeable = False
+        self._remember(cache_key, values)
+        return values
+
+    def evict_disk(self):
+        """磁盘缓存超过 disk_bytes 时，从最久没有使用的文件开始删除。返回删除的文件数。"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.endswith('.npy'): continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.disk_bytes: break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            if not os.listdir(os.path.dirname(path)): os.rmdir(os.path.dirname(path))
+        return removed
+
+    def clear_memory(self):
+        with self.lock:
+            self.memory.clear()
+
+
+CACHE = IndicatorCache()
+
+class ArrayPandasData(bt.feeds.PandasData):
+    """
+    PandasData 每根 K 线对每一列调用一次 DataFrame.iloc，列一多加载反而比算指标还慢。
+    这里在 start() 时把各列一次性转成列表（时间戳预先转成 backtrader 的浮点日期），_load() 只按位置取值。
+    只支持时间在索引上的 DataFrame（datetime 参数为 None，即默认设置）。
+    """
+    def start(self):
+        super().start()
+        df = self.p.dataname
+        self._columns = [(getattr(self.lines, field), df.iloc[:, col].tolist())
+                         for field, col in self._colmapping.items() if field != 'datetime' and col is not None]
+        self._datetimes = [bt.date2num(ts) for ts in df.index.to_pydatetime()]
+
+    def _load(self):
+        if self._colmapping['datetime'] is not None: return super()._load()
+        self._idx += 1
+        if self._idx >= len(self._datetimes): return False
+        for line, values in self._columns: line[0] = values[self._idx]
+        self.lines.datetime[0] = self._datetimes[self._idx]
+        return True
+
+
+_FEED_CLASSES = {}
+
+
+def feed_class(lines):
+    """带额外 line 的 ArrayPandasData 子类（按 line 名自动匹配同名列），同一组 line 复用同一个类。"""
+    lines = tuple(lines)
+    if lines not in _FEED_CLASSES:
+        _FEED_CLASSES[lines] = type('IndicatorPandasData', (ArrayPandasData,),
+                                    {'lines': lines, 'params': tuple((line, -1) for line in lines)})
+    return _FEED_CLASSES[lines]
+
+
+def cached_feed(df, specs, cache=CACHE, **kwargs):
+    """
+    构造带预计算指标的数据源。specs 为 [(指标名, 参数 dict), ...]，如 [('ema', {'period': 200})]；
+    kwargs 传给 PandasData（如 fromdate / todate）。
+    """
+    key = fingerprint(df)
+    columns = {}
+    for name, params in specs:
+        columns[line_name(name, params)] = cache.get(df, name, key=key, **params)
+    return feed_class(columns)(dataname=df.assign(**columns), **kwargs)
+
+
+def cached_line(data, name, **params):
+    """数据源带有预计算的 name(**params) 时返回该 line，否则创建对应的 backtrader 指标。在策略 __init__ 中调用。"""
+    line = line_name(name, params)
+    if line in data.lines.getlinealiases(): return getattr(data.lines, line)
+    return INDICATORS[name][0](data, **params)
@@ -0,0 +1,130 @@
+import math
+import random
+from collections import deque
+
+import backtrader as bt
+
+
+# ==========================================
+# 【可索引跳表】
+# 有序多重集合，每个节点记录到下一节点跨过的元素个数 (width)，
+# 插入、删除、按名次取值的期望复杂度都是 O(log n)。
+# ==========================================
+class _SkipNode:
+    __slots__ = ('value', 'next', 'width')
+
+    def __init__(self, value, next, width):
+        self.value = value
+        self.next = next
+        self.width = width
+
+
+_NIL = _SkipNode(math.inf, [], [])
+
+
+class IndexableSkiplist:
+    def __init__(self, expected_size=1024):
+        self.size = 0
+        self.maxlevels = int(1 + math.log2(max(expected_size, 2)))
+        self.head = _SkipNode(None, [_NIL] * self.maxlevels, [1] * self.maxlevels)
+        self._random = random.Random(0)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        node = self.head
+        i += 1
+        for level in reversed(range(self.maxlevels)):
+            while node.width[level] <= i:
+                i -= node.width[level]
+                node = node.next[level]
+        return node.value
+
+    def insert(self, value):
+        chain, steps_at_level = [None] * self.maxlevels, [0] * self.maxlevels
+        node = self.head
+        for level in reversed(range(self.maxlevels)):
+            while node.next[level].value <= value:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        height = min(self.maxlevels, 1 - int(math.log2(1.0 - self._random.random())))
+        new_node = _SkipNode(value, [None] * height, [None] * height)
+        steps = 0
+        for level in range(height):
+            prev = chain[level]
+            new_node.next[level], prev.next[level] = prev.next[level], new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, self.maxlevels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, value):
+        chain = [None] * self.maxlevels
+        node = self.head
+        for level in reversed(range(self.maxlevels)):
+            while node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target.value != value: raise KeyError(value)
+
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.maxlevels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def quantile(self, q):
+        """线性插值分位数，与 np.percentile / np.quantile 默认的 method='linear' 结果一致。"""
+        pos = (self.size - 1) * q
+        lo = int(pos)
+        gamma = pos - lo
+        a = self[lo]
+        if gamma == 0: return a
+        b = self[lo + 1]
+        diff = b - a
+        return b - diff * (1 - gamma) if gamma >= 0.5 else a + diff * gamma
+
+
+# ==========================================
+# 【滚动分位数指标】
+# ==========================================
+class RollingQuantile(bt.Indicator):
+    """
+    最近 period 个值的下分位 (1 - q)、中位数和上分位 (q)。
+    窗口保存在可索引跳表中，每根 K 线的插入、淘汰和取值都是 O(log period)，不保留窗口以外的历史。
+    NaN/inf 不计入窗口（例如输入指标还在预热期时）。
+    """
+    lines = ('lower', 'median', 'upper')
+    params = (
+        ('period', 1000),
+        ('q', 0.98),
+    )
+
+    def __init__(self):
+        self.addminperiod(self.p.period)
+        self.window = IndexableSkiplist(self.p.period)
+        self.values = deque()
+
+    def _push(self, value):
+        if not math.isfinite(value): return
+        if len(self.values) == self.p.period: self.window.remove(self.values.popleft())
+        self.values.append(value)
+        self.window.insert(value)
+
+    def prenext(self):
+        self._push(self.data[0])
+
+    def next(self):
+        self._push(self.data[0])
+        if not self.window: return
+        self.lines.lower[0] = self.window.quantile(1 - self.p.q)
+        self.lines.median[0] = self.window.quantile(0.5)
+        self.lines.upper[0] = self.window.quantile(self.p.q)
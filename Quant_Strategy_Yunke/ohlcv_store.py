@@ -0,0 +1,487 @@
+import os
+import re
+import json
+import time
+import threading
+import uuid
+import requests
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+# ==========================================
+# 【OHLCV 行情数据仓库】
+# 各策略脚本共用：每个 (数据源, 标的, 周期) 一个目录，按月分区保存为 Parquet 文件（日线及以上按年分区，
+# 避免产生大量小文件），并记录已经抓取过的时间段。任意日期区间的请求直接从分区中切片，只抓取缺失的部分。
+#
+# 目录结构: ohlcv_data/<source>/<symbol>/<interval>/2026-01.parquet + _coverage.json
+# 时间统一为不带时区的 UTC 时间，区间为左闭右开 [start, end)。
+# 复权价格按下载当天的基准保存，补缺口时发现基准变化（新的分红 / 拆股）会整段重新下载，见 OHLCVStore.load。
+#
+# 读取走内存映射快照: 同目录下的 _series.time.npy (int64 纳秒时间戳) + _series.ohlcv.npy
+# (n×5 列优先 float 数组)。np.load(mmap_mode='r') 直接映射文件，切片和构造 DataFrame 都不复制数据，
+# 多个回测进程读同一标的时共享同一份页缓存。每次 write() 都会换一个新的版本号 (_generation)，
+# 快照记录生成时的版本号 (_series.json)，两者不相等时自动重建。
+# ==========================================
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ohlcv_data')
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+COVERAGE_FILE = '_coverage.json'
+SNAPSHOT_TIME_FILE = '_series.time.npy'
+SNAPSHOT_VALUES_FILE = '_series.ohlcv.npy'
+SNAPSHOT_META_FILE = '_series.json'
+GENERATION_FILE = '_generation'
+ADJUSTMENT_RTOL = 1e-6           # 复权价格重叠 K 线的收盘价容差
+MAX_MARKET_CLOSURE = pd.Timedelta(days=10)   # 最长的连续休市（春节长假加前后周末）
+SNAPSHOT_DTYPE = np.float64      # 改为 np.float32 可让快照体积减半（价格保留约 7 位有效数字）
+
+try:
+    import pyarrow  # noqa: F401  Parquet 读写引擎
+    PARTITION_EXT = '.parquet'
+except ImportError:  # 未安装 pyarrow 时退化为 pickle 分区（同样免去 CSV 解析）
+    PARTITION_EXT = '.pkl'
+
+BINANCE_API_URL = 'https://api.binance.com'
+BINANCE_PAGE_LIMIT = 1000
+BINANCE_CONCURRENCY = 8          # 同时请求的分页数
+BINANCE_WEIGHT_LIMIT = 6000      # 现货接口每分钟请求权重上限 (REQUEST_WEIGHT)
+BINANCE_WEIGHT_HEADROOM = 0.8    # 只使用上限的 80%，给同一 IP 的其它程序留余量
+BINANCE_KLINES_WEIGHT = 2        # /api/v3/klines 单次请求的权重（与 limit 无关）；实际用量以响应头为准
+BINANCE_RETRIES = 3
+
+
+def interval_to_timedelta(interval):
+    """币安周期字符串 ('1s' / '1m' / '1h' / '1d' / '1w') 转为 pd.Timedelta。"""
+    match = re.fullmatch(r'(\d+)([smhdw])', interval)
+    if not match: raise ValueError(f"不支持的周期: {interval}")
+    return pd.Timedelta(int(match.group(1)), {'s': 's', 'm': 'min', 'h': 'h', 'd': 'D', 'w': 'W'}[match.group(2)])
+
+
+def is_time_interval(interval):
+    """按固定时长切分的周期。成交量 / 成交额 K 线（如 'vol5k'，见 trade_bars.py）返回 False。"""
+    return re.fullmatch(r'\d+[smhdw]', interval) is not None
+
+
+def empty_fetch_result(start, end):
+    """
+    数据源出错和休市都只返回空表时（如 yfinance）对空结果的处理：不超过 MAX_MARKET_CLOSURE 的时段视为休市，
+    返回空表（登记为已抓取）；更长的时段不可能整段休市，视为下载失败，返回 None（下次重试）。
+    """
+    if to_timestamp(end) - to_timestamp(start) > MAX_MARKET_CLOSURE: return None
+    return pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], name='time'), dtype=float)
+
+
+def unique_tmp_path(path):
+    """每个写入者各自的临时文件名（进程号 + 随机串），写完后用 os.replace 原子替换 path。"""
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+def to_timestamp(value):
+    """'2026-01-01' / '20260101' / datetime 统一转为不带时区的 UTC pd.Timestamp。"""
+    ts = pd.Timestamp(value)
+    return ts.tz_convert('UTC').tz_localize(None) if ts.tz is not None else ts
+
+
+def partition_freq(interval):
+    """分区粒度：日内周期（以及成交量 / 成交额 K 线）按月，日线及以上按年。返回 (pandas 周期频率, 文件名格式)。"""
+    if not is_time_interval(interval) or interval_to_timedelta(interval) < pd.Timedelta(1, 'D'): return 'M', '%Y-%m'
+    return 'Y', '%Y'
+
+
+def merge_ranges(ranges):
+    """合并重叠或相接的 [start, end) 区间。"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def subtract_ranges(start, end, covered):
+    """[start, end) 中不被 covered 覆盖的部分。"""
+    gaps, cursor = [], start
+    for c_start, c_end in covered:
+        if c_end <= cursor or c_start >= end: continue
+        if c_start > cursor: gaps.append((cursor, c_start))
+        cursor = max(cursor, c_end)
+    if cursor < end: gaps.append((cursor, end))
+    return gaps
+
+
+def normalize_ohlcv(df):
+    """整理为 DatetimeIndex('time') + 五列 float，按时间排序并去掉重复的 K 线。"""
+    df = df[COLUMNS].astype(float)
+    df.index = pd.DatetimeIndex(df.index, name='time')
+    if df.index.tz is not None: df.index = df.index.tz_convert('UTC').tz_localize(None)
+    return df[~df.index.duplicated(keep='last')].sort_index()
+
+
+class OHLCVStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+
+    def series_dir(self, source, symbol, interval):
+        return os.path.join(self.root, source.lower(), symbol, interval)
+
+    # --- 覆盖区间 ---
+    def coverage(self, source, symbol, interval):
+        path = os.path.join(self.series_dir(source, symbol, interval), COVERAGE_FILE)
+        if not os.path.exists(path): return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return [[pd.Timestamp(s), pd.Timestamp(e)] for s, e in json.load(f)]
+
+    def _save_coverage(self, source, symbol, interval, ranges):
+        path = os.path.join(self.series_dir(source, symbol, interval), COVERAGE_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([[s.isoformat(), e.isoformat()] for s, e in merge_ranges(ranges)], f, indent=1)
+        os.replace(tmp_path, path)
+
+    def missing_ranges(self, source, symbol, interval, start, end):
+        """[start, end) 中尚未抓取过的时间段。"""
+        return subtract_ranges(to_timestamp(start), to_timestamp(end), self.coverage(source, symbol, interval))
+
+    # --- 分区读写 ---
+    def _partition_path(self, series_dir, key):
+        return os.path.join(series_dir, f"{key}{PARTITION_EXT}")
+
+    def _read_partition(self, path):
+        return pd.read_parquet(path) if PARTITION_EXT == '.parquet' else pd.read_pickle(path)
+
+    def _write_partition(self, df, path):
+        tmp_path = path + '.tmp'
+        if PARTITION_EXT == '.parquet':
+            df.to_parquet(tmp_path)
+        else:
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+
+    def write(self, source, symbol, interval, df, covered_start, covered_end):
+        """
+        写入 K 线并把 [covered_start, covered_end) 登记为已抓取（即使该时段没有数据，如休市日）。
+        covered_start 为 None 时只写数据、不登记（分批写入同一时段时，最后再统一登记）。
+        """
+        series_dir = self.series_dir(source, symbol, interval)
+        os.makedirs(series_dir, exist_ok=True)
+        if df is not None and not df.empty:
+            df = normalize_ohlcv(df)
+            for key, part in df.groupby(df.index.strftime(partition_freq(interval)[1])):
+                path = self._partition_path(series_dir, key)
+                if os.path.exists(path): part = normalize_ohlcv(pd.concat([self._read_partition(path), part]))
+                self._write_partition(part, path)
+            self._bump_generation(series_dir)
+        if covered_start is None: return
+        ranges = self.coverage(source, symbol, interval) + [[to_timestamp(covered_start), to_timestamp(covered_end)]]
+        self._save_coverage(source, symbol, interval, ranges)
+
+    def _bump_generation(self, series_dir):
+        """分区有变动时换一个随机版本号（不用计数器，多个进程同时写入也不会得到相同的值）。"""
+        path = os.path.join(series_dir, GENERATION_FILE)
+        tmp_path = unique_tmp_path(path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp_path, path)
+
+    def _generation(self, series_dir):
+        path = os.path.join(series_dir, GENERATION_FILE)
+        if not os.path.exists(path): return ''
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+
+    def read_partitions(self, source, symbol, interval, start=None, end=None):
+        """只读取覆盖 [start, end) 的分区并切片，不联网。不指定区间时读取全部分区。"""
+        series_dir = self.series_dir(source, symbol, interval)
+        if start is None or end is None:
+            paths = sorted(os.path.join(series_dir, name) for name in os.listdir(series_dir)
+                           if name.endswith(PARTITION_EXT)) if os.path.isdir(series_dir) else []
+        else:
+            start, end = to_timestamp(start), to_timestamp(end)
+            freq, name_format = partition_freq(interval)
+            keys = pd.period_range(start, end - pd.Timedelta(1, 'ns'), freq=freq).strftime(name_format)
+            paths = [p for p in (self._partition_path(series_dir, k) for k in keys) if os.path.exists(p)]
+        if not paths: return pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], name='time'), dtype=float)
+        df = pd.concat([self._read_partition(p) for p in paths])
+        return df if start is None or end is None else df.loc[(df.index >= start) & (df.index < end)]
+
+    # --- 内存映射快照 ---
+    def _snapshot_paths(self, source, symbol, interval):
+        series_dir = self.series_dir(source, symbol, interval)
+        return os.path.join(series_dir, SNAPSHOT_TIME_FILE), os.path.join(series_dir, SNAPSHOT_VALUES_FILE)
+
+    def build_snapshot(self, source, symbol, interval, dtype=SNAPSHOT_DTYPE):
+        """
+        把全部分区合并写成快照。先写临时文件再替换，正在映射旧快照的进程不受影响；
+        临时文件名各不相同，多个工作进程同时重建同一快照时不会互相覆盖写到一半的文件。
+        """
+        series_dir = self.series_dir(source, symbol, interval)
+        generation = self._generation(series_dir)  # 先取版本号：读分区期间有新的写入时，快照下次仍判为过期
+        df = self.read_partitions(source, symbol, interval)
+        times = df.index.as_unit('ns').asi8 if len(df) else np.empty(0, dtype=np.int64)
+        values = np.asfortranarray(df[COLUMNS].to_numpy(dtype=dtype))
+        for path, array in zip(self._snapshot_paths(source, symbol, interval), (times, values)):
+            tmp_path = unique_tmp_path(path)
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        meta_path = os.path.join(series_dir, SNAPSHOT_META_FILE)
+        tmp_path = unique_tmp_path(meta_path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'generation': generation}, f)
+        os.replace(tmp_path, meta_path)
+
+    def _snapshot_stale(self, source, symbol, interval):
+        series_dir = self.series_dir(source, symbol, interval)
+        paths = self._snapshot_paths(source, symbol, interval) + (os.path.join(series_dir, SNAPSHOT_META_FILE),)
+        if not all(os.path.exists(path) for path in paths): return True
+        # 比较版本号而不是文件修改时间：同一个时间刻度内的写入在粗粒度时间戳的文件系统上也能发现
+        with open(paths[2], 'r', encoding='utf-8') as f:
+            return json.load(f).get('generation') != self._generation(series_dir)
+
+    def read_arrays(self, source, symbol, interval, start=None, end=None):
+        """
+        返回 [start, end) 的 (times, values)：int64 纳秒时间戳和 n×5 的 open/high/low/close/volume 数组，
+        均为只读内存映射上的切片视图，不读入内存也不复制。快照不存在或已过期时先重建。
+        """
+        if self._snapshot_stale(source, symbol, interval): self.build_snapshot(source, symbol, interval)
+        time_path, values_path = self._snapshot_paths(source, symbol, interval)
+        times, values = np.load(time_path, mmap_mode='r'), np.load(values_path, mmap_mode='r')
+        if len(times) != len(values):  # 两个进程按不同版本同时重建时可能各替换了一个文件
+            self.build_snapshot(source, symbol, interval)
+            times, values = np.load(time_path, mmap_mode='r'), np.load(values_path, mmap_mode='r')
+        lo = 0 if start is None else int(np.searchsorted(times, to_timestamp(start).as_unit('ns').value))
+        hi = len(times) if end is None else int(np.searchsorted(times, to_timestamp(end).as_unit('ns').value))
+        return np.asarray(times[lo:hi]), np.asarray(values[lo:hi])
+
+    def read(self, source, symbol, interval, start, end):
+        """从快照读取 [start, end) 的 K 线（None 表示不限），不联网。返回的 DataFrame 直接引用映射的文件页，为只读。"""
+        if not os.path.isdir(self.series_dir(source, symbol, interval)):
+            return pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], name='time'), dtype=float)
+        times, values = self.read_arrays(source, symbol, interval, start, end)
+        index = pd.DatetimeIndex(times.view('datetime64[ns]'), name='time', copy=False)
+        return pd.DataFrame(values, index=index, columns=COLUMNS, copy=False)
+
+    def load(self, source, symbol, interval, start, end, fetch, adjusted=False):
+        """
+        返回 [start, end) 的 K 线。fetch(gap_start, gap_end) 负责从数据源下载缺失时段，
+        返回以时间为索引、包含 open/high/low/close/volume 的 DataFrame（可以为空，表示该时段确实没有数据）。
+        下载失败时 fetch 应抛出异常或返回 None：打印原因后跳过该时段（不登记为已抓取，下次请求时重试），
+        仍返回仓库中已有的数据。
+        尚未收盘的最后一根 K 线不登记为已抓取，下次请求时会重新获取。
+
+        adjusted=True 表示复权价格（yfinance auto_adjust、AKShare qfq）：复权以下载当天为基准，之后有分红 / 拆股时
+        早先存下的价格和新下载的不在同一基准上。此时每段缺口从仓库中它之前的最后一根 K 线开始下载，
+        这根 K 线的收盘价与已存的不一致说明基准变了，清空该标的后重新下载整个 [start, end)。
+        仓库不记录复权方式本身：在代码里改了复权方式（如 qfq 改为 hfq）后需要先调用 clear()。
+        """
+        start, end = to_timestamp(start), to_timestamp(end)
+        if not os.path.isdir(self.series_dir(source, symbol, interval)):
+            migrate_csv_caches(LEGACY_CSV_DIR, self, source, symbol, interval)
+        closed_until = pd.Timestamp.now(tz='UTC').tz_localize(None)
+        if is_time_interval(interval): closed_until = closed_until.floor(interval_to_timedelta(interval))
+        for gap_start, gap_end in self.missing_ranges(source, symbol, interval, start, min(end, closed_until)):
+            anchor = self.read(source, symbol, interval, None, gap_start).tail(1) if adjusted else None
+            fetch_start = anchor.index[0] if anchor is not None and len(anchor) else gap_start
+            print(f"[行情仓库] 抓取 {source} {symbol} {interval}: {gap_start} ~ {gap_end}")
+            try:
+                df = fetch(fetch_start, gap_end)
+            except Exception as e:  # 某一段下载失败不影响已缓存的数据
+                print(f"[行情仓库] 抓取出错: {type(e).__name__}: {e}")
+                df = None
+            if df is None:
+                print(f"[行情仓库] 抓取失败，下次运行时重试: {gap_start} ~ {gap_end}")
+                continue
+            if not df.empty:
+                df = normalize_ohlcv(df)
+                if fetch_start != gap_start and fetch_start in df.index and not np.isclose(
+                        df.at[fetch_start, 'close'], anchor['close'].iloc[0], rtol=ADJUSTMENT_RTOL, atol=0.0):
+                    print(f"[行情仓库] {source} {symbol} 的复权基准已变化（{fetch_start} 收盘价 "
+                          f"{anchor['close'].iloc[0]} -> {df.at[fetch_start, 'close']}），重新下载全部数据")
+                    self.clear(source, symbol, interval)
+                    return self.load(source, symbol, interval, start, end, fetch, adjusted)
+                df = df.loc[(df.index >= gap_start) & (df.index < gap_end)]
+            self.write(source, symbol, interval, df, gap_start, gap_end)
+        return self.read(source, symbol, interval, start, end)
+
+    def clear(self, source, symbol, interval):
+        """删除该标的的全部分区、覆盖记录和快照（保留目录，旧 CSV 缓存不会被重新导入）。"""
+        series_dir = self.series_dir(source, symbol, interval)
+        if not os.path.isdir(series_dir): return
+        for name in os.listdir(series_dir):
+            if name.endswith(PARTITION_EXT) or name in (COVERAGE_FILE, SNAPSHOT_TIME_FILE, SNAPSHOT_VALUES_FILE,
+                                                       SNAPSHOT_META_FILE):
+                os.remove(os.path.join(series_dir, name))
+        self._bump_generation(series_dir)
+
+    # --- 旧 CSV 缓存迁移 ---
+    def import_csv(self, path, source, symbol, interval, covered_start=None, covered_end=None):
+        """
+        导入旧脚本生成的 CSV 缓存，返回导入的行数。覆盖区间为当初请求的 [covered_start, covered_end)
+        （取自文件名，区间开头 / 结尾的休市日也算已抓取）与数据首尾时间的并集。
+        """
+        df = pd.read_csv(path, index_col=0, parse_dates=True)
+        df.columns = [str(col).lower() for col in df.columns]
+        if df.empty: return 0
+        df = normalize_ohlcv(df)
+        data_start, data_end = df.index[0], df.index[-1] + interval_to_timedelta(interval)
+        covered_start = min(to_timestamp(covered_start), data_start) if covered_start is not None else data_start
+        covered_end = max(to_timestamp(covered_end), data_end) if covered_end is not None else data_end
+        self.write(source, symbol, interval, df, covered_start, covered_end)
+        return len(df)
+
+
+STORE = OHLCVStore()
+LEGACY_CSV_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 旧缓存文件名: binance_BTCUSDT_1m_2026-01-01_2026-01-10.csv / YAHOO_TSLA_2020-01-01_2025-12-31.csv
+# 文件名中的日期为当初请求的区间；结束日期除 AKShare（包含当天）外都不包含在内
+LEGACY_CSV_PATTERNS = [
+    (re.compile(r'^binance_(?P<symbol>[A-Z0-9]+)_(?P<interval>\d+[mhdw])_(?P<start>[\d-]+)_(?P<end>[\d-]+)\.csv$'),
+     'binance'),
+    (re.compile(r'^(?P<source>BINANCE|YAHOO|AKSHARE)_(?P<symbol>[^_]+)_(?P<start>\d[\d-]+)_(?P<end>\d[\d-]+)\.csv$'),
+     None),
+]
+LEGACY_INCLUSIVE_END_SOURCES = ('akshare',)
+
+
+def migrate_csv_caches(directory, store=None, source=None, symbol=None, interval=None):
+    """
+    把目录下旧脚本的 CSV 缓存导入仓库（不删除原文件）。指定 source/symbol/interval 时只导入对应的文件，
+    仓库首次读取某个标的时会自动调用，因此旧缓存中已有的数据不会重新下载。
+    """
+    store = store or STORE
+    for name in sorted(os.listdir(directory)):
+        for pattern, default_source in LEGACY_CSV_PATTERNS:
+            match = pattern.match(name)
+            if not match: continue
+            fields = match.groupdict()
+            key = ((default_source or fields['source']).lower(), fields['symbol'], fields.get('interval') or '1d')
+            if (source, symbol, interval) != (None, None, None) and key != (source.lower(), symbol, interval): break
+            covered_end = to_timestamp(fields['end'])
+            if key[0] in LEGACY_INCLUSIVE_END_SOURCES: covered_end += pd.Timedelta(days=1)
+            rows = store.import_csv(os.path.join(directory, name), *key, to_timestamp(fields['start']), covered_end)
+            print(f"[行情仓库] 已导入旧缓存 {name}: {rows} 行")
+            break
+
+
+# ==========================================
+# 【币安 K 线下载】
+# ==========================================
+class WeightLimiter:
+    """
+    按整分钟窗口统计请求权重，本分钟预算用完时等待到下一分钟。
+    服务器返回的已用权重 (X-MBX-USED-WEIGHT-1M) 比本地计数更准确时以服务器为准；
+    收到 429/418 时所有请求暂停 Retry-After 秒。
+    """
+    def __init__(self, limit):
+        self.budget = limit
+        self.minute = None
+        self.used = 0
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, weight):
+        while True:
+            with self._lock:
+                now = time.time()
+                if now >= self.paused_until:
+                    if int(now // 60) != self.minute: self.minute, self.used = int(now // 60), 0
+                    if self.used + weight <= self.budget:
+                        self.used += weight
+                        return
+                wait = max(self.paused_until, (self.minute + 1) * 60) - now
+            time.sleep(max(wait, 0.01))
+
+    def update(self, used_weight):
+        with self._lock:
+            if int(time.time() // 60) == self.minute: self.used = max(self.used, used_weight)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+
+
+_binance_lock = threading.Lock()
+_binance_session = None
+_binance_limiter = WeightLimiter(int(BINANCE_WEIGHT_LIMIT * BINANCE_WEIGHT_HEADROOM))
+
+
+def get_binance_session():
+    """所有分页请求共用的连接池。"""
+    global _binance_session
+    with _binance_lock:
+        if _binance_session is None:
+            _binance_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=BINANCE_CONCURRENCY * 2)
+            _binance_session.mount('https://', adapter)
+            _binance_session.mount('http://', adapter)
+        return _binance_session
+
+
+def kline_windows(interval, start, end, limit=BINANCE_PAGE_LIMIT):
+    """把 [start, end) 按每页 limit 根 K 线预先切分为 [(start_ms, end_ms), ...]。"""
+    start_ms = int(to_timestamp(start).timestamp() * 1000)
+    end_ms = int(to_timestamp(end).timestamp() * 1000)
+    page_ms = int(interval_to_timedelta(interval).total_seconds() * 1000) * limit
+    return [(s, min(s + page_ms, end_ms)) for s in range(start_ms, end_ms, page_ms)]
+
+
+def fetch_klines_page(symbol, interval, start_ms, end_ms, base_url=BINANCE_API_URL, limiter=None):
+    """请求一页 K 线（[start_ms, end_ms)），限流或服务器错误时重试。返回币安原始数组。"""
+    limiter = limiter or _binance_limiter
+    params = {'symbol': symbol, 'interval': interval, 'startTime': start_ms, 'endTime': end_ms - 1,
+              'limit': BINANCE_PAGE_LIMIT}
+    for attempt in range(BINANCE_RETRIES + 1):
+        limiter.acquire(BINANCE_KLINES_WEIGHT)
+        try:
+            res = get_binance_session().get(f"{base_url}/api/v3/klines", params=params, timeout=15)
+        except requests.RequestException:
+            if attempt == BINANCE_RETRIES: raise
+            time.sleep(2 ** attempt)
+            continue
+        used_weight = res.headers.get('X-MBX-USED-WEIGHT-1M')
+        if used_weight: limiter.update(int(used_weight))
+        if res.status_code in (418, 429):
+            limiter.pause(int(res.headers.get('Retry-After', 60)))
+        elif res.status_code >= 500 and attempt < BINANCE_RETRIES:
+            time.sleep(2 ** attempt)
+        else:
+            res.raise_for_status()
+            data = res.json()
+            if isinstance(data, dict): raise ValueError(f"币安接口返回错误 {data.get('code')}: {data.get('msg')}")
+            return data
+    raise IOError(f"{symbol} {interval} 分页请求多次被限流")
+
+
+def fetch_binance_klines(symbol, interval, start, end, base_url=BINANCE_API_URL, concurrency=BINANCE_CONCURRENCY):
+    """
+    下载币安现货 K 线，返回 [start, end) 内的 DataFrame。
+    先按每页 1000 根切好全部分页窗口，再用共享连接池并发请求，按时间顺序拼接并去掉分页边界上的重复 K 线。
+    """
+    windows = kline_windows(interval, start, end)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        pages = list(executor.map(lambda w: fetch_klines_page(symbol, interval, *w, base_url=base_url), windows))
+    rows = [row for page in pages for row in page]
+    if not rows: return pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], name='time'), dtype=float)
+    df = pd.DataFrame([row[:6] for row in rows], columns=['time'] + COLUMNS)
+    df['time'] = pd.to_datetime(df['time'], unit='ms')
+    return normalize_ohlcv(df.set_index('time'))
+
+
+def load_binance_klines(symbol, interval, start, end, store=STORE):
+    """从仓库读取币安 K 线，缺失的时段自动下载补齐。"""
+    return store.load('binance', symbol, interval, start, end,
+                      lambda gap_start, gap_end: fetch_binance_klines(symbol, interval, gap_start, gap_end))
+
+
+def load_binance_klines_many(symbols, interval, start, end, store=STORE):
+    """多个标的同时补齐，返回 {symbol: DataFrame}。请求权重由全部标的共同受 WeightLimiter 约束。"""
+    with ThreadPoolExecutor(max_workers=max(1, len(symbols))) as executor:
+        frames = executor.map(lambda symbol: load_binance_klines(symbol, interval, start, end, store), symbols)
+        return dict(zip(symbols, frames))
+
+
+if __name__ == '__main__':
+    # 一次性迁移：python ohlcv_store.py [旧CSV所在目录]
+    import sys
+    migrate_csv_caches(sys.argv[1] if len(sys.argv) > 1 else LEGACY_CSV_DIR)
@@ -0,0 +1,244 @@
+"""
+参数扫描：网格 / 随机 / 贝叶斯 (TPE) 搜索，用进程池在全部 CPU 核心上并行运行向量化回测。
+
+用法:
+    python param_sweep.py <策略> [grid|random|bayes] [试验次数] [排序指标]
+    python param_sweep.py ma grid
+    python param_sweep.py hf bayes 64
+    python param_sweep.py multi random 200 cagr
+
+策略: ma (MaCrossStrategy, TSLA 日线) / hf (FeeAwareDynamicStrategy, SOL/ETH 1m) /
+      multi (ScientificMultiFactor, BTC 1h)。搜索空间见 SEARCH_SPACES，结果表按排序指标排好后输出并保存为 CSV。
+
+行情在主进程中补齐后，每个工作进程启动时从行情仓库的内存映射快照读取一次，之后的试验共用同一份数据。
+"""
+import itertools
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import vector_backtest as vb
+from analytics import SECONDS_PER_YEAR, bar_returns, periods_per_year, sharpe_ratio
+from ohlcv_store import STORE, fetch_binance_klines, to_timestamp
+
+RESULT_COLUMNS = ['final_value', 'cagr', 'sharpe', 'max_drawdown']
+TPE_GAMMA = 0.25          # 排名前 25% 的试验视为"好"样本
+TPE_CANDIDATES = 48       # 每次建议时从好样本分布中抽取的候选点数
+
+# 每个策略: 回测函数、行情 (source, symbol, interval, start, end)、固定参数、夏普比率的年化无风险利率
+STRATEGIES = {
+    'ma': dict(run=vb.run_ma_cross, data=[('yahoo', 'TSLA', '1d', '2022-06-01', '2025-12-31')],
+               kwargs=dict(commission=0.001, percents=50), riskfreerate=0.02),
+    'hf': dict(run=vb.run_fee_aware, data=[('binance', 'SOLUSDT', '1m', '2026-01-01', '2026-01-10'),
+                                           ('binance', 'ETHUSDT', '1m', '2026-01-01', '2026-01-10')],
+               kwargs=dict(commission=0.0004, portfolio_use_percent=0.2), riskfreerate=0.01),
+    'multi': dict(run=vb.run_multifactor, data=[('binance', 'BTCUSDT', '1h', '2024-01-01', '2026-01-01')],
+                  kwargs=dict(commission=0.0004), riskfreerate=0.01),
+}
+
+# 搜索空间: 列表 = 候选值（网格搜索只接受列表）；(整数, 整数) = 闭区间整数；(浮点, 浮点) = 均匀分布
+SEARCH_SPACES = {
+    'ma': {
+        'grid': {'fast': [3, 5, 8, 10, 15, 20], 'slow': [20, 30, 50, 80, 120, 200]},
+        'random': {'fast': (2, 30), 'slow': (10, 250)},
+    },
+    'hf': {
+        'grid': {'lookback': [300, 500, 1000, 2000], 'q_entry': [0.95, 0.97, 0.98, 0.99],
+                 'min_profit_pct': [0.0015, 0.0025, 0.004]},
+        'random': {'lookback': (200, 3000), 'q_entry': (0.9, 0.995), 'min_profit_pct': (0.001, 0.006)},
+    },
+    'multi': {
+        'grid': {'ema_long': [100, 150, 200, 300], 'adx_min': [15, 20, 25, 30, 35],
+                 'risk_percent': [0.005, 0.01, 0.02]},
+        'random': {'ema_long': (50, 400), 'adx_min': (10, 40), 'risk_percent': (0.0025, 0.03)},
+    },
+}
+
+
+# ==========================================
+# 【1. 行情准备与工作进程】
+# ==========================================
+def _missing_data(source, symbol):
+    def fetch(start, end):
+        raise LookupError(f"行情仓库缺少 {source} {symbol} {start} ~ {end}，请先运行对应的策略脚本下载")
+    return fetch
+
+
+def prepare_data(specs):
+    """在主进程中补齐行情（币安可自动下载，其它数据源需已由策略脚本写入仓库）。"""
+    for source, symbol, interval, start, end in specs:
+        fetch = ((lambda s, e, symbol=symbol, interval=interval: fetch_binance_klines(symbol, interval, s, e))
+                 if source == 'binance' else _missing_data(source, symbol))
+        STORE.load(source, symbol, interval, start, end, fetch)
+
+
+def load_frames(specs):
+    """从内存映射快照读取行情；多个标的时只保留共同的时间戳。"""
+    frames = [STORE.read(*spec) for spec in specs]
+    if len(frames) > 1:
+        common = frames[0].index
+        for df in frames[1:]: common = common.intersection(df.index)
+        frames = [df.loc[common] for df in frames]
+    return frames
+
+
+_worker = {}
+
+
+def _init_worker(strategy):
+    _worker.update(strategy=strategy, frames=load_frames(STRATEGIES[strategy]['data']))
+
+
+def result_metrics(result, riskfreerate, years=None):
+    """
+    最终资产、年化收益率 (%)、夏普比率和最大回撤 (%)。years 默认按结果的首尾时间计算。
+    夏普比率同 analytics.summarize：按每根 K 线的收益率计算，再按真实的 K 线间隔年化，几天的 1m 行情也能计算。
+    """
+    if years is None:
+        years = (result.index[-1] - result.index[0]).total_seconds() / SECONDS_PER_YEAR if len(result.index) else 0
+    cagr = (pow(result.final_value / result.start_cash, 1 / years) - 1) * 100 if years > 0 else 0.0
+    equity = pd.Series(result.values, index=result.index)
+    sharpe = sharpe_ratio(bar_returns(equity, result.start_cash), periods_per_year(result.index), riskfreerate)
+    return dict(final_value=result.final_value, cagr=cagr, sharpe=sharpe, max_drawdown=result.max_drawdown)
+
+
+def evaluate(strategy, frames, params):
+    """运行一次回测，返回 result_metrics。年化收益率按配置的起止日期计算，与各脚本的报告一致。"""
+    config = STRATEGIES[strategy]
+    result = config['run'](*frames, **config['kwargs'], **params)
+    _, _, _, start, end = config['data'][0]
+    years = (to_timestamp(end) - to_timestamp(start)).total_seconds() / SECONDS_PER_YEAR
+    return result_metrics(result, config['riskfreerate'], years)
+
+
+def _run_trial(params):
+    try:
+        return {**params, **evaluate(_worker['strategy'], _worker['frames'], params)}
+    except Exception as e:  # 某组参数出错不影响其它试验
+        return {**params, 'error': f"{type(e).__name__}: {e}"}
+
+
+# ==========================================
+# 【2. 搜索空间采样】
+# ==========================================
+def grid_points(space):
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+
+
+def sample_param(spec, rng):
+    if isinstance(spec, list): return spec[rng.integers(len(spec))]
+    low, high = spec
+    if isinstance(low, int) and isinstance(high, int): return int(rng.integers(low, high + 1))
+    return float(rng.uniform(low, high))
+
+
+def random_points(space, n, rng):
+    return [{name: sample_param(spec, rng) for name, spec in space.items()} for _ in range(n)]
+
+
+def objective(row, sort_by):
+    value = row.get(sort_by)
+    if value is None or (isinstance(value, float) and math.isnan(value)): return -math.inf
+    return -value if sort_by == 'max_drawdown' else value
+
+
+def tpe_points(space, history, n, rng, sort_by):
+    """
+    Tree-structured Parzen Estimator：把已完成的试验按目标分成好 / 差两组，
+    从好样本附近抽取候选点，选 l(x)/g(x)（好样本密度 / 差样本密度）最大的 n 个。
+    """
+    ranked = sorted(history, key=lambda row: objective(row, sort_by), reverse=True)
+    n_good = max(1, int(len(ranked) * TPE_GAMMA))
+    good, bad = ranked[:n_good], ranked[n_good:] or ranked
+    candidates = []
+    for _ in range(n * TPE_CANDIDATES):
+        anchor = good[rng.integers(len(good))]
+        point = {}
+        for name, spec in space.items():
+            if isinstance(spec, list) or rng.random() < 0.1:  # 类别参数和少量随机扰动直接重新采样
+                point[name] = sample_param(spec, rng)
+                continue
+            low, high = spec
+            value = float(np.clip(anchor[name] + rng.normal(0, (high - low) / 6), low, high))
+            point[name] = int(round(value)) if isinstance(low, int) and isinstance(high, int) else value
+        candidates.append(point)
+
+    def log_density(point, rows):
+        total = 0.0
+        for name, spec in space.items():
+            if isinstance(spec, list):
+                total += math.log((sum(row[name] == point[name] for row in rows) + 1) / (len(rows) + len(spec)))
+            else:
+                width = (spec[1] - spec[0]) / 6 or 1.0
+                dist = np.array([row[name] for row in rows], dtype=float) - point[name]
+                total += math.log(np.exp(-0.5 * (dist / width) ** 2).mean() + 1e-12)
+        return total
+
+    scored = sorted(candidates, key=lambda p: log_density(p, good) - log_density(p, bad), reverse=True)
+    seen = {tuple((name, row[name]) for name in space) for row in history}
+    points = []
+    for point in scored:
+        key = tuple((name, point[name]) for name in space)
+        if key in seen: continue
+        seen.add(key)
+        points.append(point)
+        if len(points) == n: break
+    return points
+
+
+# ==========================================
+# 【3. 扫描】
+# ==========================================
+def sweep(strategy, method='grid', trials=None, sort_by='sharpe', space=None, workers=None, seed=0):
+    """
+    运行参数扫描，返回按 sort_by 排序的结果表（max_drawdown 升序，其余降序）。
+    method='grid' 遍历 space 中所有组合；'random' 随机抽取 trials 组；'bayes' 先随机抽取一批，
+    之后每批由 TPE 根据已完成的结果建议新的参数。workers 默认为 CPU 核心数。
+    """
+    space = space or SEARCH_SPACES[strategy]['grid' if method == 'grid' else 'random']
+    workers = workers or os.cpu_count() or 1
+    rng = np.random.default_rng(seed)
+    prepare_data(STRATEGIES[strategy]['data'])
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(strategy,)) as executor:
+        if method in ('grid', 'random'):
+            points = grid_points(space) if method == 'grid' else random_points(space, trials or 100, rng)
+            rows = list(executor.map(_run_trial, points, chunksize=max(1, len(points) // (workers * 4))))
+        elif method == 'bayes':
+            trials = trials or 64
+            batch = random_points(space, min(trials, max(workers, 10)), rng)
+            while batch:
+                rows += executor.map(_run_trial, batch)
+                done = [row for row in rows if 'error' not in row]
+                remaining = trials - len(rows)
+                batch = tpe_points(space, done, min(workers, remaining), rng, sort_by) if remaining > 0 and done else []
+        else:
+            raise ValueError(f"未知的搜索方式: {method}")
+    df = pd.DataFrame(rows)
+    for col in RESULT_COLUMNS:
+        if col not in df: df[col] = np.nan
+    return df.sort_values(sort_by, ascending=(sort_by == 'max_drawdown'), na_position='last', ignore_index=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in STRATEGIES:
+        print(__doc__)
+        sys.exit(1)
+    strategy = sys.argv[1]
+    method = sys.argv[2] if len(sys.argv) > 2 else 'grid'
+    trials = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    sort_by = sys.argv[4] if len(sys.argv) > 4 else 'sharpe'
+
+    start = time.perf_counter()
+    results = sweep(strategy, method, trials, sort_by)
+    elapsed = time.perf_counter() - start
+    output_file = f"sweep_{strategy}_{method}.csv"
+    results.to_csv(output_file, index=False)
+    print(results.head(20).to_string(float_format=lambda v: f"{v:,.4f}"))
+    print(f"\n{len(results)} 组参数，{os.cpu_count()} 个进程，耗时 {elapsed:.1f}s，完整结果已保存到 {output_file}")
@@ -0,0 +1,184 @@
+import hashlib
+import inspect
+import os
+import pickle
+
+import numpy as np
+import backtrader as bt
+
+from analytics import Recorder
+from ohlcv_store import STORE_DIR
+
+# ==========================================
+# 【回测结果缓存】
+# 策略脚本每次运行都会把整个回测重跑一遍，哪怕什么都没改（或者只改了 SHOW_TRADE_LOG 之类的显示开关）。
+# run_cached(cerebro) 根据已经配置好的 Cerebro 计算一个指纹，命中时直接返回上次保存的结果：
+#   - 策略代码: 策略类及其基类的源码，以及方法里引用到的本目录下的类 / 函数（递归）和全局常量
+#     （SHOW_ 开头的显示开关除外）
+#   - 策略参数（含默认值）、初始资金、手续费、sizer、broker 与 Cerebro 的设置、分析器及其参数
+#   - 每个数据源的参数和 DataFrame 内容哈希（含 cached_feed 附加的指标列）
+# 保存的内容: 最终资产、各分析器的 get_analysis() 结果、analytics.Recorder 记录的逐根 K 线资金曲线和成交。
+#
+# 目录结构: ohlcv_data/_results/<指纹>.pkl。只缓存第一个策略的结果（不支持 optstrategy）。
+# ==========================================
+RESULT_CACHE_DIR = os.path.join(STORE_DIR, '_results')
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IGNORED_GLOBAL_PREFIX = 'SHOW_'  # 只影响输出、不影响结果的开关
+
+
+# ==========================================
+# 【1. 指纹】
+# ==========================================
+def _is_local(obj):
+    """是否为本目录下定义的类 / 函数（第三方库的代码由 backtrader 版本号代表）。"""
+    if not (inspect.isclass(obj) or inspect.isfunction(obj)): return False
+    try:
+        path = inspect.getsourcefile(obj)
+    except TypeError:
+        return False
+    return path is not None and os.path.abspath(path).startswith(BASE_DIR + os.sep)
+
+
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const): names |= _code_names(const)
+    return names
+
+
+def code_fingerprint(strategy):
+    """策略类及其依赖的本地代码的源码，和方法中引用的全局常量。"""
+    seen, sources, constants = set(), [], {}
+
+    def visit(obj):
+        if id(obj) in seen or not _is_local(obj): return
+        seen.add(id(obj))
+        sources.append(inspect.getsource(obj))
+        if inspect.isclass(obj):
+            for base in obj.__mro__[1:]: visit(base)
+            functions = [getattr(v, '__func__', v) for v in vars(obj).values()]
+            functions = [f for f in functions if inspect.isfunction(f)]
+        else:
+            functions = [obj]
+        for func in functions:
+            names = _code_names(func.__code__)
+            for name in sorted(names):
+                if name not in func.__globals__: continue
+                value = func.__globals__[name]
+                if isinstance(value, (bool, int, float, str)):
+                    if not name.startswith(IGNORED_GLOBAL_PREFIX): constants[f"{func.__module__}.{name}"] = value
+                elif inspect.ismodule(value):
+                    for attr in sorted(names):
+                        if hasattr(value, attr): visit(getattr(value, attr))
+                else:
+                    visit(value)
+
+    visit(strategy)
+    return sources, sorted(constants.items())
+
+
+def frame_fingerprint(df):
+    """DataFrame 内容哈希：列名、时间索引和全部数值。"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(list(df.columns)).encode())
+    digest.update(df.index.as_unit('ns').asi8.tobytes())
+    digest.update(np.ascontiguousarray(df.to_numpy(dtype=float)).tobytes())
+    return digest.hexdigest()
+
+
+def _plain(value):
+    """把参数值转成稳定的文本（类写成全名，带 params 的对象写成类名 + 参数）。"""
+    if inspect.isclass(value): return f"{value.__module__}.{value.__qualname__}"
+    if isinstance(value, dict): return {str(k): _plain(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)): return [_plain(v) for v in value]
+    if hasattr(value, 'p') and hasattr(value.p, '_getitems'):
+        return [_plain(type(value)), _plain(dict(value.p._getitems()))]
+    return repr(value)
+
+
+def _params(cls, args, kwargs):
+    return _plain([cls, list(args), {**dict(cls.params._getitems()), **kwargs}])
+
+
+def run_key(cerebro):
+    """已配置好（尚未运行）的 Cerebro 的结果指纹。"""
+    if len(cerebro.strats) != 1 or len(cerebro.strats[0]) != 1: raise ValueError("只支持单个策略的回测")
+    strategy, args, kwargs = cerebro.strats[0][0]
+    broker = cerebro.broker
+    parts = dict(
+        backtrader=bt.__version__,
+        code=code_fingerprint(strategy),
+        strategy=_params(strategy, args, kwargs),
+        cash=broker.startingcash,
+        commission=_plain(broker.comminfo),
+        broker=_plain({k: v for k, v in broker.p._getitems() if k not in ('cash', 'commission')}),
+        sizers=_plain(cerebro.sizers),
+        cerebro=_plain(dict(cerebro.p._getitems())),
+        analyzers=[_params(cls, a, kw) for cls, a, kw in cerebro.analyzers],
+        datas=[[frame_fingerprint(data.p.dataname),
+                _plain({k: v for k, v in data.p._getitems() if k != 'dataname'})] for data in cerebro.datas],
+    )
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+# ==========================================
+# 【2. 运行与缓存】
+# ==========================================
+class BacktestRecord:
+    def __init__(self, final_value, analyzers, recording, cached=False):
+        self.final_value = final_value
+        self.analyzers = analyzers  # 分析器名称 -> get_analysis() 结果
+        self.recording = recording  # Recorder.get_analysis()：资金曲线、成交和初始资金，交给 analytics.summarize
+        self.cached = cached
+
+    @property
+    def equity(self):
+        return self.recording['equity']
+
+
+class ResultCache:
+    def __init__(self, root=RESULT_CACHE_DIR):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.pkl")
+
+    def load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path): return None
+        try:
+            with open(path, 'rb') as f:
+                record = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None  # 文件损坏或旧版本留下的缓存，当作未命中
+        if not isinstance(getattr(record, 'recording', None), dict): return None
+        record.cached = True
+        return record
+
+    def save(self, key, record):
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+RESULTS = ResultCache()
+
+
+def run_cached(cerebro, cache=RESULTS, refresh=False):
+    """
+    返回 cerebro 的回测结果 (BacktestRecord)。缓存命中时不运行回测（record.cached 为 True，cerebro 保持未运行，
+    不能再 plot）；refresh=True 时总是重新运行并覆盖缓存。
+    """
+    key = run_key(cerebro)
+    if not refresh:
+        record = cache.load(key)
+        if record is not None: return record
+    cerebro.addanalyzer(Recorder, _name='_recorder')
+    strat = cerebro.run()[0]
+    analyzers = {name: strat.analyzers.getbyname(name).get_analysis() for name in strat.analyzers.getnames()}
+    record = BacktestRecord(cerebro.broker.getvalue(), analyzers, analyzers.pop('_recorder'))
+    cache.save(key, record)
+    return record
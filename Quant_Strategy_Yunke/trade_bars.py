@@ -0,0 +1,255 @@
+"""
+逐笔成交导入：把币安逐笔 / 归集成交 (aggTrades) 的历史文件分块读取，流式聚合成时间、成交量或成交额 K 线，
+写入行情仓库，策略脚本照常用 load_binance_klines 读取（例如 High Freq.py 的 INTERVAL 改成 '1s' / '5s'）。
+
+用法:
+    python trade_bars.py <标的> <K 线> <文件...>
+    python trade_bars.py SOLUSDT 1s SOLUSDT-aggTrades-2026-01-0*.zip
+    python trade_bars.py SOLUSDT vol5k SOLUSDT-aggTrades-2026-01.zip
+    python trade_bars.py ETHUSDT dollar10m ETHUSDT-trades-2026-01-01.zip
+
+K 线写法:
+    1s / 5s / 1m ...    时间 K 线，以开盘时间为索引；没有成交的区间用上一根收盘价补齐、成交量为 0（同币安 1s K 线）
+    vol5k / vol2.5m     成交量 K 线（数量单位为标的币，k / m / b 表示千 / 百万 / 十亿）
+    dollar10m           成交额 K 线（价格 × 数量，单位为计价币）
+
+文件为 data.binance.vision 的 CSV 或 zip（download_trade_dump 可下载），文件名含 'trades' 且不含 'aggTrades'
+时按逐笔成交格式读取。同一标的的文件按时间顺序依次处理，前一个文件末尾未完成的 K 线会和下一个文件接上。
+"""
+import os
+import re
+import sys
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv  # 流式多线程 CSV 解析，比 pandas 分块读取快约一倍
+except ImportError:
+    pa_csv = None
+
+from ohlcv_store import COLUMNS, STORE, get_binance_session, interval_to_timedelta, is_time_interval
+
+TRADE_CHUNK_ROWS = 2_000_000    # 每次读入的成交笔数（pyarrow 按字节分块，约为这个笔数）
+TRADE_ROW_BYTES = 64            # 成交文件每行的大致字节数
+FLUSH_BARS = 1_000_000          # 攒够这么多根 K 线写一次仓库
+BINANCE_DUMP_URL = 'https://data.binance.vision/data/spot'
+
+# 各种成交文件中 价格 / 数量 / 时间 三列的位置
+TRADE_FORMATS = {
+    'aggTrades': (1, 2, 5),  # agg_trade_id, price, quantity, first_trade_id, last_trade_id, transact_time, ...
+    'trades': (1, 2, 4),     # id, price, qty, quote_qty, time, is_buyer_maker, ...
+}
+EVENT_BAR_PATTERN = re.compile(r'(vol|dollar)(\d+(?:\.\d+)?)([kmb]?)')
+UNIT_MULTIPLIERS = {'': 1, 'k': 1e3, 'm': 1e6, 'b': 1e9}
+
+
+# ==========================================
+# 【1. 读取成交文件】
+# ==========================================
+def trade_format(path):
+    name = os.path.basename(path)
+    return 'trades' if 'trades' in name and 'aggTrades' not in name else 'aggTrades'
+
+
+def _to_ns(times):
+    """币安成交时间：2025 年起的现货文件为微秒，之前及合约为毫秒。按数量级统一转成纳秒。"""
+    if not len(times): return times
+    if times[-1] > 10 ** 17: return times
+    return times * (1000 if times[-1] > 10 ** 14 else 1_000_000)
+
+
+def _open(path):
+    """CSV 或只含一个 CSV 的 zip，以二进制流打开（zip 边读边解压，不落盘）。"""
+    if not path.endswith('.zip'): return open(path, 'rb')
+    archive = zipfile.ZipFile(path)
+    return archive.open(archive.namelist()[0])
+
+
+def read_trades(path, kind=None, chunksize=TRADE_CHUNK_ROWS):
+    """分块读取成交文件，逐块产出 (纳秒时间戳 int64, 价格, 数量)。有无表头均可。"""
+    price_col, qty_col, time_col = TRADE_FORMATS[kind or trade_format(path)]
+    with _open(path) as f:
+        header = 0 if f.readline().split(b',')[0].strip().isdigit() else 1
+    with _open(path) as f:
+        if pa_csv is not None:
+            names = {col: f"f{col}" for col in (price_col, qty_col, time_col)}
+            reader = pa_csv.open_csv(
+                f, read_options=pa_csv.ReadOptions(autogenerate_column_names=True, skip_rows=header,
+                                                   block_size=chunksize * TRADE_ROW_BYTES),
+                convert_options=pa_csv.ConvertOptions(
+                    include_columns=list(names.values()),
+                    column_types={names[price_col]: pa.float64(), names[qty_col]: pa.float64(),
+                                  names[time_col]: pa.int64()}))
+            for batch in reader:
+                times, prices, qtys = (batch.column(names[col]).to_numpy() for col in (time_col, price_col, qty_col))
+                yield _to_ns(times), prices, qtys
+            return
+        reader = pd.read_csv(f, header=None, skiprows=header, usecols=[price_col, qty_col, time_col],
+                             dtype={price_col: np.float64, qty_col: np.float64, time_col: np.int64},
+                             float_precision='round_trip', chunksize=chunksize)
+        for chunk in reader:
+            yield (_to_ns(chunk[time_col].to_numpy()), chunk[price_col].to_numpy(), chunk[qty_col].to_numpy())
+
+
+def trade_dump_url(symbol, date, kind='aggTrades'):
+    """data.binance.vision 上的日度 ('2026-01-01') 或月度 ('2026-01') 成交文件地址。"""
+    period = 'daily' if len(date) > 7 else 'monthly'
+    return f"{BINANCE_DUMP_URL}/{period}/{kind}/{symbol}/{symbol}-{kind}-{date}.zip"
+
+
+def download_trade_dump(symbol, date, directory, kind='aggTrades'):
+    """下载成交文件到 directory（已存在则跳过），返回本地路径。"""
+    url = trade_dump_url(symbol, date, kind)
+    path = os.path.join(directory, os.path.basename(url))
+    if os.path.exists(path): return path
+    os.makedirs(directory, exist_ok=True)
+    with get_binance_session().get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for block in response.iter_content(1 << 20): f.write(block)
+    os.replace(tmp_path, path)
+    return path
+
+
+# ==========================================
+# 【2. 流式聚合】
+# ==========================================
+class TradeBars:
+    """
+    把按时间排序的成交流聚合成 K 线。push() 每次处理一块成交，返回其中已经完成的 K 线；
+    最后一根可能还没结束，它的成交留到下一块再算，flush() 输出剩下的部分。每块只做一次向量化的分组聚合，
+    内存只和块大小有关。
+
+    成交量 / 成交额 K 线按累计量穿过阈值整数倍的那笔成交收盘（一笔大单跨过多个阈值时只收一根），
+    索引为 K 线第一笔成交的时间；同一时刻开盘的多根 K 线依次加 1 纳秒，保证索引严格递增。
+    """
+    def __init__(self, bar):
+        self.bar = bar
+        self.step = interval_to_timedelta(bar).value if is_time_interval(bar) else None
+        if self.step is None:
+            match = EVENT_BAR_PATTERN.fullmatch(bar)
+            if not match: raise ValueError(f"无法识别的 K 线: {bar}")
+            self.measure = match.group(1)
+            self.threshold = float(match.group(2)) * UNIT_MULTIPLIERS[match.group(3)]
+        self.carry = None          # 未完成的最后一根 K 线的成交
+        self.carry_total = 0.0     # 这些成交之前的累计量（成交量 / 成交额 K 线）
+        self._before = None
+        self.last_bucket = None    # 上一根输出的时间 K 线编号和收盘价，用于补齐空白区间
+        self.last_close = np.nan
+        self.last_time = None
+
+    def _groups(self, times, prices, qtys):
+        if self.step is not None: return times // self.step
+        measure = qtys if self.measure == 'vol' else prices * qtys
+        before = self.carry_total + np.cumsum(measure) - measure
+        self._before = before
+        return np.floor(before / self.threshold)
+
+    def push(self, times, prices, qtys, final=False):
+        if self.carry is not None:
+            times, prices, qtys = (np.concatenate([c, x]) for c, x in zip(self.carry, (times, prices, qtys)))
+        if not len(times): return self._empty()
+        groups = self._groups(times, prices, qtys)
+        starts = np.r_[0, np.flatnonzero(groups[1:] != groups[:-1]) + 1]
+        if not final:  # 最后一组留到下一块
+            cut = starts[-1]
+            self.carry = times[cut:], prices[cut:], qtys[cut:]
+            if self.step is None: self.carry_total = float(self._before[cut])
+            starts, times, prices, qtys, groups = starts[:-1], times[:cut], prices[:cut], qtys[:cut], groups[:cut]
+        else:
+            self.carry = None
+        if not len(starts): return self._empty()
+        ends = np.r_[starts[1:], len(times)] - 1
+        bars = (prices[starts], np.maximum.reduceat(prices, starts), np.minimum.reduceat(prices, starts),
+                prices[ends], np.add.reduceat(qtys, starts))
+        if self.step is not None: return self._time_bars(groups[starts].astype(np.int64), *bars)
+        return self._frame(self._unique_times(times[starts]), *bars)
+
+    def flush(self):
+        if self.carry is None: return self._empty()
+        return self.push(*(np.empty(0, dtype=c.dtype) for c in self.carry), final=True)
+
+    def _time_bars(self, buckets, open_, high, low, close, volume):
+        """补齐没有成交的区间：OHLC 取上一根收盘价，成交量为 0。"""
+        first = buckets[0] if self.last_bucket is None else self.last_bucket + 1
+        n = int(buckets[-1] - first + 1)
+        pos = buckets - first
+        full = [np.full(n, np.nan) for _ in range(4)] + [np.zeros(n)]
+        for line, values in zip(full, (open_, high, low, close, volume)): line[pos] = values
+        filled = np.zeros(n, dtype=bool)
+        filled[pos] = True
+        last = np.maximum.accumulate(np.where(filled, np.arange(n), -1))
+        prev_close = np.where(last >= 0, full[3][np.maximum(last, 0)], self.last_close)
+        for line in full[:4]: line[~filled] = prev_close[~filled]
+        self.last_bucket, self.last_close = int(buckets[-1]), float(close[-1])
+        return self._frame((first + np.arange(n)) * self.step, *full)
+
+    def _unique_times(self, times):
+        floor = np.iinfo(np.int64).min if self.last_time is None else self.last_time + 1
+        # t_i' = max(t_i, t_{i-1}' + 1)：减去位置序号后做前缀最大值，再加回来
+        offsets = np.arange(len(times))
+        unique = np.maximum.accumulate(np.maximum(times - offsets, floor)) + offsets
+        self.last_time = int(unique[-1])
+        return unique
+
+    def _empty(self):
+        return self._frame(np.empty(0, dtype=np.int64), *(np.empty(0),) * 5)
+
+    def _frame(self, times, open_, high, low, close, volume):
+        index = pd.DatetimeIndex(np.asarray(times, dtype=np.int64).view('datetime64[ns]'), name='time')
+        return pd.DataFrame(dict(zip(COLUMNS, (open_, high, low, close, volume))), index=index)
+
+
+# ==========================================
+# 【3. 写入行情仓库】
+# ==========================================
+def ingest_trades(paths, symbol, bar, source='binance', kind=None, chunksize=TRADE_CHUNK_ROWS, store=STORE):
+    """
+    把成交文件（按时间顺序）聚合成 bar K 线写入仓库 (source, symbol, bar)，最后把首笔到末笔成交覆盖的时段登记为已抓取。
+    返回 (成交笔数, K 线根数)。
+    """
+    resampler = TradeBars(bar)
+    buffer, buffered, trades, bars = [], 0, 0, 0
+    first_time = last_time = None
+
+    def write(frames):
+        df = pd.concat(frames)
+        store.write(source, symbol, bar, df, None, None)
+        return len(df)
+
+    for path in paths:
+        for times, prices, qtys in read_trades(path, kind, chunksize):
+            if not len(times): continue
+            if first_time is None: first_time = int(times[0])
+            last_time, trades = int(times[-1]), trades + len(times)
+            df = resampler.push(times, prices, qtys)
+            buffer.append(df)
+            buffered += len(df)
+            if buffered >= FLUSH_BARS:
+                bars += write(buffer)
+                buffer, buffered = [], 0
+    buffer.append(resampler.flush())
+    bars += write(buffer)
+    if first_time is None: return 0, 0
+    step = resampler.step
+    start = pd.Timestamp(first_time if step is None else first_time // step * step)
+    end = pd.Timestamp(last_time + 1 if step is None else (last_time // step + 1) * step)
+    store.write(source, symbol, bar, None, start, end)
+    return trades, bars
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print(__doc__)
+        sys.exit(1)
+    symbol, bar, paths = sys.argv[1], sys.argv[2], sys.argv[3:]
+    began = time.perf_counter()
+    n_trades, n_bars = ingest_trades(paths, symbol, bar)
+    elapsed = time.perf_counter() - began
+    print(f"{symbol} {bar}: {n_trades:,} 笔成交 -> {n_bars:,} 根 K 线，耗时 {elapsed:.1f}s "
+          f"({n_trades / max(elapsed, 1e-9) / 1e6:.1f} 百万笔/秒)")
@@ -0,0 +1,369 @@
+import math
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# ==========================================
+# 【向量化回测引擎】
+# 与 backtrader 版策略逐项对应：指标用整段数组计算（公式、预热期与 backtrader 指标一致），
+# 成交在一个紧凑的循环里模拟 BackBroker 的规则：
+#   - 第 t 根 K 线发出的市价单在第 t+1 根开盘成交，最后一根 K 线发出的订单不成交
+#   - 提交检查按下单时的收盘价预演，现金为负则拒单；成交时开仓部分现金不足同样不成交
+#   - 手续费 = |数量| × 成交价 × commission，做空 (现货模式) 卖出所得计入现金
+#   - 账户价值 = 现金 + Σ 持仓 × 收盘价，夏普比率与回撤的算法同 SharpeRatio / DrawDown 分析器
+# 用于 1m 数据和参数研究；与 backtrader 结果的一致性由 bench_vector.py 检查。
+# ==========================================
+START_CASH = 100000.0
+SHARPE_FACTORS = {'days': 252, 'years': 1}
+
+
+# ==========================================
+# 【1. 指标】 输入输出都是 float 数组，预热期为 NaN
+# ==========================================
+def rolling_sum(x, period):
+    out = np.full(len(x), np.nan)
+    if len(x) >= period: out[period - 1:] = sliding_window_view(x, period).sum(axis=1)
+    return out
+
+
+def sma(x, period):
+    return rolling_sum(x, period) / period
+
+
+def exp_smooth(x, period, alpha):
+    """以前 period 个有效值的均值为种子的指数平滑 (backtrader ExponentialSmoothing)。"""
+    out = np.full(len(x), np.nan)
+    valid = np.flatnonzero(~np.isnan(x))
+    if len(valid) == 0 or len(x) - valid[0] < period: return out
+    seed = valid[0] + period - 1
+    prev = out[seed] = math.fsum(x[valid[0]:seed + 1]) / period
+    alpha1, values = 1.0 - alpha, x.tolist()
+    smoothed = out.tolist()
+    for i in range(seed + 1, len(x)):
+        smoothed[i] = prev = prev * alpha1 + values[i] * alpha
+    return np.array(smoothed)
+
+
+def ema(x, period):
+    return exp_smooth(x, period, 2.0 / (1.0 + period))
+
+
+def smma(x, period):
+    """Wilder 平滑 (SMMA)，ATR / RSI / ADX 使用。"""
+    return exp_smooth(x, period, 1.0 / period)
+
+
+def stddev(x, period):
+    """总体标准差，同 backtrader StdDev: sqrt(|mean(x²) - mean(x)²|)。"""
+    return np.sqrt(np.abs(sma(x ** 2, period) - sma(x, period) ** 2))
+
+
+def rolling_zscore(x, period):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (x - sma(x, period)) / stddev(x, period)
+
+
+def shift(x, n=1):
+    out = np.full(len(x), np.nan)
+    out[n:] = x[:-n]
+    return out
+
+
+def crossover(a, b):
+    """+1 上穿、-1 下穿、其余 0。与 CrossOver 相同，相等的 K 线沿用上一次非零的差值判断方向。"""
+    diff = a - b
+    nzd = pd.Series(np.where(diff == 0, np.nan, diff)).ffill().to_numpy()
+    before = shift(nzd)
+    return ((before < 0) & (a > b)).astype(float) - ((before > 0) & (a < b)).astype(float)
+
+
+def true_range(high, low, close):
+    prev_close = shift(close)
+    return np.maximum(high, prev_close) - np.minimum(low, prev_close)
+
+
+def ultimate_oscillator(high, low, close, p1=7, p2=14, p3=28):
+    bp = close - np.minimum(low, shift(close))
+    tr = true_range(high, low, close)
+    av1, av2, av3 = (rolling_sum(bp, p) / rolling_sum(tr, p) for p in (p1, p2, p3))
+    factor = 100.0 / (4.0 + 2.0 + 1.0)
+    return (4.0 * factor) * av1 + (2.0 * factor) * av2 + factor * av3
+
+
+def atr(high, low, close, period=14):
+    return smma(true_range(high, low, close), period)
+
+
+def rsi(close, period=14):
+    diff = close - shift(close)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = smma(np.maximum(diff, 0.0), period) / smma(np.maximum(-diff, 0.0), period)
+    return 100.0 - 100.0 / (1.0 + rs)
+
+
+def adx(high, low, close, period=14):
+    up, down = high - shift(high), shift(low) - low
+    plus_dm = np.where((up > down) & (up > 0.0), up, 0.0)
+    minus_dm = np.where((down > up) & (down > 0.0), down, 0.0)
+    plus_dm[0] = minus_dm[0] = np.nan
+    tr_avg = atr(high, low, close, period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        di_plus = 100.0 * smma(plus_dm, period) / tr_avg
+        di_minus = 100.0 * smma(minus_dm, period) / tr_avg
+        dx = np.abs(di_plus - di_minus) / (di_plus + di_minus)
+    return 100.0 * smma(dx, period)
+
+
+def rolling_quantiles(x, period, qs, chunk=4096):
+    """
+    最近 period 个有效值的分位数 (np.quantile 线性插值，同 RollingQuantile)。返回 len(qs) 行的数组。
+    NaN/inf 不计入窗口，这些 K 线沿用上一个窗口的结果；凑满 period 个有效值之前为 NaN。
+    """
+    out = np.full((len(qs), len(x)), np.nan)
+    valid = np.flatnonzero(np.isfinite(x))
+    if len(valid) < period: return out
+    windows = sliding_window_view(x[valid], period)
+    quantiles = np.empty((len(qs), len(windows)))
+    for lo in range(0, len(windows), chunk):
+        block = windows[lo:lo + chunk]
+        quantiles[:, lo:lo + len(block)] = np.quantile(block, qs, axis=1)
+    # 每根 K 线对应的窗口：截至该 K 线的最后一个有效值结束的那个窗口
+    pos = np.searchsorted(valid, np.arange(len(x)), side='right') - period
+    ready = pos >= 0
+    out[:, ready] = quantiles[:, pos[ready]]
+    return out
+
+
+# ==========================================
+# 【2. 成交模拟与结果】
+# ==========================================
+class Broker:
+    """BackBroker 的精简版，只支持市价单和按成交额百分比收取的手续费。"""
+    def __init__(self, opens, cash=START_CASH, commission=0.0):
+        self.opens = opens
+        self.cash = cash
+        self.commission = commission
+        self.positions = [0.0] * len(opens)
+        self.orders = []
+        self.fills = 0
+
+    def submit(self, asset, size, created_price):
+        if size: self.orders.append((asset, size, created_price))
+
+    def close(self, asset, created_price):
+        self.submit(asset, -self.positions[asset], created_price)
+
+    def value(self, prices):
+        return self.cash + sum(size * price for size, price in zip(self.positions, prices))
+
+    def _execute(self, cash, position, size, price, pseudo):
+        """先平仓后开仓。开仓后现金为负时开仓部分不成交；预演 (pseudo) 时把负的现金返回给提交检查。"""
+        closed = (size if abs(size) <= abs(position) else -position) if position * size < 0 else 0.0
+        opened = size - closed
+        if closed:
+            cash -= closed * price + abs(closed) * price * self.commission
+            position += closed
+        if opened:
+            open_cash = cash - opened * price - abs(opened) * price * self.commission
+            if open_cash >= 0.0:
+                cash, position = open_cash, position + opened
+            elif pseudo:
+                cash = open_cash
+        return cash, position
+
+    def process(self, t):
+        """第 t 根 K 线开始时：先做提交检查，再按开盘价成交上一根 K 线发出的订单。"""
+        if not self.orders: return
+        cash, positions, accepted = self.cash, list(self.positions), []
+        for asset, size, created_price in self.orders:
+            cash, positions[asset] = self._execute(cash, positions[asset], size, created_price, pseudo=True)
+            if cash >= 0.0: accepted.append((asset, size))
+        for asset, size in accepted:
+            before, price = self.positions[asset], float(self.opens[asset][t])
+            self.cash, self.positions[asset] = self._execute(self.cash, before, size, price, pseudo=False)
+            if self.positions[asset] != before: self.fills += 1
+        self.orders = []
+
+
+class BacktestResult:
+    def __init__(self, index, values, start_cash, fills):
+        self.index = index
+        self.values = values
+        self.start_cash = start_cash
+        self.fills = fills
+
+    @property
+    def final_value(self):
+        return float(self.values[-1]) if len(self.values) else self.start_cash
+
+    @property
+    def max_drawdown(self):
+        """最大回撤 (%)，同 DrawDown 分析器的 max.drawdown。"""
+        if not len(self.values): return 0.0
+        peak = np.maximum.accumulate(self.values)
+        return float((100.0 * (peak - self.values) / peak).max())
+
+    def returns(self, timeframe='years'):
+        """按自然日 / 自然年取期末账户价值计算的收益率序列，同 TimeReturn 分析器（首期以初始资金为基准）。"""
+        keys = self.index.year if timeframe == 'years' else self.index.normalize()
+        ends = np.r_[np.flatnonzero(keys[1:] != keys[:-1]), len(keys) - 1]
+        period_end = self.values[ends]
+        return pd.Series(period_end / np.r_[self.start_cash, period_end[:-1]] - 1.0, index=keys[ends])
+
+    def sharpe_ratio(self, timeframe='years', riskfreerate=0.01, annualize=False):
+        """同 SharpeRatio 分析器：年化无风险利率先折算到每期，总体标准差；无法计算时返回 None。"""
+        if not len(self.values): return None
+        factor = SHARPE_FACTORS[timeframe]
+        rate = pow(1.0 + riskfreerate, 1.0 / factor) - 1.0
+        excess = self.returns(timeframe).to_numpy() - rate
+        avg = math.fsum(excess) / len(excess)
+        dev = math.sqrt(math.fsum((excess - avg) ** 2) / len(excess))
+        if dev == 0: return None
+        return avg / dev * (math.sqrt(factor) if annualize else 1.0)
+
+
+def _arrays(df):
+    return (df[col].to_numpy(dtype=float) for col in ('open', 'high', 'low', 'close'))
+
+
+# ==========================================
+# 【3. 策略】 参数默认值与各脚本中的 backtrader 策略相同
+# 指标与交易模拟分开：*_indicators / *_signals 在整段行情上计算一次，simulate_* / run_long_flat 可以只模拟
+# window=(起, 止) 范围内的 K 线（新资金、空仓起步，订单仍按绝对位置成交），供走步优化在多个区间复用同一份指标。
+# ==========================================
+def _window(n, window):
+    return window if window is not None else (0, n)
+
+
+def run_long_flat(df, entry, exit, percents=50, commission=0.001, start_cash=START_CASH, window=None):
+    """
+    单标的多/空仓切换：空仓且 entry 为真时按当前现金的 percents% 买入 (PercentSizer)，
+    持仓且 exit 为真时全部平仓。
+    """
+    lo, hi = _window(len(df), window)
+    open_, _, _, close = _arrays(df)
+    broker = Broker([open_], start_cash, commission)
+    closes, entries, exits = close[lo:hi].tolist(), entry[lo:hi].tolist(), exit[lo:hi].tolist()
+    values = np.empty(hi - lo)
+    for i, price in enumerate(closes):
+        broker.process(lo + i)
+        position = broker.positions[0]
+        if not position and entries[i]:
+            broker.submit(0, broker.cash / price * (percents / 100), price)
+        elif position and exits[i]:
+            broker.close(0, price)
+        values[i] = broker.cash + broker.positions[0] * price
+    return BacktestResult(df.index[lo:hi], values, start_cash, broker.fills)
+
+
+def ma_cross_signals(df, fast=5, slow=30):
+    close = df['close'].to_numpy(dtype=float)
+    cross = crossover(sma(close, fast), sma(close, slow))
+    return cross > 0, cross < 0
+
+
+def run_ma_cross(df, fast=5, slow=30, **kwargs):
+    """MaCrossStrategy：快慢均线金叉买入、死叉平仓。"""
+    return run_long_flat(df, *ma_cross_signals(df, fast, slow), **kwargs)
+
+
+def run_ultimate(df, p1=7, p2=14, p3=28, low=30, high=70, **kwargs):
+    """UltimateStrategy：终极振荡器低于 low 买入、高于 high 平仓。"""
+    _, h, l, c = _arrays(df)
+    uo = ultimate_oscillator(h, l, c, p1, p2, p3)
+    return run_long_flat(df, uo < low, uo > high, **kwargs)
+
+
+def run_momentum(df, market_df, low=30, high=70, **kwargs):
+    """MomentumStrategy：终极振荡器超卖且大盘收涨时买入。大盘收盘价按目标标的的日期对齐。"""
+    _, h, l, c = _arrays(df)
+    uo = ultimate_oscillator(h, l, c)
+    market_close = market_df['close'].reindex(df.index).ffill().to_numpy(dtype=float)
+    return run_long_flat(df, (uo < low) & (market_close > shift(market_close)), uo > high, **kwargs)
+
+
+def multifactor_indicators(df, ema_long=200, adx_period=14, atr_period=14):
+    """返回 (EMA, ADX, RSI(14), ATR)。"""
+    _, h, l, c = _arrays(df)
+    return ema(c, ema_long), adx(h, l, c, adx_period), rsi(c, 14), atr(h, l, c, atr_period)
+
+
+def simulate_multifactor(df, indicators, adx_min=25, risk_percent=0.01, commission=0.0004, start_cash=START_CASH,
+                         window=None):
+    lo, hi = _window(len(df), window)
+    open_, _, _, c = _arrays(df)
+    ema_line, adx_line, rsi_line, atr_line = (line[lo:hi].tolist() for line in indicators)
+    broker = Broker([open_], start_cash, commission)
+    values = np.empty(hi - lo)
+    stop_price = highest_price = 0.0
+    for i, price in enumerate(c[lo:hi].tolist()):
+        broker.process(lo + i)
+        if not broker.positions[0]:
+            if price > ema_line[i] and adx_line[i] > adx_min and rsi_line[i] > 50:
+                stop_dist = atr_line[i] * 3.0
+                stop_price = price - stop_dist
+                size = broker.value((price,)) * risk_percent / stop_dist
+                max_size = (broker.cash * 0.95) / price
+                broker.submit(0, min(size, max_size), price)
+                highest_price = price
+        else:
+            highest_price = max(highest_price, price)
+            trailing_stop = highest_price - (atr_line[i] * 2.5)
+            if price < max(stop_price, trailing_stop) or price < ema_line[i]:
+                broker.close(0, price)
+        values[i] = broker.cash + broker.positions[0] * price
+    return BacktestResult(df.index[lo:hi], values, start_cash, broker.fills)
+
+
+def run_multifactor(df, ema_long=200, adx_period=14, adx_min=25, atr_period=14, risk_percent=0.01, **kwargs):
+    """ScientificMultiFactor：EMA/ADX/RSI 共振入场，按 ATR 风险定仓，初始止损 + 追踪止损 + 跌破均线离场。"""
+    indicators = multifactor_indicators(df, ema_long, adx_period, atr_period)
+    return simulate_multifactor(df, indicators, adx_min, risk_percent, **kwargs)
+
+
+def fee_aware_indicators(df_a, df_b, lookback=1000, q_entry=0.98, zscore_period=200):
+    """返回 (比价, z-score, 下分位, 中位数, 上分位)。"""
+    ratio = df_a['close'].to_numpy(dtype=float) / df_b['close'].to_numpy(dtype=float)
+    zscore = rolling_zscore(ratio, zscore_period)
+    return (ratio, zscore, *rolling_quantiles(zscore, lookback, [1 - q_entry, 0.5, q_entry]))
+
+
+def simulate_fee_aware(df_a, df_b, indicators, min_profit_pct=0.0025, portfolio_use_percent=0.2, commission=0.0004,
+                       start_cash=START_CASH, window=None):
+    lo, hi = _window(len(df_a), window)
+    open_a, _, _, close_a = _arrays(df_a)
+    open_b, _, _, close_b = _arrays(df_b)
+    ratios, zs, lower, median, upper = (line[lo:hi].tolist() for line in indicators)
+    ca, cb = close_a[lo:hi].tolist(), close_b[lo:hi].tolist()
+    broker = Broker([open_a, open_b], start_cash, commission)
+    values = np.empty(hi - lo)
+    level = side = 0
+    entry_ratio = 0.0
+    for i in range(hi - lo):
+        broker.process(lo + i)
+        if not math.isnan(upper[i]):  # 分位数窗口预热完成前不交易
+            z, pa, pb = zs[i], ca[i], cb[i]
+            value = broker.value((pa, pb))
+            size_a, size_b = value * portfolio_use_percent / pa, value * portfolio_use_percent / pb
+            if level == 0:
+                if z < lower[i] or z > upper[i]:
+                    side = 1 if z < lower[i] else -1
+                    broker.submit(0, side * size_a, pa)
+                    broker.submit(1, -side * size_b, pb)
+                    level, entry_ratio = 1, ratios[i]
+            else:
+                profit_pct = (ratios[i] / entry_ratio - 1) * side
+                regression = (side == 1 and z >= median[i]) or (side == -1 and z <= median[i])
+                if (regression and profit_pct > min_profit_pct) or abs(z) > 5.0:
+                    broker.close(0, pa)
+                    broker.close(1, pb)
+                    level = side = 0
+        values[i] = broker.value((ca[i], cb[i]))
+    return BacktestResult(df_a.index[lo:hi], values, start_cash, broker.fills)
+
+
+def run_fee_aware(df_a, df_b, lookback=1000, q_entry=0.98, min_profit_pct=0.0025, zscore_period=200, **kwargs):
+    """FeeAwareDynamicStrategy：比价 z-score 突破滚动分位数时配对开仓，均值回归且利润覆盖门槛（或 |z|>5）时平仓。"""
+    indicators = fee_aware_indicators(df_a, df_b, lookback, q_entry, zscore_period)
+    return simulate_fee_aware(df_a, df_b, indicators, min_profit_pct, **kwargs)
@@ -0,0 +1,174 @@
+"""
+走步优化 (walk-forward)：把行情切成滚动的 训练 / 测试 区间，在每个训练区间上并行搜索最优参数，
+再用这组参数跑紧随其后的测试区间，最后把各测试区间的样本外资金曲线首尾相接。
+
+用法:
+    python walk_forward.py <策略> [训练长度] [测试长度] [排序指标]
+    python walk_forward.py ma 24M 6M
+    python walk_forward.py multi 6M 2M cagr
+    python walk_forward.py hf 3D 1D final_value
+
+长度写法: 数字 + D/W/M/Y (天 / 周 / 月 / 年)。步长等于测试长度，测试区间互不重叠。
+参数网格与固定参数沿用 param_sweep.py；行情区间见 WALK_FORWARD。
+
+指标在整段行情上按每组参数只计算一次（工作进程内缓存），各训练 / 测试区间只重新模拟成交，
+因此区间开头的指标已经用之前的行情预热，不会因为切分而丢掉预热期。
+每个测试区间以上一个测试区间的期末资产作为初始资金、空仓起步（相当于按收盘价平仓，不计这笔手续费）。
+"""
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import vector_backtest as vb
+from param_sweep import (SEARCH_SPACES, STRATEGIES, grid_points, load_frames, objective, prepare_data,
+                         result_metrics)
+
+# 每个策略: 行情、默认训练 / 测试长度和排序指标
+WALK_FORWARD = {
+    'ma': dict(data=[('binance', 'BTCUSDT', '1d', '2020-06-01', '2025-12-31')], train='24M', test='6M',
+               sort_by='sharpe'),
+    'multi': dict(data=[('binance', 'BTCUSDT', '1h', '2024-01-01', '2026-01-01')], train='6M', test='2M',
+                  sort_by='cagr'),
+    'hf': dict(data=STRATEGIES['hf']['data'], train='3D', test='1D', sort_by='final_value'),
+}
+
+# 参数拆成两部分：决定指标的参数（缓存键）和只影响交易规则的参数
+INDICATOR_PARAMS = {
+    'ma': ('fast', 'slow'),
+    'multi': ('ema_long', 'adx_period', 'atr_period'),
+    'hf': ('lookback', 'q_entry', 'zscore_period'),
+}
+INDICATORS = {
+    'ma': vb.ma_cross_signals,
+    'multi': vb.multifactor_indicators,
+    'hf': vb.fee_aware_indicators,
+}
+SIMULATORS = {
+    'ma': lambda df, signals, **kwargs: vb.run_long_flat(df, *signals, **kwargs),
+    'multi': vb.simulate_multifactor,
+    'hf': vb.simulate_fee_aware,
+}
+
+
+def parse_period(text):
+    """'24M' / '2Y' / '3D' / '1W' 转为 pd.DateOffset。"""
+    match = re.fullmatch(r'(\d+)([DWMY])', text.upper())
+    if not match: raise ValueError(f"无法识别的区间长度: {text}")
+    unit = {'D': 'days', 'W': 'weeks', 'M': 'months', 'Y': 'years'}[match.group(2)]
+    return pd.DateOffset(**{unit: int(match.group(1))})
+
+
+def make_folds(index, train, test):
+    """
+    返回 [(train_lo, train_hi, test_hi), ...]（K 线位置，训练区间 [train_lo, train_hi)，测试区间 [train_hi, test_hi)）。
+    训练区间按测试长度向后滚动；最后一个测试区间可以不满一个完整长度。
+    """
+    train, test = parse_period(train), parse_period(test)
+    folds, start = [], index[0]
+    while True:
+        train_end = start + train
+        lo, mid, hi = index.searchsorted([start, train_end, train_end + test])
+        if mid >= len(index): break
+        folds.append((int(lo), int(mid), int(hi)))
+        start = start + test
+    return folds
+
+
+class IndicatorCache:
+    """按指标参数缓存整段行情上的指标，不同区间、不同交易参数共用。"""
+    def __init__(self, strategy, frames):
+        self.strategy = strategy
+        self.frames = frames
+        self.cache = {}
+
+    def split(self, params):
+        names = INDICATOR_PARAMS[self.strategy]
+        return ({k: v for k, v in params.items() if k in names}, {k: v for k, v in params.items() if k not in names})
+
+    def simulate(self, params, window, start_cash=vb.START_CASH):
+        indicator_params, trade_params = self.split(params)
+        key = tuple(sorted(indicator_params.items()))
+        if key not in self.cache: self.cache[key] = INDICATORS[self.strategy](*self.frames, **indicator_params)
+        return SIMULATORS[self.strategy](*self.frames, self.cache[key], **STRATEGIES[self.strategy]['kwargs'],
+                                         **trade_params, start_cash=start_cash, window=window)
+
+
+_worker = {}
+
+
+def _init_worker(strategy, specs, folds):
+    _worker.update(strategy=strategy, folds=folds, indicators=IndicatorCache(strategy, load_frames(specs)))
+
+
+def _train_task(params):
+    """一组参数在所有训练区间上的表现（指标只算一次）。"""
+    riskfreerate = STRATEGIES[_worker['strategy']]['riskfreerate']
+    rows = []
+    for lo, mid, _ in _worker['folds']:
+        try:
+            rows.append(result_metrics(_worker['indicators'].simulate(params, (lo, mid)), riskfreerate))
+        except Exception as e:  # 某组参数出错只影响它自己
+            rows.append({'error': f"{type(e).__name__}: {e}"})
+    return rows
+
+
+def walk_forward(strategy, train=None, test=None, sort_by=None, space=None, workers=None):
+    """
+    运行走步优化，返回 (每个区间的报告 DataFrame, 拼接后的样本外 BacktestResult)。
+    报告包含训练 / 测试区间、选中的参数、训练区间的排序指标和测试区间的最终资产、年化收益、夏普、回撤。
+    """
+    config = WALK_FORWARD[strategy]
+    train, test = train or config['train'], test or config['test']
+    sort_by = sort_by or config['sort_by']
+    points = grid_points(space or SEARCH_SPACES[strategy]['grid'])
+    prepare_data(config['data'])
+    cache = IndicatorCache(strategy, load_frames(config['data']))
+    index = cache.frames[0].index
+    folds = make_folds(index, train, test)
+    if not folds: raise ValueError(f"行情长度不足一个训练区间 ({train}) 加测试区间")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(strategy, config['data'], folds)) as executor:
+        train_rows = list(executor.map(_train_task, points, chunksize=max(1, len(points) // 64)))
+
+    report, curves, capital, fills = [], [], vb.START_CASH, 0
+    riskfreerate = STRATEGIES[strategy]['riskfreerate']
+    for f, (lo, mid, hi) in enumerate(folds):
+        scores = [objective(rows[f], sort_by) for rows in train_rows]
+        best = points[int(np.argmax(scores))]
+        result = cache.simulate(best, (mid, hi), start_cash=capital)
+        test_metrics = result_metrics(result, riskfreerate)
+        report.append(dict(train_start=index[lo], train_end=index[mid - 1], test_start=index[mid],
+                           test_end=index[hi - 1], **best, **{f'train_{sort_by}': scores[int(np.argmax(scores))]},
+                           **{f'test_{k}': v for k, v in test_metrics.items()}))
+        curves.append(result.values)
+        capital, fills = result.final_value, fills + result.fills
+
+    oos_index = index[folds[0][1]:folds[-1][2]]
+    oos = vb.BacktestResult(oos_index, np.concatenate(curves), vb.START_CASH, fills)
+    return pd.DataFrame(report), oos
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in WALK_FORWARD:
+        print(__doc__)
+        sys.exit(1)
+    strategy = sys.argv[1]
+    args = sys.argv[2:] + [None] * (3 - len(sys.argv[2:]))
+
+    start = time.perf_counter()
+    report, oos = walk_forward(strategy, *args[:3])
+    elapsed = time.perf_counter() - start
+    print(report.to_string(float_format=lambda v: f"{v:,.4f}"))
+    metrics = result_metrics(oos, STRATEGIES[strategy]['riskfreerate'])
+    print(f"\n样本外 {oos.index[0]} ~ {oos.index[-1]} ({len(report)} 个区间, 耗时 {elapsed:.1f}s)")
+    print(f" • 最终资产 : {metrics['final_value']:,.2f}   年化收益率 : {metrics['cagr']:.2f}%")
+    print(f" • 夏普比率 : {metrics['sharpe'] if metrics['sharpe'] is None else round(metrics['sharpe'], 2)}"
+          f"   最大回撤 : {metrics['max_drawdown']:.2f}%")
+    oos_file = f"walk_forward_{strategy}.csv"
+    pd.Series(oos.values, index=oos.index, name='value').to_csv(oos_file)
+    print(f" • 样本外资金曲线已保存到 {oos_file}")